@@ -1,30 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from sqlalchemy.exc import ProgrammingError
 
 from app.models.database import get_db
 from app.models.models import Alert as AlertModel
 from app.schemas.schemas import Alert, AlertCreate, AlertUpdate
 from app.api.auth import get_current_user
+from app.api.pagination import decode_id_cursor, set_next_cursor
 
 router = APIRouter()
 
 @router.get("/", response_model=List[Alert])
 def get_alerts(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     is_active: bool = None,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
+    """Alerts ordered by id; pass X-Next-Cursor back as cursor for the next page (skip is legacy)"""
+    after_id = decode_id_cursor(cursor)
     try:
         query = db.query(AlertModel).filter(AlertModel.user_id == current_user.id)
 
         if is_active is not None:
             query = query.filter(AlertModel.is_active == is_active)
 
-        return query.offset(skip).limit(limit).all()
+        if after_id is not None:
+            query = query.filter(AlertModel.id > after_id)
+        elif skip:
+            query = query.offset(skip)
+
+        alerts = query.order_by(AlertModel.id).limit(limit).all()
+        set_next_cursor(response, alerts, limit, lambda alert: {"id": alert.id})
+        return alerts
     except ProgrammingError as e:
         msg = str(e.orig) if getattr(e, "orig", None) else str(e)
         raise HTTPException(
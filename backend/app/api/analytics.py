@@ -2,7 +2,7 @@
 Analytics API endpoints for price statistics, histograms, and trends.
 Optimized for large-scale data (10k products × 20 sources).
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, desc
 from typing import List, Optional
@@ -10,47 +10,118 @@ from datetime import datetime, timedelta, date
 
 from app.models.database import get_db
 from app.models.models import (
-    Product, ProductSource, PriceHistory, 
-    DailyPriceStats, SourceDailyStats
+    Product, ProductSource, PriceHistory, Source,
+    DailyPriceStats, SourceDailyStats, ProductSourcePriceChange,
+    PriceStatsRollup, SourceStatsRollup
 )
 from app.api.auth import get_current_user
+from app.api.conditional import cached, conditional
+from app.services.price_sketches import merge_sketches
+from app.services import price_cube, response_cache
 
 router = APIRouter()
 
+# Approximate days per point of each resolution, finest first
+RESOLUTION_DAYS = {"day": 1, "week": 7, "month": 30}
+
+
+def _pick_resolution(days: int, max_points: int, requested: str) -> str:
+    """Finest resolution whose number of points fits into max_points"""
+    if requested != "auto":
+        return requested
+    for resolution, step in RESOLUTION_DAYS.items():
+        if days / step <= max_points:
+            return resolution
+    return "month"
+
+
+def _period_start(day: date, resolution: str) -> date:
+    if resolution == "week":
+        return day - timedelta(days=day.weekday())
+    if resolution == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _get_cube() -> price_cube.PriceCube:
+    cube = price_cube.get_cube()
+    if cube is None or cube.last_day is None:
+        raise HTTPException(
+            status_code=503,
+            detail={"error": "price_cube_not_built", "message": "Run rebuild_price_cube or calculate_daily_stats first"}
+        )
+    return cube
+
+
+def _with_product_names(db: Session, rows: List[dict]) -> List[dict]:
+    names = dict(db.query(Product.id, Product.name).filter(
+        Product.id.in_([row["product_id"] for row in rows])
+    ).all()) if rows else {}
+    return [{**row, "product_name": names.get(row["product_id"])} for row in rows]
+
 @router.get("/product/{product_id}/price-histogram")
 def get_price_histogram(
+    request: Request,
+    response: Response,
     product_id: int,
-    days: int = Query(30, ge=1, le=365),
+    days: int = Query(30, ge=1, le=1825),
+    resolution: str = Query("auto", pattern="^(auto|day|week|month)$"),
+    max_points: int = Query(120, ge=10, le=1000),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """
     Get price histogram for a product over time.
-    Uses pre-calculated daily_price_stats for fast queries.
+    Uses pre-calculated daily_price_stats, or the weekly/monthly rollups when
+    the range does not fit into max_points daily points (resolution=auto).
     """
+    return cached(request, response, response_cache.get_entry(
+        "analytics.price_histogram",
+        {"product_id": product_id, "days": days, "resolution": resolution, "max_points": max_points},
+        ("stats", "prices"),  # Today's row is kept current by the result writer
+        lambda session: _price_histogram(session, product_id, days, resolution, max_points),
+        db=db
+    ))
+
+
+def _price_histogram(db: Session, product_id: int, days: int, resolution: str, max_points: int) -> dict:
     product = db.query(Product).filter(Product.id == product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Get daily stats (fast query on aggregated data)
+    # Daily rows or rollups (fast queries on aggregated data)
     end_date = date.today()
     start_date = end_date - timedelta(days=days)
+    resolution = _pick_resolution(days, max_points, resolution)
     
-    daily_stats = db.query(DailyPriceStats).filter(
-        and_(
-            DailyPriceStats.product_id == product_id,
-            DailyPriceStats.date >= start_date,
-            DailyPriceStats.date <= end_date
-        )
-    ).order_by(DailyPriceStats.date).all()
+    if resolution == "day":
+        daily_stats = db.query(DailyPriceStats).filter(
+            and_(
+                DailyPriceStats.product_id == product_id,
+                DailyPriceStats.date >= start_date,
+                DailyPriceStats.date <= end_date
+            )
+        ).order_by(DailyPriceStats.date).all()
+        points = [(stat.date, stat) for stat in daily_stats]
+    else:
+        rollups = db.query(PriceStatsRollup).filter(
+            and_(
+                PriceStatsRollup.product_id == product_id,
+                PriceStatsRollup.resolution == resolution,
+                PriceStatsRollup.period_start >= _period_start(start_date, resolution),
+                PriceStatsRollup.period_start <= end_date
+            )
+        ).order_by(PriceStatsRollup.period_start).all()
+        points = [(stat.period_start, stat) for stat in rollups]
     
     return {
         "product_id": product_id,
         "product_name": product.name,
         "period_days": days,
+        "resolution": resolution,
         "data": [
             {
-                "date": str(stat.date),
+                "date": str(point_date),
                 "min_price": float(stat.min_price) if stat.min_price else None,
                 "max_price": float(stat.max_price) if stat.max_price else None,
                 "avg_price": float(stat.avg_price) if stat.avg_price else None,
@@ -59,12 +130,53 @@ def get_price_histogram(
                 "sources_available": stat.sources_available,
                 "best_price": float(stat.best_price) if stat.best_price else None,
             }
-            for stat in daily_stats
+            for point_date, stat in points
         ]
     }
 
 
-@router.get("/product/{product_id}/price-changes")
+@router.get("/product/{product_id}/price-quantiles", dependencies=[Depends(conditional("prices"))])
+def get_price_quantiles(
+    product_id: int,
+    days: int = Query(30, ge=1, le=365),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Price distribution of a product over a period (e.g. week/month).
+    Merges the stored per-day sketches instead of scanning price_history.
+    Quantiles are exact (as percentile_cont) up to 100 observations and
+    t-digest approximations beyond.
+    """
+    product = db.query(Product).filter(Product.id == product_id).first()
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    end_date = date.today()
+    start_date = end_date - timedelta(days=days)
+    
+    sketch = merge_sketches(db, [product_id], start_date, end_date).get(product_id)
+    if not sketch:
+        return {"product_id": product_id, "period_days": days, "count": 0}
+    
+    return {
+        "product_id": product_id,
+        "product_name": product.name,
+        "period_days": days,
+        "count": sketch.count,
+        "min_price": sketch.min_price,
+        "max_price": sketch.max_price,
+        "avg_price": sketch.avg_price,
+        "quantiles": {
+            f"p{int(q * 100)}": sketch.quantile(q)
+            for q in (0.1, 0.25, 0.5, 0.75, 0.9)
+        },
+        "best_price": sketch.best_price,
+        "best_source_id": sketch.best_source_id,
+    }
+
+
+@router.get("/product/{product_id}/price-changes", dependencies=[Depends(conditional("prices", "stats"))])
 def get_price_changes(
     product_id: int,
     days: int = Query(7, ge=1, le=90),
@@ -111,7 +223,7 @@ def get_price_changes(
     }
 
 
-@router.get("/product/{product_id}/source-comparison")
+@router.get("/product/{product_id}/source-comparison", dependencies=[Depends(conditional("catalog", "prices", "stats"))])
 def get_source_comparison(
     product_id: int,
     db: Session = Depends(get_db),
@@ -125,8 +237,16 @@ def get_source_comparison(
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Get all product sources with current prices
-    product_sources = db.query(ProductSource).filter(
+    # Active mappings with their precomputed current price and 1d/7d/30d changes
+    rows = db.query(ProductSource, Source.name, ProductSourcePriceChange).outerjoin(
+        Source, Source.id == ProductSource.source_id
+    ).outerjoin(
+        ProductSourcePriceChange,
+        and_(
+            ProductSourcePriceChange.product_id == ProductSource.product_id,
+            ProductSourcePriceChange.source_id == ProductSource.source_id
+        )
+    ).filter(
         and_(
             ProductSource.product_id == product_id,
             ProductSource.is_active == True
@@ -134,20 +254,16 @@ def get_source_comparison(
     ).all()
     
     comparison = []
-    for ps in product_sources:
-        # Get source info
-        from app.models.models import Source
-        source = db.query(Source).filter(Source.id == ps.source_id).first()
-        
+    for ps, source_name, changes in rows:
         comparison.append({
             "source_id": ps.source_id,
-            "source_name": source.name if source else "Unknown",
+            "source_name": source_name or "Unknown",
             "current_price": ps.last_price,
-            "availability": ps.last_availability,
+            "availability": changes.current_availability if changes else None,
             "last_checked": ps.last_checked,
-            "price_change_1d": ps.price_change_1d,
-            "price_change_7d": ps.price_change_7d,
-            "price_change_30d": ps.price_change_30d,
+            "price_change_1d": changes.price_change_1d if changes else None,
+            "price_change_7d": changes.price_change_7d if changes else None,
+            "price_change_30d": changes.price_change_30d if changes else None,
             "url": ps.source_url
         })
     
@@ -163,8 +279,71 @@ def get_source_comparison(
     }
 
 
+@router.get("/catalog/movers", dependencies=[Depends(conditional("catalog", "stats"))])
+def get_catalog_movers(
+    days: int = Query(7, ge=1, le=365),
+    category: Optional[str] = None,
+    direction: str = Query("down", pattern="^(down|up)$"),
+    metric: str = Query("avg_price", pattern="^(min_price|avg_price|max_price|best_price)$"),
+    limit: int = Query(20, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Biggest price drops (or rises) across the catalog over the last days.
+    Answered from the in-memory price cube.
+    """
+    cube = _get_cube()
+    return {
+        "period_days": days,
+        "last_day": str(cube.last_day),
+        "category": category,
+        "direction": direction,
+        "metric": metric,
+        "data": _with_product_names(db, cube.movers(days, metric, category, direction, limit))
+    }
+
+
+@router.get("/catalog/dispersion", dependencies=[Depends(conditional("catalog", "stats"))])
+def get_catalog_dispersion(
+    day: Optional[date] = None,
+    category: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """Price spread between sources per product, (max - min) / avg, from the price cube"""
+    cube = _get_cube()
+    day = day or cube.last_day
+    if not 0 <= cube.day_index(day) <= cube.day_index(cube.last_day):
+        raise HTTPException(status_code=400, detail="Day outside of the price cube window")
+    
+    dispersion = cube.dispersion(day, category, limit)
+    dispersion["top"] = _with_product_names(db, dispersion["top"])
+    return {"date": str(day), "category": category, **dispersion}
+
+
+@router.get("/catalog/price-index", dependencies=[Depends(conditional("stats"))])
+def get_catalog_price_index(
+    days: int = Query(90, ge=1, le=365),
+    category: Optional[str] = None,
+    metric: str = Query("avg_price", pattern="^(min_price|avg_price|max_price|best_price)$"),
+    current_user = Depends(get_current_user)
+):
+    """Chain-linked catalog price index (base 100 at the start of the period), from the price cube"""
+    cube = _get_cube()
+    return {
+        "period_days": days,
+        "category": category,
+        "metric": metric,
+        "data": cube.index(days, metric, category)
+    }
+
+
 @router.get("/dashboard/overview")
 def get_dashboard_overview(
+    request: Request,
+    response: Response,
     days: int = Query(7, ge=1, le=90),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
@@ -173,6 +352,14 @@ def get_dashboard_overview(
     Get comprehensive dashboard overview.
     Optimized for large datasets.
     """
+    return cached(request, response, response_cache.get_entry(
+        "analytics.dashboard_overview", {"days": days}, ("catalog", "prices", "stats"),
+        lambda session: _dashboard_overview(session, days),
+        db=db
+    ))
+
+
+def _dashboard_overview(db: Session, days: int) -> dict:
     # Product stats
     total_products = db.query(func.count(Product.id)).filter(Product.is_active == True).scalar()
     
@@ -181,10 +368,10 @@ def get_dashboard_overview(
         ProductSource.is_active == True
     ).scalar()
     
-    # Recent price checks (from last 24 hours)
+    # Recent price checks (from last 24 hours) - rows whose validity interval reaches into the window
     yesterday = datetime.utcnow() - timedelta(days=1)
     recent_checks = db.query(func.count(PriceHistory.id)).filter(
-        PriceHistory.checked_at >= yesterday
+        PriceHistory.last_seen_at >= yesterday
     ).scalar()
     
     # Price trends (from daily_price_stats)
@@ -262,37 +449,65 @@ def get_dashboard_overview(
 
 @router.get("/source/{source_id}/performance")
 def get_source_performance(
+    request: Request,
+    response: Response,
     source_id: int,
-    days: int = Query(30, ge=1, le=365),
+    days: int = Query(30, ge=1, le=1825),
+    resolution: str = Query("auto", pattern="^(auto|day|week|month)$"),
+    max_points: int = Query(120, ge=10, le=1000),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """
     Get source performance metrics over time.
+    Long ranges are served from the weekly/monthly rollups (resolution=auto).
     """
-    from app.models.models import Source
+    return cached(request, response, response_cache.get_entry(
+        "analytics.source_performance",
+        {"source_id": source_id, "days": days, "resolution": resolution, "max_points": max_points},
+        ("stats",),
+        lambda session: _source_performance(session, source_id, days, resolution, max_points),
+        db=db
+    ))
+
+
+def _source_performance(db: Session, source_id: int, days: int, resolution: str, max_points: int) -> dict:
     source = db.query(Source).filter(Source.id == source_id).first()
     if not source:
         raise HTTPException(status_code=404, detail="Source not found")
     
     end_date = date.today()
     start_date = end_date - timedelta(days=days)
+    resolution = _pick_resolution(days, max_points, resolution)
     
-    daily_stats = db.query(SourceDailyStats).filter(
-        and_(
-            SourceDailyStats.source_id == source_id,
-            SourceDailyStats.date >= start_date,
-            SourceDailyStats.date <= end_date
-        )
-    ).order_by(SourceDailyStats.date).all()
+    if resolution == "day":
+        daily_stats = db.query(SourceDailyStats).filter(
+            and_(
+                SourceDailyStats.source_id == source_id,
+                SourceDailyStats.date >= start_date,
+                SourceDailyStats.date <= end_date
+            )
+        ).order_by(SourceDailyStats.date).all()
+        points = [(stat.date, stat) for stat in daily_stats]
+    else:
+        rollups = db.query(SourceStatsRollup).filter(
+            and_(
+                SourceStatsRollup.source_id == source_id,
+                SourceStatsRollup.resolution == resolution,
+                SourceStatsRollup.period_start >= _period_start(start_date, resolution),
+                SourceStatsRollup.period_start <= end_date
+            )
+        ).order_by(SourceStatsRollup.period_start).all()
+        points = [(stat.period_start, stat) for stat in rollups]
     
     return {
         "source_id": source_id,
         "source_name": source.name,
         "period_days": days,
+        "resolution": resolution,
         "performance": [
             {
-                "date": str(stat.date),
+                "date": str(point_date),
                 "products_scraped": stat.products_scraped,
                 "successful_scrapes": stat.successful_scrapes,
                 "failed_scrapes": stat.failed_scrapes,
@@ -300,6 +515,6 @@ def get_source_performance(
                 "avg_price_change": stat.avg_price_change,
                 "products_unavailable": stat.products_unavailable,
             }
-            for stat in daily_stats
+            for point_date, stat in points
         ]
     }
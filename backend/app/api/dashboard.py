@@ -1,18 +1,26 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_
 from datetime import datetime, timedelta
 from typing import List
 
 from app.models.database import get_db
-from app.models.models import Product, Source, PriceHistory, ScrapeJob
+from app.models.models import Product, Source, PriceHistory, ScrapeJob, CurrentPrice
 from app.schemas.schemas import DashboardStats, PriceAlert
 from app.api.auth import get_current_user
+from app.api.conditional import cached, conditional
+from app.services import response_cache
 
 router = APIRouter()
 
 @router.get("/stats", response_model=DashboardStats)
-def get_dashboard_stats(db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+def get_dashboard_stats(request: Request, response: Response, db: Session = Depends(get_db),
+                        current_user = Depends(get_current_user)):
+    return cached(request, response, response_cache.get_entry(
+        "dashboard.stats", {}, ("catalog", "prices"), _dashboard_stats, db=db
+    ))
+
+def _dashboard_stats(db: Session) -> DashboardStats:
     # Total and active products
     total_products = db.query(func.count(Product.id)).scalar()
     active_products = db.query(func.count(Product.id)).filter(Product.is_active == True).scalar()
@@ -24,7 +32,7 @@ def get_dashboard_stats(db: Session = Depends(get_db), current_user = Depends(ge
     # Price checks today
     today = datetime.utcnow().date()
     price_checks_today = db.query(func.count(PriceHistory.id)).filter(
-        func.date(PriceHistory.checked_at) == today
+        PriceHistory.last_seen_at >= datetime.combine(today, datetime.min.time())
     ).scalar()
     
     # Products with price changes (simplified - compare today vs yesterday)
@@ -48,45 +56,42 @@ def get_dashboard_stats(db: Session = Depends(get_db), current_user = Depends(ge
         average_price_change=average_price_change
     )
 
-@router.get("/recent-alerts", response_model=List[PriceAlert])
+@router.get("/recent-alerts", response_model=List[PriceAlert], dependencies=[Depends(conditional("catalog", "prices"))])
 def get_recent_alerts(
     limit: int = 10,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
-    # Get recent significant price changes
-    # This is a simplified version - you'd want to track actual alerts
+    # Get recent significant price changes (> 5%) from the current prices table
     recent_changes = []
     
     try:
-        # Query for products with recent price changes
         seven_days_ago = datetime.utcnow() - timedelta(days=7)
+        change_percent = (CurrentPrice.price - CurrentPrice.previous_price) / CurrentPrice.previous_price * 100
         
-        products = db.query(Product).filter(Product.is_active == True).limit(limit).all()
+        changes = db.query(
+            CurrentPrice, Product.name, Source.name.label("source_name")
+        ).join(Product, CurrentPrice.product_id == Product.id).join(
+            Source, CurrentPrice.source_id == Source.id
+        ).filter(
+            Product.is_active == True,
+            CurrentPrice.price_changed_at >= seven_days_ago,
+            CurrentPrice.previous_price > 0,
+            func.abs(change_percent) > 5
+        ).order_by(CurrentPrice.price_changed_at.desc()).limit(limit).all()
         
-        for product in products:
-            # Get latest and previous price for comparison
-            latest_prices = db.query(PriceHistory).filter(
-                PriceHistory.product_id == product.id,
-                PriceHistory.checked_at >= seven_days_ago
-            ).order_by(PriceHistory.checked_at.desc()).limit(2).all()
-            
-            if len(latest_prices) >= 2:
-                new_price = float(latest_prices[0].price)
-                old_price = float(latest_prices[1].price)
-                change_percent = ((new_price - old_price) / old_price) * 100 if old_price > 0 else 0
-                
-                if abs(change_percent) > 5:  # Only show changes > 5%
-                    source = db.query(Source).filter(Source.id == latest_prices[0].source_id).first()
-                    recent_changes.append(PriceAlert(
-                        product_id=product.id,
-                        product_name=product.name,
-                        source_name=source.name if source else "Unknown",
-                        old_price=old_price,
-                        new_price=new_price,
-                        change_percent=round(change_percent, 2),
-                        checked_at=latest_prices[0].checked_at
-                    ))
+        for current_price, product_name, source_name in changes:
+            new_price = float(current_price.price)
+            old_price = float(current_price.previous_price)
+            recent_changes.append(PriceAlert(
+                product_id=current_price.product_id,
+                product_name=product_name,
+                source_name=source_name,
+                old_price=old_price,
+                new_price=new_price,
+                change_percent=round((new_price - old_price) / old_price * 100, 2),
+                checked_at=current_price.price_changed_at
+            ))
     except Exception as e:
         print(f"Error getting recent alerts: {e}")
         # Return empty list instead of crashing
@@ -122,3 +127,8 @@ def get_scraping_status(db: Session = Depends(get_db), current_user = Depends(ge
             for job in recent_jobs
         ]
     }
+
+@router.get("/cache-stats")
+def get_cache_stats(current_user = Depends(get_current_user)):
+    """Response cache hit/miss counters"""
+    return response_cache.stats()
@@ -0,0 +1,69 @@
+"""
+Keyset (cursor) pagination helpers.
+
+A cursor is the sort key of the last row of a page, JSON encoded and
+base64url wrapped so clients treat it as opaque. List endpoints keep
+returning plain arrays; the cursor of the next page is sent in the
+X-Next-Cursor header and is absent on the last page. skip/limit paging is
+still accepted for backward compatibility.
+"""
+from fastapi import HTTPException, Response
+from datetime import datetime
+from typing import Any, Dict, Optional
+import base64
+import json
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(key: Dict[str, Any]) -> str:
+    data = json.dumps(key, default=lambda v: v.isoformat(), separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(key, dict):
+            raise ValueError(cursor)
+        return key
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail={"error": "invalid_cursor", "cursor": cursor})
+
+
+def decode_id_cursor(cursor: Optional[str]) -> Optional[int]:
+    """Last id of the previous page, for endpoints ordered by id"""
+    if cursor is None:
+        return None
+    key = decode_cursor(cursor)
+    if not isinstance(key.get("id"), int):
+        raise HTTPException(status_code=400, detail={"error": "invalid_cursor", "cursor": cursor})
+    return key["id"]
+
+
+def decode_offset_cursor(cursor: Optional[str]) -> Optional[int]:
+    """Position of the next row, for ranked results without a unique sort key"""
+    if cursor is None:
+        return None
+    key = decode_cursor(cursor)
+    if not isinstance(key.get("offset"), int) or key["offset"] < 0:
+        raise HTTPException(status_code=400, detail={"error": "invalid_cursor", "cursor": cursor})
+    return key["offset"]
+
+
+def decode_time_cursor(cursor: Optional[str]):
+    """(checked_at, id) of the last row of the previous page"""
+    if cursor is None:
+        return None
+    key = decode_cursor(cursor)
+    try:
+        return datetime.fromisoformat(key["checked_at"]), int(key["id"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail={"error": "invalid_cursor", "cursor": cursor})
+
+
+def set_next_cursor(response: Response, rows: list, limit: int, key):
+    """Send the cursor after the last row when the page is full"""
+    if rows and len(rows) >= limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(key(rows[-1]))
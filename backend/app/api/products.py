@@ -1,90 +1,180 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, tuple_
 from typing import List, Optional
 from datetime import datetime, timedelta
+import json
 
-from app.models.database import get_db
-from app.models.models import Product as ProductModel, PriceHistory, ProductSource, Source
+from app.models.database import SessionLocal, get_db
+from app.models.models import Product as ProductModel, PriceObservation, ProductSource, Source, CurrentPrice
 from app.schemas.schemas import Product, ProductCreate, ProductUpdate, ProductWithPrices, BulkProductImport
 from app.api.auth import get_current_user
+from app.api.conditional import conditional
+from app.api.pagination import decode_id_cursor, decode_offset_cursor, decode_time_cursor, set_next_cursor
+from app.services import price_archive, product_facets, product_search, product_suggest, response_cache
 from sqlalchemy.exc import SQLAlchemyError
 from decimal import Decimal
 
 router = APIRouter()
 
-@router.get("/", response_model=List[ProductWithPrices])
+STREAM_BATCH_SIZE = 1000
+
+def _current_prices(db: Session, product_ids: List[int]) -> dict:
+    """Current price per source for each product, newest first, in one query"""
+    rows = db.query(
+        CurrentPrice.product_id,
+        CurrentPrice.source_id,
+        CurrentPrice.price,
+        CurrentPrice.checked_at,
+        Source.name
+    ).join(Source, CurrentPrice.source_id == Source.id).filter(
+        CurrentPrice.product_id.in_(product_ids)
+    ).order_by(CurrentPrice.product_id, desc(CurrentPrice.checked_at)).all()
+    
+    prices = {}
+    for row in rows:
+        prices.setdefault(row.product_id, []).append({
+            "source_id": row.source_id,
+            "source_name": row.name,
+            "price": float(row.price) if row.price else None,
+            "checked_at": row.checked_at
+        })
+    return prices
+
+def _with_prices(product: ProductModel, current_prices: list) -> ProductWithPrices:
+    """Response model of a product with its current prices and price statistics"""
+    prices = [p["price"] for p in current_prices if p["price"] is not None]
+    return ProductWithPrices.model_validate(product).model_copy(update={
+        "current_prices": current_prices,
+        "min_price": min(prices) if prices else None,
+        "max_price": max(prices) if prices else None,
+        "avg_price": sum(prices) / len(prices) if prices else None,
+        "price_trend": "stable"  # Could be calculated from history
+    })
+
+@router.get("/", response_model=List[ProductWithPrices], dependencies=[Depends(conditional("catalog", "prices"))])
 def get_products(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     search: Optional[str] = None,
     category: Optional[str] = None,
     is_active: Optional[bool] = None,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
+    """
+    Products ordered by id, or by relevance when searching; pass X-Next-Cursor
+    back as cursor for the next page (skip is legacy)
+    """
     query = db.query(ProductModel)
     
-    if search:
-        query = query.filter(
-            (ProductModel.name.ilike(f"%{search}%")) |
-            (ProductModel.sku.ilike(f"%{search}%")) |
-            (ProductModel.ean.ilike(f"%{search}%"))
-        )
-    
     if category:
         query = query.filter(ProductModel.category == category)
     
     if is_active is not None:
         query = query.filter(ProductModel.is_active == is_active)
     
-    products = query.offset(skip).limit(limit).all()
-    
-    # Enrich with current prices (safe mode - handle empty tables)
-    result = []
-    for product in products:
-        try:
-            # Get latest prices from each source
-            latest_prices = db.query(
-                PriceHistory.source_id,
-                PriceHistory.price,
-                PriceHistory.checked_at,
-                Source.name
-            ).join(Source, PriceHistory.source_id == Source.id).filter(
-                PriceHistory.product_id == product.id
-            ).order_by(desc(PriceHistory.checked_at)).all()
-            
-            # Get unique latest price per source
-            seen_sources = set()
-            current_prices = []
-            for price_record in latest_prices:
-                if price_record.source_id not in seen_sources:
-                    seen_sources.add(price_record.source_id)
-                    current_prices.append({
-                        "source_id": price_record.source_id,
-                        "source_name": price_record.name,
-                        "price": float(price_record.price) if price_record.price else None,
-                        "checked_at": price_record.checked_at
-                    })
-        except Exception as e:
-            # If price history query fails, just use empty prices
-            current_prices = []
+    if search and search.strip():
+        # Ranked results have no unique sort key, so their cursor is a position
+        offset = decode_offset_cursor(cursor)
+        if offset is None:
+            offset = skip
+        products = product_search.apply_search(db, query, search).offset(offset).limit(limit).all()
+        set_next_cursor(response, products, limit, lambda product: {"offset": offset + limit})
+    else:
+        after_id = decode_id_cursor(cursor)
+        if after_id is not None:
+            query = query.filter(ProductModel.id > after_id)
+        elif skip:
+            query = query.offset(skip)
         
-        # Calculate price statistics
-        prices = [p["price"] for p in current_prices if p["price"] is not None]
-        product_dict = {
-            **{k: v for k, v in product.__dict__.items() if not k.startswith('_')},
-            "current_prices": current_prices,
-            "min_price": min(prices) if prices else None,
-            "max_price": max(prices) if prices else None,
-            "avg_price": sum(prices) / len(prices) if prices else None,
-            "price_trend": "stable"  # Could be calculated from history
-        }
-        result.append(ProductWithPrices(**product_dict))
+        products = query.order_by(ProductModel.id).limit(limit).all()
+        set_next_cursor(response, products, limit, lambda product: {"id": product.id})
     
-    return result
+    # Current prices of the whole page in one query (safe mode - handle empty tables)
+    try:
+        prices_by_product = _current_prices(db, [product.id for product in products])
+    except Exception as e:
+        # If the current prices query fails, just use empty prices
+        prices_by_product = {}
+    
+    return [_with_prices(product, prices_by_product.get(product.id, [])) for product in products]
+
+@router.get("/browse", dependencies=[Depends(conditional("catalog", "prices"))])
+def browse_products(
+    response: Response,
+    search: Optional[str] = None,
+    category: Optional[List[str]] = Query(None),
+    brand: Optional[List[str]] = Query(None),
+    source_id: Optional[List[int]] = Query(None),
+    availability: Optional[List[str]] = Query(None, description="available / unavailable"),
+    is_active: Optional[bool] = True,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Faceted catalog browser: a page of products ordered by id plus counts per
+    category, brand, source and availability. Values within a facet are OR-ed,
+    facets are AND-ed; each facet is counted without its own filter.
+    """
+    after_id = decode_id_cursor(cursor)
+    matching_ids = None
+    if search and search.strip():
+        matching_ids = [
+            product_id for product_id, in product_search.apply_search(db, db.query(ProductModel.id), search).all()
+        ]
+
+    result = product_facets.get_index(db).browse(
+        categories=category,
+        brands=brand,
+        source_ids=source_id,
+        availability=availability,
+        is_active=is_active,
+        product_ids=matching_ids,
+        after_id=after_id,
+        limit=limit,
+    )
 
-@router.get("/{product_id}", response_model=ProductWithPrices)
+    products = {
+        product.id: product
+        for product in db.query(ProductModel).filter(ProductModel.id.in_(result["product_ids"])).all()
+    }
+    page = [products[product_id] for product_id in result["product_ids"] if product_id in products]
+    set_next_cursor(response, page, limit, lambda product: {"id": product.id})
+
+    try:
+        prices_by_product = _current_prices(db, [product.id for product in page])
+    except Exception as e:
+        prices_by_product = {}
+
+    return {
+        "items": [_with_prices(product, prices_by_product.get(product.id, [])) for product in page],
+        "total": result["total"],
+        "facets": result["facets"],
+    }
+
+@router.get("/suggest")
+def suggest_products(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    active_only: bool = True,
+    current_user = Depends(get_current_user)
+):
+    """Autocomplete on name, SKU, EAN, brand and category from the in-process index"""
+    if not product_suggest.index.ready:
+        raise HTTPException(
+            status_code=503,
+            detail={"error": "suggest_index_not_ready", "message": "Indeks podpowiedzi jest w trakcie ładowania."},
+        )
+    return product_suggest.index.suggest(q, limit, active_only)
+
+@router.get("/{product_id}", response_model=ProductWithPrices, dependencies=[Depends(conditional("catalog", "prices"))])
 def get_product(product_id: int, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
     product = db.query(ProductModel).filter(ProductModel.id == product_id).first()
     if not product:
@@ -92,40 +182,11 @@ def get_product(product_id: int, db: Session = Depends(get_db), current_user = D
     
     # Get current prices (safe mode)
     try:
-        latest_prices = db.query(
-            PriceHistory.source_id,
-            PriceHistory.price,
-            PriceHistory.checked_at,
-            Source.name
-        ).join(Source, PriceHistory.source_id == Source.id).filter(
-            PriceHistory.product_id == product.id
-        ).order_by(desc(PriceHistory.checked_at)).all()
-        
-        seen_sources = set()
-        current_prices = []
-        for price_record in latest_prices:
-            if price_record.source_id not in seen_sources:
-                seen_sources.add(price_record.source_id)
-                current_prices.append({
-                    "source_id": price_record.source_id,
-                    "source_name": price_record.name,
-                    "price": float(price_record.price) if price_record.price else None,
-                    "checked_at": price_record.checked_at
-                })
+        current_prices = _current_prices(db, [product.id]).get(product.id, [])
     except Exception as e:
         current_prices = []
     
-    prices = [p["price"] for p in current_prices if p["price"] is not None]
-    product_dict = {
-        **{k: v for k, v in product.__dict__.items() if not k.startswith('_')},
-        "current_prices": current_prices,
-        "min_price": min(prices) if prices else None,
-        "max_price": max(prices) if prices else None,
-        "avg_price": sum(prices) / len(prices) if prices else None,
-        "price_trend": "stable"
-    }
-    
-    return ProductWithPrices(**product_dict)
+    return _with_prices(product, current_prices)
 
 @router.post("/", response_model=Product)
 def create_product(product: ProductCreate, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
@@ -139,6 +200,8 @@ def create_product(product: ProductCreate, db: Session = Depends(get_db), curren
     db.add(db_product)
     db.commit()
     db.refresh(db_product)
+    product_suggest.products_changed(db, [db_product.id])
+    response_cache.invalidate("catalog")
     return db_product
 
 @router.put("/{product_id}", response_model=Product)
@@ -154,6 +217,8 @@ def update_product(product_id: int, product: ProductUpdate, db: Session = Depend
     db_product.updated_at = datetime.utcnow()
     db.commit()
     db.refresh(db_product)
+    product_suggest.products_changed(db, [product_id])
+    response_cache.invalidate("catalog")
     return db_product
 
 @router.delete("/{product_id}")
@@ -164,52 +229,120 @@ def delete_product(product_id: int, db: Session = Depends(get_db), current_user
     
     db.delete(db_product)
     db.commit()
+    product_suggest.products_changed(db, [product_id])
+    response_cache.invalidate("catalog")
     return {"message": "Product deleted successfully"}
 
-@router.get("/{product_id}/price-history")
+def _to_float(v):
+    if v is None:
+        return None
+    if isinstance(v, Decimal):
+        return float(v)
+    return float(v)
+
+def _history_queries(db: Session, product_id: int, source_id: Optional[int], date_from: datetime, after=None):
+    """
+    Hot price history query and archived rows for the range, both ordered by
+    (checked_at, id) and starting after the cursor key, if any.
+    """
+    # One row per source per day, also for intervals stored in change_only mode
+    query = db.query(PriceObservation, Source.name).join(
+        Source, PriceObservation.source_id == Source.id
+    ).filter(
+        PriceObservation.product_id == product_id,
+        PriceObservation.last_seen_at >= date_from,
+        PriceObservation.checked_at >= date_from
+    )
+
+    if source_id:
+        query = query.filter(PriceObservation.source_id == source_id)
+    if after:
+        query = query.filter(tuple_(PriceObservation.checked_at, PriceObservation.id) > after)
+
+    # Months before the boundary are read from the Parquet archive
+    archived = []
+    boundary = price_archive.archive_boundary()
+    if boundary and date_from < boundary:
+        query = query.filter(PriceObservation.valid_from >= boundary)
+        if not after or after[0] < boundary:
+            archived = sorted(
+                (row for row in price_archive.read_observations(product_id, date_from, boundary, source_id)
+                 if not after or (row["checked_at"], row["id"]) > after),
+                key=lambda row: (row["checked_at"], row["id"])
+            )
+
+    return query.order_by(PriceObservation.checked_at, PriceObservation.id), archived
+
+def _archived_history_rows(db: Session, archived: list) -> list:
+    source_names = {}
+    if archived:
+        source_names = dict(db.query(Source.id, Source.name).filter(
+            Source.id.in_({row["source_id"] for row in archived})
+        ).all())
+
+    return [
+        {
+            "id": row["id"],
+            "source_id": row["source_id"],
+            "source_name": source_names.get(row["source_id"]),
+            "price": row["price"],
+            "currency": row["currency"],
+            "availability": row["availability"],
+            "checked_at": row["checked_at"]
+        }
+        for row in archived
+    ]
+
+def _history_row(h) -> dict:
+    return {
+        "id": h[0].id,
+        "source_id": h[0].source_id,
+        "source_name": h[1],
+        "price": _to_float(h[0].price),
+        "currency": h[0].currency,
+        "availability": h[0].availability,
+        "checked_at": h[0].checked_at
+    }
+
+def _require_product(db: Session, product_id: int):
+    # Validate product exists for clearer 404
+    product = db.query(ProductModel).filter(ProductModel.id == product_id).first()
+    if not product:
+        raise HTTPException(status_code=404, detail={"error": "product_not_found", "product_id": product_id})
+
+@router.get("/{product_id}/price-history", dependencies=[Depends(conditional("catalog", "prices"))])
 def get_price_history(
     product_id: int,
+    response: Response,
     source_id: Optional[int] = None,
     days: int = 30,
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
-    # Validate product exists for clearer 404
-    product = db.query(ProductModel).filter(ProductModel.id == product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail={"error": "product_not_found", "product_id": product_id})
+    """
+    Price history ordered by (checked_at, id). Without limit the whole range
+    is returned; with limit, pass X-Next-Cursor back as cursor for the next page.
+    """
+    _require_product(db, product_id)
+    after = decode_time_cursor(cursor)
 
     date_from = datetime.utcnow() - timedelta(days=days)
     try:
-        query = db.query(PriceHistory, Source.name).join(Source).filter(
-            PriceHistory.product_id == product_id,
-            PriceHistory.checked_at >= date_from
-        )
+        query, archived = _history_queries(db, product_id, source_id, date_from, after)
 
-        if source_id:
-            query = query.filter(PriceHistory.source_id == source_id)
-
-        history = query.order_by(PriceHistory.checked_at).all()
-
-        def to_float(v):
-            if v is None:
-                return None
-            if isinstance(v, Decimal):
-                return float(v)
-            return float(v)
-
-        return [
-            {
-                "id": h[0].id,
-                "source_id": h[0].source_id,
-                "source_name": h[1],
-                "price": to_float(h[0].price),
-                "currency": h[0].currency,
-                "availability": h[0].availability,
-                "checked_at": h[0].checked_at
-            }
-            for h in history
-        ]
+        if limit is not None:
+            archived = archived[:limit]
+            remaining = limit - len(archived)
+            history = query.limit(remaining).all() if remaining else []
+        else:
+            history = query.all()
+
+        rows = _archived_history_rows(db, archived) + [_history_row(h) for h in history]
+        if limit is not None:
+            set_next_cursor(response, rows, limit, lambda row: {"checked_at": row["checked_at"], "id": row["id"]})
+        return rows
     except SQLAlchemyError as e:
         raise HTTPException(
             status_code=500,
@@ -229,6 +362,34 @@ def get_price_history(
             },
         )
 
+@router.get("/{product_id}/price-history/stream")
+def stream_price_history(
+    product_id: int,
+    source_id: Optional[int] = None,
+    days: int = 30,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """Whole price history range as NDJSON, one row per line, without loading it into memory"""
+    _require_product(db, product_id)
+
+    date_from = datetime.utcnow() - timedelta(days=days)
+
+    # The body is sent after get_db has closed the request session, so the
+    # generator reads through a session of its own
+    def generate():
+        stream_db = SessionLocal()
+        try:
+            query, archived = _history_queries(stream_db, product_id, source_id, date_from)
+            for row in _archived_history_rows(stream_db, archived):
+                yield json.dumps(jsonable_encoder(row)) + "\n"
+            for h in query.yield_per(STREAM_BATCH_SIZE):
+                yield json.dumps(jsonable_encoder(_history_row(h))) + "\n"
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
 @router.post("/bulk-import")
 def bulk_import_products(
     import_data: BulkProductImport,
@@ -255,6 +416,9 @@ def bulk_import_products(
         except Exception as e:
             errors.append({"sku": product_data.sku if product_data.sku else "N/A", "error": str(e)})
     
+    product_suggest.products_changed(db, created)
+    response_cache.invalidate("catalog")
+    
     return {
         "created": len(created),
         "errors": len(errors),
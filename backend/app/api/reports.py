@@ -11,9 +11,10 @@ from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 
 from app.models.database import get_db
-from app.models.models import Product, PriceHistory, Source
+from app.models.models import Product, PriceHistory, Source, CurrentPrice
 from app.schemas.schemas import ReportRequest
 from app.api.auth import get_current_user
+from app.services import price_archive
 
 router = APIRouter()
 
@@ -55,12 +56,14 @@ def _get_products_report_data(db: Session, report_request: ReportRequest):
     
     products = query.all()
     
+    # Most recently observed price per product, across sources
+    latest_prices = dict(db.query(CurrentPrice.product_id, CurrentPrice.price).distinct(
+        CurrentPrice.product_id
+    ).order_by(CurrentPrice.product_id, CurrentPrice.checked_at.desc()).all())
+    
     data = []
     for product in products:
-        # Get latest price
-        latest_price = db.query(PriceHistory).filter(
-            PriceHistory.product_id == product.id
-        ).order_by(PriceHistory.checked_at.desc()).first()
+        latest_price = latest_prices.get(product.id)
         
         data.append({
             "ID": product.id,
@@ -70,7 +73,7 @@ def _get_products_report_data(db: Session, report_request: ReportRequest):
             "Category": product.category or "",
             "Brand": product.brand or "",
             "Base Price": product.base_price or 0,
-            "Latest Price": latest_price.price if latest_price else 0,
+            "Latest Price": latest_price if latest_price is not None else 0,
             "Active": "Yes" if product.is_active else "No",
             "Created": product.created_at.strftime("%Y-%m-%d")
         })
@@ -82,11 +85,39 @@ def _get_price_changes_report_data(db: Session, report_request: ReportRequest):
     date_from = report_request.date_from or (datetime.utcnow() - timedelta(days=30))
     date_to = report_request.date_to or datetime.utcnow()
     
-    price_history = db.query(
+    query = db.query(
         PriceHistory, Product.name, Source.name.label("source_name")
     ).join(Product).join(Source).filter(
         PriceHistory.checked_at.between(date_from, date_to)
-    ).order_by(PriceHistory.checked_at.desc()).all()
+    )
+    
+    # Months before the boundary are read from the Parquet archive
+    archived_data = []
+    boundary = price_archive.archive_boundary()
+    if boundary and date_from < boundary:
+        query = query.filter(PriceHistory.checked_at >= boundary)
+        # Streamed batch by batch with only the report columns, and restricted
+        # to products that still exist (like the join on the hot rows)
+        product_names = dict(db.query(Product.id, Product.name).all())
+        source_names = dict(db.query(Source.id, Source.name).all())
+        archived = price_archive.iter_rows(
+            date_from, min(date_to, boundary), product_ids=product_names,
+            columns=["product_id", "source_id", "price", "currency", "availability", "checked_at"]
+        )
+        for row in archived:
+            if row["checked_at"] < date_from or row["source_id"] not in source_names:
+                continue
+            archived_data.append((row["checked_at"], {
+                "Product": product_names[row["product_id"]],
+                "Source": source_names[row["source_id"]],
+                "Price": row["price"],
+                "Currency": row["currency"],
+                "Available": "Yes" if row["availability"] else "No",
+                "Checked At": row["checked_at"].strftime("%Y-%m-%d %H:%M")
+            }))
+        archived_data = [entry for _, entry in sorted(archived_data, key=lambda item: item[0], reverse=True)]
+    
+    price_history = query.order_by(PriceHistory.checked_at.desc()).all()
     
     data = []
     for history, product_name, source_name in price_history:
@@ -99,7 +130,8 @@ def _get_price_changes_report_data(db: Session, report_request: ReportRequest):
             "Checked At": history.checked_at.strftime("%Y-%m-%d %H:%M")
         })
     
-    return data
+    # Newest first: hot rows, then the archive
+    return data + archived_data
 
 def _get_sources_report_data(db: Session, report_request: ReportRequest):
     """Get sources data for report"""
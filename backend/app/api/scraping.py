@@ -19,7 +19,19 @@ def trigger_scrape_all(
     Uses Celery Worker for async processing.
     """
     try:
-        from app.tasks.scraping_tasks import scrape_all_products
+        from app.tasks.scraping_tasks import scrape_all_products, is_job_stale
+        
+        # Coalesce with a full run that is in progress (a stalled one is resumed by the task)
+        running_job = db.query(ScrapeJob).filter(
+            ScrapeJob.job_type == "full",
+            ScrapeJob.status == "running"
+        ).first()
+        if running_job and not is_job_stale(db, running_job):
+            return {
+                "status": "coalesced",
+                "message": f"Scraping job {running_job.id} is already running",
+                "job_id": running_job.id
+            }
         
         # Queue the scraping task in Celery
         task = scrape_all_products.delay()
@@ -40,6 +52,7 @@ def trigger_scrape_all(
 def trigger_scrape_product(
     product_id: int,
     source_id: Optional[int] = None,
+    force: bool = False,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
@@ -47,9 +60,11 @@ def trigger_scrape_product(
     Trigger scraping for a specific product.
     If source_id is provided, scrape only from that source.
     Otherwise, scrape from all active sources for this product.
+    Mappings scraped recently or already queued/in flight are coalesced;
+    force=true ignores the minimum re-scrape interval.
     """
     try:
-        from app.tasks.scraping_tasks import scrape_product
+        from app.tasks.scraping_tasks import dispatch_scrape
         
         # Check if product exists
         product = db.query(Product).filter(Product.id == product_id).first()
@@ -58,11 +73,17 @@ def trigger_scrape_product(
         
         if source_id:
             # Scrape from specific source
-            task = scrape_product.delay(product_id, source_id)
+            dispatched = dispatch_scrape(product_id, source_id, force=force)
+            if "coalesced" in dispatched:
+                return {
+                    "status": "coalesced",
+                    "message": f"Product {product_id} from source {source_id} was not queued ({dispatched['coalesced']})",
+                    "reason": dispatched["coalesced"]
+                }
             return {
                 "status": "queued",
                 "message": f"Scraping product {product_id} from source {source_id}",
-                "task_id": task.id
+                "task_id": dispatched["task_id"]
             }
         else:
             # Scrape from all sources
@@ -78,14 +99,19 @@ def trigger_scrape_product(
                 )
             
             tasks = []
+            coalesced = []
             for ps in product_sources:
-                task = scrape_product.delay(product_id, ps.source_id)
-                tasks.append(task.id)
+                dispatched = dispatch_scrape(product_id, ps.source_id, force=force)
+                if "coalesced" in dispatched:
+                    coalesced.append({"source_id": ps.source_id, "reason": dispatched["coalesced"]})
+                else:
+                    tasks.append(dispatched["task_id"])
             
             return {
-                "status": "queued",
-                "message": f"Scraping product {product_id} from {len(tasks)} sources",
-                "task_ids": tasks
+                "status": "queued" if tasks else "coalesced",
+                "message": f"Scraping product {product_id} from {len(tasks)} sources ({len(coalesced)} coalesced)",
+                "task_ids": tasks,
+                "coalesced": coalesced
             }
             
     except HTTPException:
@@ -141,16 +167,75 @@ def get_scrape_jobs(
     return [
         {
             "id": job.id,
+            "job_type": job.job_type,
             "status": job.status,
             "started_at": job.started_at,
             "completed_at": job.completed_at,
             "prices_found": job.prices_found,
+            "errors_count": job.errors_count,
+            "total_chunks": job.total_chunks,
+            "completed_chunks": job.completed_chunks,
+            "resume_count": job.resume_count,
             "error_message": job.error_message
         }
         for job in jobs
     ]
 
 
+@router.post("/jobs/{job_id}/resume")
+def resume_scrape_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Resume a cancelled, failed or stalled full run.
+    Only chunks that are not completed are dispatched again.
+    """
+    job = db.query(ScrapeJob).filter(ScrapeJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Scrape job not found")
+    if job.job_type != "full" or not job.total_chunks:
+        raise HTTPException(status_code=400, detail="Only checkpointed full runs can be resumed")
+    if job.status == "completed":
+        raise HTTPException(status_code=400, detail="Scrape job already completed")
+    
+    try:
+        from app.tasks.scraping_tasks import resume_scrape_job as resume_task
+        
+        task = resume_task.delay(job_id)
+        return {
+            "status": "queued",
+            "message": f"Resuming scrape job {job_id} ({job.completed_chunks or 0}/{job.total_chunks} chunks done)",
+            "task_id": task.id
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to queue resume task: {str(e)}")
+
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_scrape_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Cancel a running job. Chunks stop at their next checkpoint
+    and keep their progress, so the job can be resumed later.
+    """
+    job = db.query(ScrapeJob).filter(ScrapeJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Scrape job not found")
+    if job.status != "running":
+        raise HTTPException(status_code=400, detail=f"Scrape job is {job.status}")
+    
+    job.status = "cancelled"
+    job.completed_at = datetime.utcnow()
+    db.commit()
+    
+    return {"status": "cancelled", "job_id": job_id}
+
+
 @router.get("/status/{task_id}")
 def get_scrape_status(
     task_id: str,
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
@@ -6,23 +6,36 @@ from app.models.database import get_db
 from app.models.models import Source as SourceModel, ProductSource as ProductSourceModel
 from app.schemas.schemas import Source, SourceCreate, SourceUpdate, ProductSource, ProductSourceCreate
 from app.api.auth import get_current_user
+from app.api.pagination import decode_id_cursor, set_next_cursor
+from app.services import invalidation, response_cache
 
 router = APIRouter()
 
 @router.get("/", response_model=List[Source])
 def get_sources(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     is_active: Optional[bool] = None,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
+    """Sources ordered by id; pass X-Next-Cursor back as cursor for the next page (skip is legacy)"""
     query = db.query(SourceModel)
     
     if is_active is not None:
         query = query.filter(SourceModel.is_active == is_active)
     
-    return query.offset(skip).limit(limit).all()
+    after_id = decode_id_cursor(cursor)
+    if after_id is not None:
+        query = query.filter(SourceModel.id > after_id)
+    elif skip:
+        query = query.offset(skip)
+    
+    sources = query.order_by(SourceModel.id).limit(limit).all()
+    set_next_cursor(response, sources, limit, lambda source: {"id": source.id})
+    return sources
 
 @router.get("/{source_id}", response_model=Source)
 def get_source(source_id: int, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
@@ -42,6 +55,8 @@ def create_source(source: SourceCreate, db: Session = Depends(get_db), current_u
     db.add(db_source)
     db.commit()
     db.refresh(db_source)
+    
+    response_cache.invalidate("catalog")
     return db_source
 
 @router.put("/{source_id}", response_model=Source)
@@ -56,6 +71,10 @@ def update_source(source_id: int, source: SourceUpdate, db: Session = Depends(ge
     
     db.commit()
     db.refresh(db_source)
+    
+    response_cache.invalidate("catalog")
+    # Drop the source from worker caches
+    invalidation.publish("sources", source_id=source_id)
     return db_source
 
 @router.delete("/{source_id}")
@@ -66,6 +85,10 @@ def delete_source(source_id: int, db: Session = Depends(get_db), current_user =
     
     db.delete(db_source)
     db.commit()
+    
+    response_cache.invalidate("catalog")
+    
+    invalidation.publish("sources", source_id=source_id)
     return {"message": "Source deleted successfully"}
 
 # Product-Source Mappings
@@ -95,6 +118,14 @@ def create_product_source(
     db.add(db_product_source)
     db.commit()
     db.refresh(db_product_source)
+    
+    response_cache.invalidate("catalog")
+    
+    invalidation.publish(
+        "product_sources",
+        product_id=db_product_source.product_id,
+        source_id=db_product_source.source_id
+    )
     return db_product_source
 
 @router.delete("/product-sources/{product_source_id}")
@@ -107,6 +138,11 @@ def delete_product_source(
     if not db_ps:
         raise HTTPException(status_code=404, detail="Product-Source mapping not found")
     
+    product_id, source_id = db_ps.product_id, db_ps.source_id
     db.delete(db_ps)
     db.commit()
+    
+    response_cache.invalidate("catalog")
+    
+    invalidation.publish("product_sources", product_id=product_id, source_id=source_id)
     return {"message": "Product-Source mapping deleted successfully"}
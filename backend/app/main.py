@@ -4,12 +4,15 @@ from contextlib import asynccontextmanager
 import os
 
 from app.api.v1.api import api_router
+from app.api.pagination import NEXT_CURSOR_HEADER
 from app.models.database import engine, Base
+from app.services import product_suggest
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     # NOTE: Schema is managed by Alembic migrations (see backend/migrations)
+    product_suggest.start()
     yield
     # Shutdown
     pass
@@ -35,6 +38,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 app.include_router(api_router, prefix="/api/v1")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Text, JSON, Index, Date, Numeric
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Text, JSON, Index, Date, Numeric, Table, MetaData
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.models.database import Base
@@ -42,6 +42,7 @@ class Product(Base):
     __table_args__ = (
         Index('idx_product_active_category', 'is_active', 'category'),
         Index('idx_product_brand_active', 'brand', 'is_active'),
+        # Trigram search indexes (idx_product_*_trgm) are created by migration, see services/product_search.py
     )
 
 class Source(Base):
@@ -90,11 +91,80 @@ class ProductSource(Base):
         Index('idx_product_source_last_checked', 'product_id', 'last_checked'),
     )
 
+class CurrentPrice(Base):
+    """
+    Latest observed price per product-source mapping.
+    Upserted by the result writer on every flush, so "current price" reads
+    are one indexed lookup instead of a price_history scan.
+    previous_price/price_changed_at describe the last actual price change.
+    """
+    __tablename__ = "current_prices"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    source_id = Column(Integer, ForeignKey("sources.id", ondelete="CASCADE"), nullable=False)
+    
+    price = Column(Numeric(10, 2), nullable=False)
+    currency = Column(String, default="PLN")
+    availability = Column(Boolean, default=True)
+    shipping_cost = Column(Numeric(10, 2))
+    checked_at = Column(DateTime, nullable=False)
+    
+    previous_price = Column(Numeric(10, 2))
+    price_changed_at = Column(DateTime)
+    
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_current_price_mapping_unique', 'product_id', 'source_id', unique=True),
+        Index('idx_current_price_changed', 'price_changed_at'),
+    )
+
+class ProductSourcePriceChange(Base):
+    """
+    Precomputed price changes per product-source mapping.
+    Current price/availability and the as-of prices 1, 7 and 30 days ago,
+    refreshed in one set-based pass by update_product_source_changes after
+    each full scrape run (and nightly), so comparison endpoints only read it.
+    """
+    __tablename__ = "product_source_price_changes"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    source_id = Column(Integer, ForeignKey("sources.id", ondelete="CASCADE"), nullable=False)
+    
+    current_price = Column(Numeric(10, 2))
+    current_availability = Column(Boolean)
+    current_checked_at = Column(DateTime)
+    
+    price_1d = Column(Numeric(10, 2))
+    price_7d = Column(Numeric(10, 2))
+    price_30d = Column(Numeric(10, 2))
+    
+    # Percentage change of current_price against the as-of price
+    price_change_1d = Column(Float)
+    price_change_7d = Column(Float)
+    price_change_30d = Column(Float)
+    
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_price_change_mapping_unique', 'product_id', 'source_id', unique=True),
+    )
+
 class PriceHistory(Base):
     """
     Raw price history - partitioned by date for performance.
-    For large scale (10k products × 20 sources × 365 days = 73M records/year),
-    use PostgreSQL table partitioning by month.
+    For large scale (10k products × 20 sources × 365 days = 73M records/year)
+    the table is range-partitioned by month on checked_at (migration
+    20261018_08, primary key (id, checked_at)). Partitions are created ahead
+    by ensure_price_history_partitions and dropped whole by cleanup_old_data;
+    filter on checked_at to get partition pruning.
+    
+    Each row is valid from checked_at to last_seen_at. In append mode both are
+    the scrape time; with PRICE_STORAGE_MODE=change_only a new row is written
+    only when price, availability or shipping changes, otherwise last_seen_at
+    of the current row is extended. Use PriceObservation for per-day reads.
     """
     __tablename__ = "price_history"
     
@@ -105,6 +175,7 @@ class PriceHistory(Base):
     currency = Column(String, default="PLN")
     availability = Column(Boolean, default=True)
     checked_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_seen_at = Column(DateTime, default=datetime.utcnow, nullable=False)  # End of validity interval
     
     # Additional metadata
     shipping_cost = Column(Numeric(10, 2))
@@ -119,6 +190,56 @@ class PriceHistory(Base):
         Index('idx_price_source_date', 'source_id', 'checked_at'),
         Index('idx_price_product_source_date', 'product_id', 'source_id', 'checked_at'),
         Index('idx_price_date', 'checked_at'),  # For partitioning
+        Index('idx_price_last_seen', 'last_seen_at'),  # For interval overlap queries
+    )
+
+class PriceObservation(Base):
+    """
+    Read-only view (price_observations) expanding price_history validity
+    intervals into one row per mapping per day.
+    Gives the same rows as price_history in append mode, so per-day queries
+    keep working in change_only mode. Always filter by product_id or source_id.
+    """
+    __table__ = Table(
+        "price_observations",
+        MetaData(),  # Not in Base.metadata - the view is created by migration
+        Column("id", Integer, primary_key=True),
+        Column("product_id", Integer, nullable=False),
+        Column("source_id", Integer, nullable=False),
+        Column("price", Numeric(10, 2), nullable=False),
+        Column("currency", String),
+        Column("availability", Boolean),
+        Column("shipping_cost", Numeric(10, 2)),
+        Column("discount_percentage", Float),
+        Column("stock_quantity", Integer),
+        Column("checked_at", DateTime, primary_key=True),  # Observation time on that day
+        Column("valid_from", DateTime),
+        Column("last_seen_at", DateTime),
+    )
+
+class PriceChangeEvent(Base):
+    """
+    Outbox of price/availability changes.
+    Written by the result writer in the same transaction as price_history and
+    consumed by event_tasks.process_price_events (stats + alerts per product).
+    """
+    __tablename__ = "price_change_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    source_id = Column(Integer, ForeignKey("sources.id", ondelete="CASCADE"), nullable=False)
+    
+    old_price = Column(Numeric(10, 2))
+    new_price = Column(Numeric(10, 2), nullable=False)
+    old_availability = Column(Boolean)
+    new_availability = Column(Boolean)
+    
+    checked_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    processed_at = Column(DateTime)  # NULL until consumed
+    
+    __table_args__ = (
+        Index('idx_price_event_processed', 'processed_at', 'id'),
     )
 
 class DailyPriceStats(Base):
@@ -162,6 +283,38 @@ class DailyPriceStats(Base):
         Index('idx_daily_stats_unique', 'product_id', 'date', unique=True),
     )
 
+class ProductPriceSketch(Base):
+    """
+    Intraday rolling aggregate per product per day.
+    Merged from the result writers' in-memory sketches on every flush: count,
+    sum, min, max, best offer and a t-digest (centroids as JSON) for quantiles.
+    Sketches of several days merge into weekly/monthly quantiles without
+    reading price_history.
+    """
+    __tablename__ = "product_price_sketches"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    date = Column(Date, nullable=False)
+    
+    count = Column(Integer, default=0, nullable=False)
+    total = Column(Float, default=0, nullable=False)  # Sum of prices
+    min_price = Column(Numeric(10, 2))
+    max_price = Column(Numeric(10, 2))
+    available_count = Column(Integer, default=0, nullable=False)
+    
+    # Best offer: cheapest available, cheapest overall when nothing is in stock
+    best_price = Column(Numeric(10, 2))
+    best_source_id = Column(Integer, ForeignKey("sources.id", ondelete="SET NULL"))
+    best_available = Column(Boolean)
+    
+    digest = Column(JSON)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_price_sketch_unique', 'product_id', 'date', unique=True),
+    )
+
 class SourceDailyStats(Base):
     """
     Aggregated daily statistics per source.
@@ -192,6 +345,85 @@ class SourceDailyStats(Base):
         Index('idx_source_daily_stats_unique', 'source_id', 'date', unique=True),
     )
 
+class SourceScrapeCounter(Base):
+    """
+    Per-source, per-day scrape attempt counters.
+    Incremented by the result writer on every flush (failures never reach
+    price_history), read by calculate_source_stats for failed_scrapes and
+    avg_response_time.
+    """
+    __tablename__ = "source_scrape_counters"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source_id = Column(Integer, ForeignKey("sources.id", ondelete="CASCADE"), nullable=False)
+    date = Column(Date, nullable=False)
+    
+    attempts = Column(Integer, default=0, nullable=False)
+    failures = Column(Integer, default=0, nullable=False)
+    response_time_total = Column(Float, default=0, nullable=False)  # Seconds, summed over attempts
+    
+    __table_args__ = (
+        Index('idx_source_scrape_counter_unique', 'source_id', 'date', unique=True),
+    )
+
+class PriceStatsRollup(Base):
+    """
+    Weekly / monthly rollups of daily_price_stats per product.
+    Refreshed for the affected periods whenever daily stats are computed,
+    so long-range charts read ~52 or ~12 rows per year instead of 365.
+    """
+    __tablename__ = "price_stats_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    resolution = Column(String, nullable=False)  # week, month
+    period_start = Column(Date, nullable=False)
+    
+    min_price = Column(Numeric(10, 2))
+    max_price = Column(Numeric(10, 2))
+    avg_price = Column(Numeric(10, 2))  # Mean of daily averages
+    median_price = Column(Numeric(10, 2))  # Median of daily medians
+    change_percentage = Column(Float)  # Against the previous period
+    
+    sources_available = Column(Integer)  # Max over the period
+    best_source_id = Column(Integer, ForeignKey("sources.id", ondelete="SET NULL"))
+    best_price = Column(Numeric(10, 2))
+    days = Column(Integer)  # Daily rows in the period
+    
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_price_rollup_unique', 'product_id', 'resolution', 'period_start', unique=True),
+    )
+
+class SourceStatsRollup(Base):
+    """
+    Weekly / monthly rollups of source_daily_stats per source.
+    """
+    __tablename__ = "source_stats_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source_id = Column(Integer, ForeignKey("sources.id", ondelete="CASCADE"), nullable=False)
+    resolution = Column(String, nullable=False)  # week, month
+    period_start = Column(Date, nullable=False)
+    
+    products_scraped = Column(Integer)  # Max over the period
+    successful_scrapes = Column(Integer)  # Summed
+    failed_scrapes = Column(Integer)  # Summed
+    avg_response_time = Column(Float)  # Weighted by attempts
+    
+    avg_price_change = Column(Float)  # Mean of daily values
+    products_price_increased = Column(Integer)  # Summed
+    products_price_decreased = Column(Integer)  # Summed
+    products_unavailable = Column(Integer)  # Max over the period
+    days = Column(Integer)
+    
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_source_rollup_unique', 'source_id', 'resolution', 'period_start', unique=True),
+    )
+
 class Alert(Base):
     __tablename__ = "alerts"
     
@@ -236,9 +468,49 @@ class ScrapeJob(Base):
     errors_count = Column(Integer, default=0)
     error_message = Column(Text)
     
+    # Checkpointing (full runs are split into scrape_job_chunks)
+    total_chunks = Column(Integer, default=0)
+    completed_chunks = Column(Integer, default=0)
+    resume_count = Column(Integer, default=0)
+    heartbeat_at = Column(DateTime)
+    
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    chunks = relationship("ScrapeJobChunk", back_populates="job", cascade="all, delete-orphan")
+    
     __table_args__ = (
         Index('idx_scrape_job_status_date', 'status', 'started_at'),
         Index('idx_scrape_job_type_date', 'job_type', 'started_at'),
     )
+
+class ScrapeJobChunk(Base):
+    """
+    Durable work list of a full scrape run.
+    Each chunk holds a slice of the (product_id, source_id) mappings and its own
+    progress, so a crashed or cancelled run re-dispatches only what is left.
+    """
+    __tablename__ = "scrape_job_chunks"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("scrape_jobs.id", ondelete="CASCADE"), nullable=False)
+    chunk_index = Column(Integer, nullable=False)
+    mappings = Column(JSON, nullable=False)  # [[product_id, source_id], ...]
+    
+    status = Column(String, default="pending")  # pending, queued, running, completed
+    attempts = Column(Integer, default=0)  # Dispatch counter; stale deliveries are dropped
+    progress = Column(Integer, default=0)  # Mappings processed so far
+    
+    successful = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    coalesced = Column(Integer, default=0)
+    
+    celery_task_id = Column(String)
+    heartbeat_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    
+    job = relationship("ScrapeJob", back_populates="chunks")
+    
+    __table_args__ = (
+        Index('idx_scrape_job_chunk_job_status', 'job_id', 'status'),
+        Index('idx_scrape_job_chunk_unique', 'job_id', 'chunk_index', unique=True),
+    )
@@ -0,0 +1,295 @@
+"""
+pandas backend for the nightly aggregations.
+
+Alternative to the single-statement SQL in aggregation_tasks: the day's
+observations are streamed out of Postgres with COPY ... TO STDOUT, parsed
+into Arrow columns and aggregated with pandas groupby; the results are
+COPY'd into a temp staging table and upserted with one INSERT ... SELECT.
+The output is identical to the SQL path (same observation window, median =
+percentile_cont, same best offer order), so the backends can be switched per
+task with backend="pandas" or AGGREGATION_BACKEND.
+
+Compare both with benchmarks/aggregation_benchmark.py.
+"""
+from app.services.result_writer import interval_scan_start
+from sqlalchemy import text
+from datetime import date, datetime, timedelta
+from typing import Dict, Tuple
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+DAILY_OBSERVATIONS_SQL = """
+    SELECT ph.product_id, ph.source_id, CAST(ph.price AS DOUBLE PRECISION) AS price, ph.availability
+    FROM price_history ph
+    JOIN products p ON p.id = ph.product_id AND p.is_active
+    WHERE ph.last_seen_at >= %(day_start)s
+      AND ph.checked_at >= %(scan_start)s
+      AND ph.checked_at < %(day_end)s
+      AND (CAST(%(product_ids)s AS INTEGER[]) IS NULL OR ph.product_id = ANY(CAST(%(product_ids)s AS INTEGER[])))
+      AND (CAST(%(product_min)s AS INTEGER) IS NULL OR ph.product_id BETWEEN %(product_min)s AND %(product_max)s)
+"""
+
+DAILY_OBSERVATION_TYPES = {
+    "product_id": pa.int32(),
+    "source_id": pa.int32(),
+    "price": pa.float64(),
+    "availability": pa.bool_(),
+}
+
+# Observations of the day and the day before, with the day(s) they belong to
+SOURCE_OBSERVATIONS_SQL = """
+    SELECT
+        ph.product_id, ph.source_id, CAST(ph.price AS DOUBLE PRECISION) AS price, ph.availability,
+        EXTRACT(EPOCH FROM ph.checked_at) AS checked_at,
+        ph.checked_at < %(day_start)s AS on_prev_day,
+        ph.last_seen_at >= %(day_start)s AS on_day
+    FROM price_history ph
+    WHERE ph.last_seen_at >= %(prev_day_start)s
+      AND ph.checked_at >= %(scan_start)s
+      AND ph.checked_at < %(day_end)s
+      AND (CAST(%(source_ids)s AS INTEGER[]) IS NULL OR ph.source_id = ANY(CAST(%(source_ids)s AS INTEGER[])))
+"""
+
+SOURCE_OBSERVATION_TYPES = {
+    "product_id": pa.int32(),
+    "source_id": pa.int32(),
+    "price": pa.float64(),
+    "availability": pa.bool_(),
+    "checked_at": pa.float64(),
+    "on_prev_day": pa.bool_(),
+    "on_day": pa.bool_(),
+}
+
+DAILY_STAGING_COLUMNS = (
+    "product_id", "min_price", "max_price", "avg_price", "median_price",
+    "sources_available", "total_sources_checked", "best_source_id", "best_price",
+)
+
+CREATE_DAILY_STAGING_SQL = """
+    CREATE TEMP TABLE daily_stats_staging (
+        product_id INTEGER NOT NULL,
+        min_price NUMERIC,
+        max_price NUMERIC,
+        avg_price NUMERIC,
+        median_price NUMERIC,
+        sources_available INTEGER,
+        total_sources_checked INTEGER,
+        best_source_id INTEGER,
+        best_price NUMERIC
+    ) ON COMMIT DROP
+"""
+
+UPSERT_DAILY_FROM_STAGING_SQL = text("""
+    WITH upserted AS (
+        INSERT INTO daily_price_stats (
+            product_id, date, min_price, max_price, avg_price, median_price,
+            change_from_previous, change_percentage,
+            sources_available, total_sources_checked, best_source_id, best_price, created_at
+        )
+        SELECT
+            s.product_id, :day, s.min_price, s.max_price, s.avg_price, s.median_price,
+            s.avg_price - prev.avg_price,
+            CAST((s.avg_price - prev.avg_price) / NULLIF(prev.avg_price, 0) * 100 AS DOUBLE PRECISION),
+            s.sources_available, s.total_sources_checked, s.best_source_id, s.best_price,
+            now() AT TIME ZONE 'utc'
+        FROM daily_stats_staging s
+        LEFT JOIN daily_price_stats prev ON prev.product_id = s.product_id AND prev.date = :prev_day
+        ON CONFLICT (product_id, date) DO UPDATE SET
+            min_price = EXCLUDED.min_price,
+            max_price = EXCLUDED.max_price,
+            avg_price = EXCLUDED.avg_price,
+            median_price = EXCLUDED.median_price,
+            change_from_previous = EXCLUDED.change_from_previous,
+            change_percentage = EXCLUDED.change_percentage,
+            sources_available = EXCLUDED.sources_available,
+            total_sources_checked = EXCLUDED.total_sources_checked,
+            best_source_id = EXCLUDED.best_source_id,
+            best_price = EXCLUDED.best_price
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT
+        COUNT(*) FILTER (WHERE inserted) AS created,
+        COUNT(*) FILTER (WHERE NOT inserted) AS updated
+    FROM upserted
+""")
+
+SOURCE_STAGING_COLUMNS = (
+    "source_id", "products_scraped", "avg_price_change",
+    "products_price_increased", "products_price_decreased", "products_unavailable",
+)
+
+CREATE_SOURCE_STAGING_SQL = """
+    CREATE TEMP TABLE source_stats_staging (
+        source_id INTEGER NOT NULL,
+        products_scraped INTEGER,
+        avg_price_change DOUBLE PRECISION,
+        products_price_increased INTEGER,
+        products_price_decreased INTEGER,
+        products_unavailable INTEGER
+    ) ON COMMIT DROP
+"""
+
+UPSERT_SOURCE_FROM_STAGING_SQL = text("""
+    WITH upserted AS (
+        INSERT INTO source_daily_stats (
+            source_id, date, products_scraped, successful_scrapes, failed_scrapes, avg_response_time,
+            avg_price_change, products_price_increased, products_price_decreased, products_unavailable,
+            created_at
+        )
+        SELECT
+            s.id, :day,
+            COALESCE(a.products_scraped, 0),
+            COALESCE(c.attempts - c.failures, a.products_scraped, 0),
+            COALESCE(c.failures, 0),
+            c.response_time_total / NULLIF(c.attempts, 0),
+            COALESCE(a.avg_price_change, 0),
+            COALESCE(a.products_price_increased, 0),
+            COALESCE(a.products_price_decreased, 0),
+            COALESCE(a.products_unavailable, 0),
+            now() AT TIME ZONE 'utc'
+        FROM sources s
+        LEFT JOIN source_stats_staging a ON a.source_id = s.id
+        LEFT JOIN source_scrape_counters c ON c.source_id = s.id AND c.date = :day
+        WHERE s.is_active
+          AND (a.source_id IS NOT NULL OR c.source_id IS NOT NULL)
+          AND (CAST(:source_ids AS INTEGER[]) IS NULL OR s.id = ANY(CAST(:source_ids AS INTEGER[])))
+        ON CONFLICT (source_id, date) DO UPDATE SET
+            products_scraped = EXCLUDED.products_scraped,
+            successful_scrapes = CASE
+                WHEN EXISTS (
+                    SELECT 1 FROM source_scrape_counters c
+                    WHERE c.source_id = EXCLUDED.source_id AND c.date = EXCLUDED.date
+                ) THEN EXCLUDED.successful_scrapes
+                ELSE source_daily_stats.successful_scrapes
+            END,
+            failed_scrapes = EXCLUDED.failed_scrapes,
+            avg_response_time = EXCLUDED.avg_response_time,
+            avg_price_change = EXCLUDED.avg_price_change,
+            products_price_increased = EXCLUDED.products_price_increased,
+            products_price_decreased = EXCLUDED.products_price_decreased,
+            products_unavailable = EXCLUDED.products_unavailable
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM upserted
+""")
+
+
+def read_frame(db, sql: str, params: Dict, column_types: Dict[str, pa.DataType]) -> pd.DataFrame:
+    """Stream a query result out with COPY and parse it column-wise with Arrow"""
+    # Raw DBAPI cursor on the session's connection, so the COPY sees the caller's transaction
+    cursor = db.connection().connection.cursor()
+    query = cursor.mogrify(sql, params).decode()
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+    buffer.seek(0)
+
+    table = pacsv.read_csv(buffer, convert_options=pacsv.ConvertOptions(
+        column_types=column_types, true_values=["t"], false_values=["f"],
+    ))
+    return table.to_pandas()
+
+
+def write_staging(db, frame: pd.DataFrame, create_sql: str, table: str, columns: Tuple[str, ...]):
+    cursor = db.connection().connection.cursor()
+    cursor.execute(create_sql)
+    buffer = io.StringIO()
+    frame.to_csv(buffer, columns=list(columns), header=False, index=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def daily_stats_frame(obs: pd.DataFrame) -> pd.DataFrame:
+    """Per-product min/max/mean/median, availability and best offer of one day"""
+    prices = obs.groupby("product_id")["price"]
+    stats = prices.agg(min_price="min", max_price="max", avg_price="mean", median_price="median")
+    stats["sources_available"] = obs["availability"].fillna(False).groupby(obs["product_id"]).sum().astype(np.int64)
+    stats["total_sources_checked"] = prices.size()
+
+    # Cheapest available offer; cheapest overall when nothing is in stock (NULL sorts last)
+    rank = obs["availability"].map({True: 0, False: 1}).fillna(2)
+    best = obs.assign(rank=rank).sort_values(["product_id", "rank", "price", "source_id"]) \
+        .drop_duplicates("product_id").set_index("product_id")
+    stats["best_source_id"] = best["source_id"]
+    stats["best_price"] = best["price"]
+    return stats.reset_index()
+
+
+def source_stats_frame(obs: pd.DataFrame) -> pd.DataFrame:
+    """Per-source product counts and closing-price changes against the day before"""
+    today = obs[obs["on_day"]]
+    closes = today.sort_values("checked_at").drop_duplicates(["product_id", "source_id"], keep="last")
+    prev_closes = obs[obs["on_prev_day"]].sort_values("checked_at") \
+        .drop_duplicates(["product_id", "source_id"], keep="last")
+
+    changes = closes.merge(
+        prev_closes[["product_id", "source_id", "price"]],
+        on=["product_id", "source_id"], how="left", suffixes=("", "_prev")
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = (changes["price"] - changes["price_prev"]) / changes["price_prev"].replace(0, np.nan) * 100
+    changes = changes.assign(
+        pct_change=pct,
+        increased=pct > 0,
+        decreased=pct < 0,
+        unavailable=changes["availability"].eq(False),
+    )
+
+    by_source = changes.groupby("source_id")
+    stats = pd.DataFrame({
+        "products_scraped": by_source.size(),
+        "avg_price_change": by_source["pct_change"].mean(),
+        "products_price_increased": by_source["increased"].sum(),
+        "products_price_decreased": by_source["decreased"].sum(),
+        "products_unavailable": by_source["unavailable"].sum(),
+    })
+    return stats.reset_index()
+
+
+def upsert_daily_stats(db, calc_date: date, product_ids=None, product_range=None):
+    """Same contract as aggregation_tasks.upsert_daily_stats. Returns (created, updated)."""
+    product_min, product_max = product_range or (None, None)
+    day_start = datetime.combine(calc_date, datetime.min.time())
+    obs = read_frame(db, DAILY_OBSERVATIONS_SQL, {
+        "day_start": day_start,
+        "scan_start": interval_scan_start(day_start),
+        "day_end": datetime.combine(calc_date + timedelta(days=1), datetime.min.time()),
+        "product_ids": list(product_ids) if product_ids is not None else None,
+        "product_min": product_min,
+        "product_max": product_max,
+    }, DAILY_OBSERVATION_TYPES)
+    if obs.empty:
+        return 0, 0
+
+    write_staging(
+        db, daily_stats_frame(obs), CREATE_DAILY_STAGING_SQL, "daily_stats_staging", DAILY_STAGING_COLUMNS
+    )
+    row = db.execute(UPSERT_DAILY_FROM_STAGING_SQL, {
+        "day": calc_date,
+        "prev_day": calc_date - timedelta(days=1),
+    }).one()
+    return row.created, row.updated
+
+
+def upsert_source_stats(db, calc_date: date, source_ids=None) -> int:
+    """Same contract as aggregation_tasks.upsert_source_stats. Returns rows written."""
+    prev_day_start = datetime.combine(calc_date - timedelta(days=1), datetime.min.time())
+    obs = read_frame(db, SOURCE_OBSERVATIONS_SQL, {
+        "prev_day_start": prev_day_start,
+        "scan_start": interval_scan_start(prev_day_start),
+        "day_start": datetime.combine(calc_date, datetime.min.time()),
+        "day_end": datetime.combine(calc_date + timedelta(days=1), datetime.min.time()),
+        "source_ids": list(source_ids) if source_ids is not None else None,
+    }, SOURCE_OBSERVATION_TYPES)
+
+    write_staging(
+        db, source_stats_frame(obs) if not obs.empty else pd.DataFrame(columns=SOURCE_STAGING_COLUMNS),
+        CREATE_SOURCE_STAGING_SQL, "source_stats_staging", SOURCE_STAGING_COLUMNS
+    )
+    return db.execute(UPSERT_SOURCE_FROM_STAGING_SQL, {
+        "day": calc_date,
+        "source_ids": list(source_ids) if source_ids is not None else None,
+    }).scalar()
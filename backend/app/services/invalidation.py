@@ -0,0 +1,76 @@
+"""
+Cross-process invalidation messages over Redis pub/sub.
+
+publish(topic, **payload) reaches every process that registered a handler for
+the topic with subscribe(). Each process runs one listener thread, started on
+the first subscribe() after fork. After a reconnect handlers are called with
+{"reset": True}, since messages sent while disconnected are lost.
+"""
+from app.services.redis_client import get_redis
+from collections import defaultdict
+from typing import Callable, Dict, Any
+import json
+import logging
+import os
+import threading
+import time
+import redis
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "price_monitor:invalidate"
+
+_handlers = defaultdict(list)
+_lock = threading.Lock()
+_listener_pid = None
+
+def publish(topic: str, **payload):
+    """Send an invalidation message; failures are logged, never raised"""
+    try:
+        get_redis().publish(CHANNEL, json.dumps({"topic": topic, **payload}))
+    except redis.RedisError as e:
+        logger.warning(f"Could not publish invalidation for {topic}: {e}")
+
+def subscribe(topic: str, handler: Callable[[Dict[str, Any]], None]):
+    """Call handler(payload) for every message on topic, in this process"""
+    global _listener_pid
+    with _lock:
+        if handler not in _handlers[topic]:
+            _handlers[topic].append(handler)
+        
+        pid = os.getpid()
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+    
+    thread = threading.Thread(target=_listen, name="invalidation-listener", daemon=True)
+    thread.start()
+
+def _dispatch(topic: str, payload: Dict[str, Any]):
+    for handler in list(_handlers.get(topic, [])):
+        try:
+            handler(payload)
+        except Exception as e:
+            logger.error(f"Invalidation handler for {topic} failed: {e}")
+
+def _listen():
+    connected_before = False
+    while True:
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
+            
+            if connected_before:
+                for topic in list(_handlers):
+                    _dispatch(topic, {"reset": True})
+            connected_before = True
+            
+            for message in pubsub.listen():
+                try:
+                    payload = json.loads(message["data"])
+                except (TypeError, ValueError):
+                    continue
+                _dispatch(payload.pop("topic", None), payload)
+        except Exception as e:
+            logger.warning(f"Invalidation listener disconnected, retrying: {e}")
+            time.sleep(5)
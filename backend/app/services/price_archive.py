@@ -0,0 +1,237 @@
+"""
+Cold-tier archive of price_history in compressed Parquet files.
+
+Closed months older than the retention window are exported to
+PRICE_ARCHIVE_DIR, one file per month and source:
+
+    month=2025-01/source_id=3/data.parquet
+    month=2025-01/_manifest.json
+
+The manifest is written only after every file has been read back and its
+row count matches the database; from then on the month counts as archived
+and cleanup_old_data may drop its hot rows. Intervals still valid after the
+month end (change_only mode) are archived clipped to the month and carried
+over in the hot table, so hot and archived rows never overlap. An interval
+spanning several months is archived once per month, each part clipped to
+its month.
+
+Readers split a requested range at archive_boundary(): everything before it
+comes from the files, everything after from price_history.
+"""
+from sqlalchemy import text
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import json
+import logging
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("PRICE_ARCHIVE_DIR")  # Archiving is disabled when unset
+ARCHIVE_COMPRESSION = os.getenv("PRICE_ARCHIVE_COMPRESSION", "zstd")
+FETCH_SIZE = 50000
+
+SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("product_id", pa.int32()),
+    ("source_id", pa.int32()),
+    ("price", pa.float64()),
+    ("currency", pa.string()),
+    ("availability", pa.bool_()),
+    ("shipping_cost", pa.float64()),
+    ("discount_percentage", pa.float64()),
+    ("stock_quantity", pa.int32()),
+    ("checked_at", pa.timestamp("us")),
+    ("last_seen_at", pa.timestamp("us")),
+])
+
+MONTH_ROWS_SQL = text("""
+    SELECT
+        id, product_id, source_id,
+        CAST(price AS DOUBLE PRECISION) AS price,
+        currency, availability,
+        CAST(shipping_cost AS DOUBLE PRECISION) AS shipping_cost,
+        discount_percentage, stock_quantity,
+        GREATEST(checked_at, CAST(:month_start AS TIMESTAMP)) AS checked_at,
+        LEAST(last_seen_at, CAST(:month_end AS TIMESTAMP) - INTERVAL '1 microsecond') AS last_seen_at
+    FROM price_history
+    WHERE last_seen_at >= :month_start
+      AND checked_at < :month_end
+    ORDER BY source_id, product_id, checked_at
+""")
+
+MONTH_COUNTS_SQL = text("""
+    SELECT source_id, COUNT(*)
+    FROM price_history
+    WHERE last_seen_at >= :month_start
+      AND checked_at < :month_end
+    GROUP BY source_id
+""")
+
+
+def is_enabled() -> bool:
+    return bool(ARCHIVE_DIR)
+
+
+def next_month(month_start: date) -> date:
+    return (month_start + timedelta(days=32)).replace(day=1)
+
+
+def _month_dir(month_start: date) -> str:
+    return os.path.join(ARCHIVE_DIR, f"month={month_start:%Y-%m}")
+
+
+def _manifest_path(month_start: date) -> str:
+    return os.path.join(_month_dir(month_start), "_manifest.json")
+
+
+def _source_path(month_start: date, source_id: int) -> str:
+    return os.path.join(_month_dir(month_start), f"source_id={source_id}", "data.parquet")
+
+
+def read_manifest(month_start: date) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_manifest_path(month_start)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def archived_months() -> List[date]:
+    """Months with a complete manifest, oldest first"""
+    if not is_enabled() or not os.path.isdir(ARCHIVE_DIR):
+        return []
+    months = []
+    for name in os.listdir(ARCHIVE_DIR):
+        if name.startswith("month=") and os.path.exists(os.path.join(ARCHIVE_DIR, name, "_manifest.json")):
+            months.append(datetime.strptime(name[6:], "%Y-%m").date())
+    return sorted(months)
+
+
+def archive_boundary() -> Optional[datetime]:
+    """Rows checked before this instant are served from the archive"""
+    months = archived_months()
+    if not months:
+        return None
+    return datetime.combine(next_month(months[-1]), datetime.min.time())
+
+
+def archive_month(db, month_start: date) -> Dict[str, Any]:
+    """
+    Export one month of price_history, verify the files and write the
+    manifest. Hot rows are left in place. Idempotent: an already archived
+    month returns its manifest.
+    """
+    manifest = read_manifest(month_start)
+    if manifest:
+        return manifest
+
+    params = {
+        "month_start": datetime.combine(month_start, datetime.min.time()),
+        "month_end": datetime.combine(next_month(month_start), datetime.min.time()),
+    }
+    expected = {source_id: count for source_id, count in db.execute(MONTH_COUNTS_SQL, params).all()}
+
+    writers: Dict[int, pq.ParquetWriter] = {}
+    try:
+        result = db.execute(MONTH_ROWS_SQL.execution_options(stream_results=True), params)
+        while True:
+            rows = result.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            batch = pa.Table.from_pylist([row._asdict() for row in rows], schema=SCHEMA)
+            source_ids = batch.column("source_id")
+            for source_id in set(source_ids.to_pylist()):
+                if source_id not in writers:
+                    path = _source_path(month_start, source_id)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    writers[source_id] = pq.ParquetWriter(path + ".tmp", SCHEMA, compression=ARCHIVE_COMPRESSION)
+                writers[source_id].write_table(batch.filter(pc.equal(source_ids, source_id)))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    written = {}
+    for source_id in writers:
+        path = _source_path(month_start, source_id)
+        os.replace(path + ".tmp", path)
+        written[source_id] = pq.ParquetFile(path).metadata.num_rows
+
+    if written != expected:
+        raise RuntimeError(
+            f"Archive of {month_start:%Y-%m} does not match price_history: "
+            f"expected {expected}, written {written}"
+        )
+
+    manifest = {
+        "month": f"{month_start:%Y-%m}",
+        "rows": sum(written.values()),
+        "sources": {str(source_id): count for source_id, count in sorted(written.items())},
+        "compression": ARCHIVE_COMPRESSION,
+        "archived_at": datetime.utcnow().isoformat(),
+    }
+    with open(_manifest_path(month_start) + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(_manifest_path(month_start) + ".tmp", _manifest_path(month_start))
+
+    logger.info(f"Archived {manifest['rows']} price history rows of {manifest['month']}")
+    return manifest
+
+
+def iter_rows(date_from: datetime, date_to: datetime, product_ids: Optional[Iterable[int]] = None,
+              source_id: Optional[int] = None, columns: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Archived rows whose validity interval overlaps [date_from, date_to), read
+    one record batch at a time, in file order (not sorted).
+    """
+    paths = []
+    for month_start in archived_months():
+        month_end = datetime.combine(next_month(month_start), datetime.min.time())
+        if month_end <= date_from or datetime.combine(month_start, datetime.min.time()) >= date_to:
+            continue
+        manifest = read_manifest(month_start)
+        for sid in manifest["sources"]:
+            if source_id is None or int(sid) == source_id:
+                paths.append(_source_path(month_start, int(sid)))
+    if not paths:
+        return
+
+    condition = (ds.field("last_seen_at") >= pa.scalar(date_from, pa.timestamp("us"))) & \
+        (ds.field("checked_at") < pa.scalar(date_to, pa.timestamp("us")))
+    if product_ids is not None:
+        condition &= ds.field("product_id").isin(list(product_ids))
+
+    dataset = ds.dataset(paths, schema=SCHEMA, format="parquet")
+    for batch in dataset.to_batches(columns=columns, filter=condition, batch_size=FETCH_SIZE):
+        yield from batch.to_pylist()
+
+
+def read_rows(date_from: datetime, date_to: datetime, product_ids: Optional[Iterable[int]] = None,
+              source_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Archived rows whose validity interval overlaps [date_from, date_to),
+    ordered by checked_at.
+    """
+    return sorted(iter_rows(date_from, date_to, product_ids, source_id), key=lambda row: row["checked_at"])
+
+
+def read_observations(product_id: int, date_from: datetime, date_to: datetime,
+                      source_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Archived rows expanded to one observation per source per day, like the
+    price_observations view.
+    """
+    observations = []
+    for row in read_rows(date_from, date_to, [product_id], source_id):
+        day = datetime.combine(row["checked_at"].date(), datetime.min.time())
+        while day <= row["last_seen_at"] and day < date_to:
+            checked_at = row["checked_at"] if day.date() == row["checked_at"].date() else day
+            if checked_at >= date_from:
+                observations.append({**row, "checked_at": checked_at})
+            day += timedelta(days=1)
+    return sorted(observations, key=lambda row: row["checked_at"])
@@ -0,0 +1,307 @@
+"""
+Columnar price cube for catalog-wide analytics.
+
+Daily min/avg/max/best prices of every product are kept in one float32
+array of shape (metric, product, day) stored as an .npy file under
+PRICE_CUBE_DIR and memory-mapped by every process, so API workers share one
+copy through the page cache. Missing days are NaN. The Celery worker writes
+the cube and the API reads it, so PRICE_CUBE_DIR must be a directory both
+see (the price_cube volume in docker-compose.yml).
+
+The window covers PRICE_CUBE_DAYS days back and PRICE_CUBE_HEADROOM empty
+days ahead, so the nightly refresh only overwrites day columns in place.
+A full rebuild (new products, a day past the window) writes a new
+versioned file and swaps meta.json; readers pick it up on their next check.
+Writers (refresh and rebuild) serialize on a .lock file in the directory.
+
+Movers, dispersion and the price index are vectorized over the whole
+catalog and do not touch the database.
+"""
+from app.models.models import DailyPriceStats
+from sqlalchemy import select, text
+from datetime import date, datetime, timedelta
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+import fcntl
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CUBE_DIR = os.getenv("PRICE_CUBE_DIR", "/var/lib/price-monitor/price-cube")
+CUBE_DAYS = int(os.getenv("PRICE_CUBE_DAYS", 400))
+CUBE_HEADROOM = int(os.getenv("PRICE_CUBE_HEADROOM", 31))
+RELOAD_CHECK_INTERVAL = 5  # Seconds between meta.json checks in readers
+FETCH_SIZE = 50000
+
+METRICS = ("min_price", "avg_price", "max_price", "best_price")
+
+PRODUCTS_SQL = text("SELECT id, category FROM products ORDER BY id")
+
+DAILY_STATS_COLUMNS = (
+    DailyPriceStats.product_id, DailyPriceStats.date,
+    *(getattr(DailyPriceStats, metric) for metric in METRICS)
+)
+
+
+class PriceCube:
+    """Read-only view of the memory-mapped cube"""
+
+    def __init__(self, values: np.ndarray, meta: Dict[str, Any]):
+        self.values = values
+        self.start = date.fromisoformat(meta["start"])
+        self.last_day = date.fromisoformat(meta["last_day"]) if meta.get("last_day") else None
+        self.product_ids = np.asarray(meta["product_ids"], dtype=np.int64)
+        self.categories = np.asarray(meta["categories"], dtype=object)
+        self.version = meta["version"]
+
+    def day_index(self, day: date) -> int:
+        return (day - self.start).days
+
+    def metric(self, name: str) -> np.ndarray:
+        return self.values[METRICS.index(name)]
+
+    def product_mask(self, category: Optional[str] = None) -> np.ndarray:
+        if category is None:
+            return np.ones(len(self.product_ids), dtype=bool)
+        return self.categories == category
+
+    def movers(self, days: int, metric: str = "avg_price", category: Optional[str] = None,
+               direction: str = "down", limit: int = 20) -> List[Dict[str, Any]]:
+        """Products with the largest price change over the last days"""
+        end = self.day_index(self.last_day)
+        start = end - days
+        if start < 0:
+            return []
+
+        mask = self.product_mask(category)
+        values = self.metric(metric)
+        then, now = values[mask, start], values[mask, end]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change = (now - then) / then * 100
+        valid = np.isfinite(change)
+
+        ids = self.product_ids[mask][valid]
+        change, then, now = change[valid], then[valid], now[valid]
+        order = np.argsort(change if direction == "down" else -change)[:limit]
+        return [
+            {
+                "product_id": int(ids[i]),
+                "price_from": float(then[i]),
+                "price_to": float(now[i]),
+                "change_percentage": float(change[i]),
+            }
+            for i in order
+        ]
+
+    def dispersion(self, day: Optional[date] = None, category: Optional[str] = None,
+                   limit: int = 20) -> Dict[str, Any]:
+        """Spread between the cheapest and the most expensive source, (max - min) / avg"""
+        column = self.day_index(day or self.last_day)
+        mask = self.product_mask(category)
+        low = self.metric("min_price")[mask, column]
+        high = self.metric("max_price")[mask, column]
+        avg = self.metric("avg_price")[mask, column]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            spread = (high - low) / avg * 100
+        valid = np.isfinite(spread)
+
+        ids = self.product_ids[mask][valid]
+        spread, low, high = spread[valid], low[valid], high[valid]
+        order = np.argsort(-spread)[:limit]
+        return {
+            "products": int(valid.sum()),
+            "median_dispersion": float(np.median(spread)) if len(spread) else None,
+            "mean_dispersion": float(spread.mean()) if len(spread) else None,
+            "top": [
+                {
+                    "product_id": int(ids[i]),
+                    "min_price": float(low[i]),
+                    "max_price": float(high[i]),
+                    "dispersion_percentage": float(spread[i]),
+                }
+                for i in order
+            ],
+        }
+
+    def index(self, days: int, metric: str = "avg_price", category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Chain-linked price index (base 100): each day's link is the geometric
+        mean of day-over-day price ratios of products priced on both days.
+        """
+        end = self.day_index(self.last_day)
+        start = max(end - days, 0)
+        values = self.metric(metric)[self.product_mask(category), start:end + 1]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_ratio = np.log(values[:, 1:] / values[:, :-1])
+        valid = np.isfinite(log_ratio)
+        counts = valid.sum(axis=0)
+        links = np.where(counts > 0, np.where(valid, log_ratio, 0).sum(axis=0) / np.maximum(counts, 1), 0)
+        levels = 100 * np.exp(np.concatenate(([0.0], np.cumsum(links))))
+
+        return [
+            {
+                "date": str(self.start + timedelta(days=start + i)),
+                "index": float(level),
+                "products": int(counts[i - 1]) if i else int(np.isfinite(values[:, 0]).sum()),
+            }
+            for i, level in enumerate(levels)
+        ]
+
+
+def _meta_path() -> str:
+    return os.path.join(CUBE_DIR, "meta.json")
+
+
+def _values_path(version: int) -> str:
+    return os.path.join(CUBE_DIR, f"values-{version}.npy")
+
+
+def _read_meta() -> Optional[Dict[str, Any]]:
+    try:
+        with open(_meta_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_meta(meta: Dict[str, Any]):
+    with open(_meta_path() + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(_meta_path() + ".tmp", _meta_path())
+
+
+def _fill(db, values: np.ndarray, rows: Dict[int, int], start: date, date_from: date, date_to: date):
+    values[:, :, (date_from - start).days:(date_to - start).days + 1] = np.nan
+    result = db.execute(
+        select(*DAILY_STATS_COLUMNS).where(
+            DailyPriceStats.date >= date_from,
+            DailyPriceStats.date <= date_to
+        ).execution_options(stream_results=True)
+    )
+    while True:
+        batch = result.fetchmany(FETCH_SIZE)
+        if not batch:
+            break
+        data = np.array(
+            [[rows.get(r[0], -1), (r[1] - start).days] + [np.nan if v is None else float(v) for v in r[2:]]
+             for r in batch],
+            dtype=np.float64,
+        )
+        data = data[data[:, 0] >= 0]
+        product_rows, days = data[:, 0].astype(np.int64), data[:, 1].astype(np.int64)
+        for m in range(len(METRICS)):
+            values[m, product_rows, days] = data[:, 2 + m]
+
+
+@contextmanager
+def _write_lock():
+    """Exclusive lock of the cube writers across processes"""
+    os.makedirs(CUBE_DIR, exist_ok=True)
+    with open(os.path.join(CUBE_DIR, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def rebuild(db, last_day: date) -> Dict[str, Any]:
+    """Build a new cube ending at last_day (plus headroom) and publish it"""
+    with _write_lock():
+        return _rebuild(db, last_day)
+
+
+def _rebuild(db, last_day: date) -> Dict[str, Any]:
+    products = db.execute(PRODUCTS_SQL).all()
+    start = last_day - timedelta(days=CUBE_DAYS - 1)
+    total_days = CUBE_DAYS + CUBE_HEADROOM
+    previous = _read_meta()
+    version = (previous["version"] + 1) if previous else 1
+
+    path = _values_path(version)
+    values = np.lib.format.open_memmap(
+        path + ".tmp", mode="w+", dtype=np.float32, shape=(len(METRICS), len(products), total_days)
+    )
+    _fill(db, values, {pid: i for i, (pid, _) in enumerate(products)}, start, start, last_day)
+    values.flush()
+    del values
+    os.replace(path + ".tmp", path)
+
+    meta = {
+        "version": version,
+        "start": start.isoformat(),
+        "days": total_days,
+        "last_day": last_day.isoformat(),
+        "metrics": list(METRICS),
+        "product_ids": [pid for pid, _ in products],
+        "categories": [category for _, category in products],
+        "built_at": datetime.utcnow().isoformat(),
+    }
+    _write_meta(meta)
+
+    # Processes that still map an old file keep it until they reload
+    for name in os.listdir(CUBE_DIR):
+        if name.startswith("values-") and name != os.path.basename(path):
+            os.remove(os.path.join(CUBE_DIR, name))
+
+    logger.info(f"Price cube v{version} built: {len(products)} products, {start} - {last_day}")
+    return meta
+
+
+def refresh(db, date_from: date, date_to: date) -> Dict[str, Any]:
+    """
+    Reload the given days from daily_price_stats in place, or rebuild when
+    they fall outside the window or the product set changed.
+    """
+    with _write_lock():
+        meta = _read_meta()
+        last_day = max(date_to, date.fromisoformat(meta["last_day"])) if meta else date_to
+        if meta is None:
+            return _rebuild(db, last_day)
+
+        start = date.fromisoformat(meta["start"])
+        product_ids = [pid for pid, in db.execute(text("SELECT id FROM products ORDER BY id")).all()]
+        if (date_from < start or (date_to - start).days >= meta["days"]
+                or product_ids != meta["product_ids"]):
+            return _rebuild(db, last_day)
+
+        values = np.load(_values_path(meta["version"]), mmap_mode="r+")
+        _fill(db, values, {pid: i for i, pid in enumerate(product_ids)}, start, date_from, date_to)
+        values.flush()
+        del values
+
+        meta["last_day"] = last_day.isoformat()
+        meta["refreshed_at"] = datetime.utcnow().isoformat()
+        _write_meta(meta)
+        logger.info(f"Price cube v{meta['version']} refreshed for {date_from} - {date_to}")
+        return meta
+
+
+_cube: Optional[PriceCube] = None
+_loaded_mtime: Optional[float] = None
+_checked_at = 0.0
+
+
+def get_cube() -> Optional[PriceCube]:
+    """Per-process cube, re-mapped when meta.json changes; None until built"""
+    global _cube, _loaded_mtime, _checked_at
+    now = time.monotonic()
+    if _cube is not None and now - _checked_at < RELOAD_CHECK_INTERVAL:
+        return _cube
+    _checked_at = now
+
+    try:
+        mtime = os.stat(_meta_path()).st_mtime
+    except FileNotFoundError:
+        return None
+    if mtime != _loaded_mtime:
+        meta = _read_meta()
+        try:
+            _cube = PriceCube(np.load(_values_path(meta["version"]), mmap_mode="r"), meta)
+            _loaded_mtime = mtime
+        except FileNotFoundError:
+            pass  # Replaced by a rebuild in between, retried on the next check
+    return _cube
@@ -0,0 +1,190 @@
+"""
+Intraday price sketches per product and day.
+
+The result writer folds every incoming price into an in-memory DaySketch
+(count, sum, min, max, available count, best offer and a t-digest) in O(1)
+and persists the sketches on flush: the stored sketch row is locked, merged
+with the in-memory delta and written back, and today's DailyPriceStats row
+is upserted from the merged sketch. The nightly calculate_daily_stats run
+still recomputes the finished day exactly from price_history.
+
+Sketches of any range of days merge into one, giving weekly/monthly
+quantiles without rescanning raw history (merge_sketches).
+"""
+from app.models.models import ProductPriceSketch
+from app.services.tdigest import TDigest
+from sqlalchemy import text, tuple_
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class DaySketch:
+    """Mergeable aggregate of one product's prices"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min_price: Optional[float] = None
+        self.max_price: Optional[float] = None
+        self.available_count = 0
+        self.best_price: Optional[float] = None
+        self.best_source_id: Optional[int] = None
+        self.best_available: Optional[bool] = None
+        self.digest = TDigest()
+
+    def add(self, price: float, available: bool, source_id: int):
+        price = float(price)
+        self.count += 1
+        self.total += price
+        self.min_price = price if self.min_price is None else min(self.min_price, price)
+        self.max_price = price if self.max_price is None else max(self.max_price, price)
+        self.available_count += 1 if available else 0
+        self._offer(price, bool(available), source_id)
+        self.digest.add(price)
+
+    def merge(self, other: "DaySketch"):
+        if not other.count:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.min_price = other.min_price if self.min_price is None else min(self.min_price, other.min_price)
+        self.max_price = other.max_price if self.max_price is None else max(self.max_price, other.max_price)
+        self.available_count += other.available_count
+        if other.best_price is not None:
+            self._offer(other.best_price, other.best_available, other.best_source_id)
+        self.digest.merge(other.digest)
+
+    def quantile(self, q: float) -> Optional[float]:
+        return self.digest.quantile(q)
+
+    @property
+    def avg_price(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    @classmethod
+    def from_model(cls, row: ProductPriceSketch) -> "DaySketch":
+        sketch = cls()
+        sketch.count = row.count or 0
+        sketch.total = row.total or 0.0
+        sketch.min_price = float(row.min_price) if row.min_price is not None else None
+        sketch.max_price = float(row.max_price) if row.max_price is not None else None
+        sketch.available_count = row.available_count or 0
+        sketch.best_price = float(row.best_price) if row.best_price is not None else None
+        sketch.best_source_id = row.best_source_id
+        sketch.best_available = row.best_available
+        sketch.digest = TDigest.from_dict(row.digest)
+        return sketch
+
+    def apply_to(self, row: ProductPriceSketch):
+        row.count = self.count
+        row.total = self.total
+        row.min_price = self.min_price
+        row.max_price = self.max_price
+        row.available_count = self.available_count
+        row.best_price = self.best_price
+        row.best_source_id = self.best_source_id
+        row.best_available = self.best_available
+        row.digest = self.digest.to_dict()
+
+    def _offer(self, price: float, available: bool, source_id: int):
+        # Available offers win over unavailable ones, then the lower price
+        if self.best_price is None or (not available, price) < (not self.best_available, self.best_price):
+            self.best_price = price
+            self.best_source_id = source_id
+            self.best_available = available
+
+
+# Rows of products deleted while buffered are not created
+ENSURE_SKETCH_SQL = text("""
+    INSERT INTO product_price_sketches (product_id, date, count, total, available_count)
+    SELECT id, :date, 0, 0, 0
+    FROM products
+    WHERE id = :product_id
+    ON CONFLICT (product_id, date) DO NOTHING
+""")
+
+UPSERT_DAILY_FROM_SKETCH_SQL = text("""
+    INSERT INTO daily_price_stats (
+        product_id, date, min_price, max_price, avg_price, median_price,
+        change_from_previous, change_percentage,
+        sources_available, total_sources_checked, best_source_id, best_price, created_at
+    )
+    SELECT
+        p.id, :date, :min_price, :max_price, :avg_price, :median_price,
+        :avg_price - prev.avg_price,
+        CAST((:avg_price - prev.avg_price) / NULLIF(prev.avg_price, 0) * 100 AS DOUBLE PRECISION),
+        :sources_available, :total_sources_checked, :best_source_id, :best_price,
+        now() AT TIME ZONE 'utc'
+    FROM products p
+    LEFT JOIN daily_price_stats prev ON prev.product_id = p.id AND prev.date = :prev_date
+    WHERE p.id = :product_id
+    ON CONFLICT (product_id, date) DO UPDATE SET
+        min_price = EXCLUDED.min_price,
+        max_price = EXCLUDED.max_price,
+        avg_price = EXCLUDED.avg_price,
+        median_price = EXCLUDED.median_price,
+        change_from_previous = EXCLUDED.change_from_previous,
+        change_percentage = EXCLUDED.change_percentage,
+        sources_available = EXCLUDED.sources_available,
+        total_sources_checked = EXCLUDED.total_sources_checked,
+        best_source_id = EXCLUDED.best_source_id,
+        best_price = EXCLUDED.best_price
+""")
+
+
+def persist_sketches(db, sketches: Dict[Tuple[int, date], DaySketch]):
+    """
+    Merge in-memory sketch deltas into product_price_sketches and upsert the
+    matching DailyPriceStats rows of today. Rows of finished days are left to
+    calculate_daily_stats, which may already have written the exact values.
+    Runs inside the caller's transaction.
+    """
+    # Consistent key order so concurrent writers lock rows in the same order
+    keys = sorted(sketches)
+    db.execute(ENSURE_SKETCH_SQL, [{"product_id": product_id, "date": day} for product_id, day in keys])
+
+    rows = db.query(ProductPriceSketch).filter(
+        tuple_(ProductPriceSketch.product_id, ProductPriceSketch.date).in_(keys)
+    ).order_by(ProductPriceSketch.product_id, ProductPriceSketch.date).with_for_update().all()
+
+    now = datetime.utcnow()
+    today = date.today()
+    daily_stats = []
+    for row in rows:
+        merged = DaySketch.from_model(row)
+        merged.merge(sketches[(row.product_id, row.date)])
+        merged.apply_to(row)
+        row.updated_at = now
+        if row.date < today:
+            continue
+        daily_stats.append({
+            "product_id": row.product_id,
+            "date": row.date,
+            "prev_date": row.date - timedelta(days=1),
+            "min_price": merged.min_price,
+            "max_price": merged.max_price,
+            "avg_price": merged.avg_price,
+            "median_price": merged.quantile(0.5),
+            "sources_available": merged.available_count,
+            "total_sources_checked": merged.count,
+            "best_source_id": merged.best_source_id,
+            "best_price": merged.best_price,
+        })
+    db.flush()
+
+    if daily_stats:
+        db.execute(UPSERT_DAILY_FROM_SKETCH_SQL, daily_stats)
+
+
+def merge_sketches(db, product_ids: Iterable[int], date_from: date, date_to: date) -> Dict[int, DaySketch]:
+    """Merge stored daily sketches per product over [date_from, date_to]"""
+    rows = db.query(ProductPriceSketch).filter(
+        ProductPriceSketch.product_id.in_(list(product_ids)),
+        ProductPriceSketch.date >= date_from,
+        ProductPriceSketch.date <= date_to
+    ).all()
+
+    merged: Dict[int, DaySketch] = {}
+    for row in rows:
+        merged.setdefault(row.product_id, DaySketch()).merge(DaySketch.from_model(row))
+    return merged
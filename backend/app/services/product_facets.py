@@ -0,0 +1,204 @@
+"""
+Precomputed facet structure for the catalog browser.
+
+Each API process keeps the catalog as NumPy arrays indexed by position in
+the sorted product id array:
+
+    category, brand, availability   one value code per product
+    source                          one (position, source code) pair per active mapping
+    is_active                       boolean
+
+A browse request turns its filters into one boolean mask and counts every
+facet with np.bincount over the products matching the *other* facets'
+filters (selecting a brand does not hide the other brands). No GROUP BY
+runs per request.
+
+The structure is rebuilt lazily: after a "products" or "product_sources"
+invalidation message, and every PRODUCT_FACETS_TTL seconds, since
+availability follows scrapes.
+"""
+from app.models.database import SessionLocal
+from app.models.models import CurrentPrice, Product, ProductSource, Source
+from app.services import invalidation
+from sqlalchemy import case, func
+from typing import Any, Dict, List, Optional, Sequence
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FACETS_TTL = int(os.getenv("PRODUCT_FACETS_TTL", 300))
+
+AVAILABILITY_VALUES = [None, "available", "unavailable"]  # None: no current price yet
+
+
+def _encode(values: Sequence[Optional[str]]):
+    """Codes per value and the value list; code 0 is reserved for None"""
+    names = [None] + sorted({v for v in values if v is not None})
+    codes = {name: i for i, name in enumerate(names)}
+    return np.fromiter((codes[v] for v in values), dtype=np.int32, count=len(values)), names
+
+
+class FacetIndex:
+    """Immutable snapshot of the catalog facets"""
+
+    def __init__(self, db):
+        products = db.query(
+            Product.id, Product.category, Product.brand, Product.is_active
+        ).order_by(Product.id).all()
+        self.product_ids = np.fromiter((p.id for p in products), dtype=np.int64, count=len(products))
+        self.is_active = np.fromiter((bool(p.is_active) for p in products), dtype=bool, count=len(products))
+        self.category, self.categories = _encode([p.category for p in products])
+        self.brand, self.brands = _encode([p.brand for p in products])
+
+        # Available when at least one source has it in stock
+        available = dict(db.query(
+            CurrentPrice.product_id, func.max(case((CurrentPrice.availability == True, 1), else_=0))
+        ).group_by(CurrentPrice.product_id).all())
+        self.availability = np.fromiter(
+            (0 if pid not in available else (1 if available[pid] else 2) for pid in self.product_ids.tolist()),
+            dtype=np.int32, count=len(products)
+        )
+
+        self.source_names = dict(db.query(Source.id, Source.name).all())
+        self.source_ids = sorted(self.source_names)
+        source_codes = {source_id: i for i, source_id in enumerate(self.source_ids)}
+        mappings = db.query(ProductSource.product_id, ProductSource.source_id).filter(
+            ProductSource.is_active == True
+        ).distinct().all()
+        mappings = [(pid, sid) for pid, sid in mappings if sid in source_codes]
+        positions = self.positions([pid for pid, _ in mappings])
+        known = positions >= 0
+        self.mapping_position = positions[known]
+        self.mapping_source = np.fromiter(
+            (source_codes[sid] for _, sid in mappings), dtype=np.int32, count=len(mappings)
+        )[known]
+
+        self.built_at = time.time()
+
+    def positions(self, product_ids: Sequence[int]) -> np.ndarray:
+        """Positions of the given ids in product_ids, -1 when unknown"""
+        ids = np.asarray(product_ids, dtype=np.int64)
+        positions = np.searchsorted(self.product_ids, ids)
+        positions = np.minimum(positions, max(len(self.product_ids) - 1, 0))
+        found = self.product_ids[positions] == ids if len(self.product_ids) else np.zeros(len(ids), dtype=bool)
+        return np.where(found, positions, -1)
+
+    def _value_mask(self, codes: np.ndarray, names: List[Any], selected) -> Optional[np.ndarray]:
+        if not selected:
+            return None
+        wanted = [names.index(value) for value in selected if value in names]
+        return np.isin(codes, wanted)
+
+    def _source_mask(self, source_ids) -> Optional[np.ndarray]:
+        if not source_ids:
+            return None
+        wanted = [i for i, sid in enumerate(self.source_ids) if sid in set(source_ids)]
+        mask = np.zeros(len(self.product_ids), dtype=bool)
+        mask[self.mapping_position[np.isin(self.mapping_source, wanted)]] = True
+        return mask
+
+    def browse(self, categories=None, brands=None, source_ids=None, availability=None,
+               is_active: Optional[bool] = None, product_ids: Optional[Sequence[int]] = None,
+               after_id: Optional[int] = None, limit: int = 50) -> Dict[str, Any]:
+        """Ids of the requested page, the total and counts per facet value"""
+        base = np.ones(len(self.product_ids), dtype=bool)
+        if is_active is not None:
+            base &= self.is_active == is_active
+        if product_ids is not None:
+            positions = self.positions(product_ids)
+            base_ids = np.zeros(len(self.product_ids), dtype=bool)
+            base_ids[positions[positions >= 0]] = True
+            base &= base_ids
+
+        masks = {
+            "category": self._value_mask(self.category, self.categories, categories),
+            "brand": self._value_mask(self.brand, self.brands, brands),
+            "availability": self._value_mask(self.availability, AVAILABILITY_VALUES, availability),
+            "source": self._source_mask(source_ids),
+        }
+
+        def matching(excluded: Optional[str] = None) -> np.ndarray:
+            mask = base.copy()
+            for facet, facet_mask in masks.items():
+                if facet != excluded and facet_mask is not None:
+                    mask &= facet_mask
+            return mask
+
+        def counts(codes: np.ndarray, names: List[Any], mask: np.ndarray) -> List[Dict[str, Any]]:
+            totals = np.bincount(codes[mask], minlength=len(names))
+            return [
+                {"value": names[i], "count": int(totals[i])}
+                for i in np.argsort(-totals, kind="stable") if names[i] is not None and totals[i]
+            ]
+
+        source_mask = matching("source")
+        source_totals = np.bincount(
+            self.mapping_source[source_mask[self.mapping_position]], minlength=len(self.source_ids)
+        )
+
+        selected = matching()
+        start = int(np.searchsorted(self.product_ids, after_id, side="right")) if after_id is not None else 0
+        page = self.product_ids[start:][selected[start:]][:limit]
+
+        return {
+            "product_ids": page.tolist(),
+            "total": int(selected.sum()),
+            "facets": {
+                "category": counts(self.category, self.categories, matching("category")),
+                "brand": counts(self.brand, self.brands, matching("brand")),
+                "availability": counts(self.availability, AVAILABILITY_VALUES, matching("availability")),
+                "source": [
+                    {"value": self.source_ids[i], "name": self.source_names[self.source_ids[i]],
+                     "count": int(source_totals[i])}
+                    for i in np.argsort(-source_totals, kind="stable") if source_totals[i]
+                ],
+            },
+        }
+
+
+_index: Optional[FacetIndex] = None
+_stale = True
+_lock = threading.Lock()
+_subscribed = False
+
+
+def _on_catalog_message(payload: Dict[str, Any]):
+    global _stale
+    _stale = True
+
+
+def get_index(db=None) -> FacetIndex:
+    """Current snapshot, rebuilt first when invalidated or older than the TTL"""
+    global _index, _stale, _subscribed
+    if not _subscribed:
+        invalidation.subscribe("products", _on_catalog_message)
+        invalidation.subscribe("product_sources", _on_catalog_message)
+        _subscribed = True
+
+    if _index is not None and not _stale and time.time() - _index.built_at < FACETS_TTL:
+        return _index
+
+    with _lock:
+        if _index is None or _stale or time.time() - _index.built_at >= FACETS_TTL:
+            # Cleared before the build, so changes during it trigger another one
+            _stale = False
+            session = db or SessionLocal()
+            try:
+                started = time.perf_counter()
+                _index = FacetIndex(session)
+                logger.info(
+                    f"Product facets built: {len(_index.product_ids)} products "
+                    f"in {time.perf_counter() - started:.2f}s"
+                )
+            except Exception:
+                _stale = True
+                raise
+            finally:
+                if db is None:
+                    session.close()
+    return _index
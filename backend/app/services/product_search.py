@@ -0,0 +1,71 @@
+"""
+Ranked product search on pg_trgm indexes.
+
+Names and SKUs are compared through product_search_norm() (lowercase,
+Polish diacritics folded), so "laczowka" finds "Łączówka". A term is
+matched as a substring of the name, SKU or EAN, or as a fuzzy word of the
+name (word_similarity), all served by the GIN trigram indexes from
+migration 20261018_10 instead of a sequential ILIKE scan.
+
+A term without spaces is first looked up as an exact SKU or EAN on the
+btree indexes; when it hits, only those products are returned.
+
+Results are ranked: exact SKU/EAN, then names starting with the term,
+then by word similarity, then by id.
+"""
+from app.models.models import Product
+from sqlalchemy import case, func, or_
+from sqlalchemy.orm import Query, Session
+
+# Mirrors product_search_norm() in the database
+_POLISH = str.maketrans("ąćęłńóśźżĄĆĘŁŃÓŚŹŻ", "acelnoszzacelnoszz")
+
+
+def normalize(term: str) -> str:
+    return term.strip().translate(_POLISH).lower()
+
+
+def _like_pattern(term: str, prefix_only: bool = False) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%" if prefix_only else f"%{escaped}%"
+
+
+def exact_matches(db: Session, term: str) -> list:
+    """Ids of products whose SKU (case-insensitive) or EAN equals the term"""
+    term = term.strip()
+    if not term or any(c.isspace() for c in term):
+        return []
+    return [
+        product_id for product_id, in db.query(Product.id).filter(
+            or_(func.lower(Product.sku) == term.lower(), Product.ean == term)
+        ).all()
+    ]
+
+
+def apply_search(db: Session, query: Query, term: str) -> Query:
+    """Filter query (over Product) by the search term and order it by rank"""
+    exact_ids = exact_matches(db, term)
+    if exact_ids:
+        return query.filter(Product.id.in_(exact_ids)).order_by(Product.id)
+
+    norm = normalize(term)
+    name = func.product_search_norm(Product.name)
+    sku = func.product_search_norm(Product.sku)
+    contains = _like_pattern(norm)
+
+    conditions = [
+        name.like(contains, escape="\\"),
+        sku.like(contains, escape="\\"),
+        Product.ean.like(_like_pattern(term.strip()), escape="\\"),
+    ]
+    if len(norm) >= 3:
+        # name %> term: a word of the name is within pg_trgm.word_similarity_threshold
+        # of the term (typos); shorter terms have too few trigrams to compare
+        conditions.append(name.op("%>")(norm))
+    query = query.filter(or_(*conditions))
+
+    rank = case(
+        (name.like(_like_pattern(norm, prefix_only=True), escape="\\"), 1),
+        else_=0
+    )
+    return query.order_by(rank.desc(), func.word_similarity(norm, name).desc(), Product.id)
@@ -0,0 +1,257 @@
+"""
+In-process prefix index for product autocomplete.
+
+Every API process keeps one sorted list of (key, field, ref) entries, where
+key is a normalized prefix target (see product_search.normalize):
+
+    name      each word start of the name, so "bosch" finds "Wiertarka Bosch"
+    sku, ean  the whole value
+    brand, category  distinct values, ref is the value itself
+
+A lookup is a bisect to the first key >= prefix followed by a scan while keys
+still start with it, so suggestions never touch Postgres.
+
+The index is loaded in a background thread at startup, retried with backoff
+until it succeeds, and kept current through the "products" invalidation
+topic: product writes call products_changed(), which applies the change
+here and publishes it; other processes reload only those products. A
+listener reconnect triggers a full reload.
+"""
+from app.models.database import SessionLocal
+from app.models.models import Product
+from app.services import invalidation
+from app.services.product_search import normalize
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_SCAN = 2000  # Entries inspected per lookup, bounds very short prefixes
+LOAD_BATCH_SIZE = 10000
+LOAD_RETRY_MIN = 1  # Seconds before the first retry of a failed load, doubled up to LOAD_RETRY_MAX
+LOAD_RETRY_MAX = 60
+
+PRODUCT_FIELDS = ("name", "sku", "ean")
+VALUE_FIELDS = ("brand", "category")
+
+
+class IndexedProduct(NamedTuple):
+    id: int
+    name: str
+    sku: Optional[str]
+    ean: Optional[str]
+    brand: Optional[str]
+    category: Optional[str]
+    is_active: bool
+
+
+def _product_keys(product: IndexedProduct) -> List[tuple]:
+    entries = set()
+    words = normalize(product.name or "").split()
+    for i in range(len(words)):
+        entries.add((" ".join(words[i:]), "name", product.id))
+    for field in ("sku", "ean"):
+        value = getattr(product, field)
+        if value:
+            entries.add((normalize(value), field, product.id))
+    return list(entries)
+
+
+class SuggestIndex:
+    """Sorted prefix index over the product catalog of this process"""
+
+    def __init__(self):
+        self._entries: List[tuple] = []
+        self._products: Dict[int, IndexedProduct] = {}
+        self._values = {field: Counter() for field in VALUE_FIELDS}
+        self._lock = threading.RLock()
+        self.loaded_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    def load(self):
+        """Rebuild from the products table and swap it in"""
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            products = {}
+            query = db.query(
+                Product.id, Product.name, Product.sku, Product.ean,
+                Product.brand, Product.category, Product.is_active
+            ).yield_per(LOAD_BATCH_SIZE)
+            for row in query:
+                products[row.id] = IndexedProduct(*row)
+        finally:
+            db.close()
+
+        entries = []
+        values = {field: Counter() for field in VALUE_FIELDS}
+        for product in products.values():
+            entries.extend(_product_keys(product))
+            for field in VALUE_FIELDS:
+                if getattr(product, field):
+                    values[field][getattr(product, field)] += 1
+        for field, counts in values.items():
+            entries.extend((normalize(value), field, value) for value in counts)
+        entries.sort()
+
+        with self._lock:
+            self._entries, self._products, self._values = entries, products, values
+            self.loaded_at = time.time()
+        logger.info(
+            f"Suggest index loaded: {len(products)} products, {len(entries)} keys "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    def _remove_entry(self, entry: tuple):
+        i = bisect_left(self._entries, entry)
+        if i < len(self._entries) and self._entries[i] == entry:
+            del self._entries[i]
+
+    def _count_value(self, field: str, value: Optional[str], delta: int):
+        if not value:
+            return
+        counts = self._values[field]
+        counts[value] += delta
+        if delta > 0 and counts[value] == delta:
+            insort(self._entries, (normalize(value), field, value))
+        elif counts[value] <= 0:
+            del counts[value]
+            self._remove_entry((normalize(value), field, value))
+
+    def upsert(self, product: IndexedProduct):
+        with self._lock:
+            self.remove(product.id)
+            self._products[product.id] = product
+            for entry in _product_keys(product):
+                insort(self._entries, entry)
+            for field in VALUE_FIELDS:
+                self._count_value(field, getattr(product, field), 1)
+
+    def remove(self, product_id: int):
+        with self._lock:
+            product = self._products.pop(product_id, None)
+            if product is None:
+                return
+            for entry in _product_keys(product):
+                self._remove_entry(entry)
+            for field in VALUE_FIELDS:
+                self._count_value(field, getattr(product, field), -1)
+
+    def refresh(self, db, product_ids: Iterable[int]):
+        """Re-read the given products; missing ones are removed"""
+        product_ids = set(product_ids)
+        rows = db.query(
+            Product.id, Product.name, Product.sku, Product.ean,
+            Product.brand, Product.category, Product.is_active
+        ).filter(Product.id.in_(product_ids)).all()
+        found = {row.id: IndexedProduct(*row) for row in rows}
+        with self._lock:
+            for product_id in product_ids:
+                if product_id in found:
+                    self.upsert(found[product_id])
+                else:
+                    self.remove(product_id)
+
+    def suggest(self, prefix: str, limit: int = 10, active_only: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+        """Products (by name, SKU or EAN) and brand/category values starting with prefix"""
+        key = normalize(prefix)
+        result = {"products": [], "brands": [], "categories": []}
+        if not key:
+            return result
+
+        seen = set()
+        with self._lock:
+            i = bisect_left(self._entries, (key,))
+            end = min(len(self._entries), i + MAX_SCAN)
+            while i < end:
+                entry_key, field, ref = self._entries[i]
+                i += 1
+                if not entry_key.startswith(key):
+                    break
+
+                if field in VALUE_FIELDS:
+                    target = result["brands" if field == "brand" else "categories"]
+                    if len(target) < limit:
+                        target.append({"value": ref, "products": self._values[field][ref]})
+                    continue
+
+                product = self._products.get(ref)
+                if ref in seen or len(result["products"]) >= limit or product is None:
+                    continue
+                if active_only and not product.is_active:
+                    continue
+                seen.add(ref)
+                result["products"].append({
+                    "id": product.id,
+                    "name": product.name,
+                    "sku": product.sku,
+                    "ean": product.ean,
+                    "brand": product.brand,
+                    "category": product.category,
+                    "matched": field,
+                })
+        return result
+
+
+index = SuggestIndex()
+_loader: Optional[threading.Thread] = None
+_loader_lock = threading.Lock()
+
+
+def _load_until_loaded():
+    delay = LOAD_RETRY_MIN
+    while True:
+        try:
+            index.load()
+            return
+        except Exception as e:
+            # Suggestions answer 503 until a load succeeds
+            logger.error(f"Could not load the suggest index, retrying in {delay}s: {e}")
+        time.sleep(delay)
+        delay = min(delay * 2, LOAD_RETRY_MAX)
+
+
+def load_in_background():
+    """Full reload in a daemon thread, retried until it succeeds; one at a time"""
+    global _loader
+    with _loader_lock:
+        if _loader is not None and _loader.is_alive():
+            return
+        _loader = threading.Thread(target=_load_until_loaded, name="suggest-index-load", daemon=True)
+        _loader.start()
+
+
+def _on_products_message(payload: Dict[str, Any]):
+    if payload.get("reset"):
+        load_in_background()
+        return
+    db = SessionLocal()
+    try:
+        index.refresh(db, payload.get("product_ids", []))
+    finally:
+        db.close()
+
+
+def start():
+    """Follow catalog changes and load the index in the background (call once per API process)"""
+    invalidation.subscribe("products", _on_products_message)
+    load_in_background()
+
+
+def products_changed(db, product_ids: Iterable[int]):
+    """Apply committed product changes to this process and publish them to the others"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    try:
+        index.refresh(db, product_ids)
+    except Exception as e:
+        logger.warning(f"Could not refresh the suggest index: {e}")
+    invalidation.publish("products", product_ids=product_ids)
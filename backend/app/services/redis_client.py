@@ -0,0 +1,17 @@
+import os
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Same Redis as the Celery broker (strip trailing slash, see celery_app)
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0").rstrip('/')
+
+_client = None
+
+def get_redis() -> redis.Redis:
+    """Shared Redis client (connection pool is re-created after fork by redis-py)"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _client
@@ -0,0 +1,312 @@
+"""
+Two-tier response cache for dashboard and analytics endpoints.
+
+Responses are cached per endpoint and parameters (never per user) in an
+in-process LRU and in Redis, shared by all API processes. Each entry is
+tagged with the generation counters of the data scopes it was computed from:
+
+    prices   bumped by the result writer, at most once per RESPONSE_CACHE_TTL
+    stats    bumped by the aggregation and backfill tasks
+    catalog  bumped by product, source and mapping writes in the API
+
+invalidate(scope) increments the counter, so entries with an older tag stop
+being fresh everywhere at once. invalidate_debounced(scope) bumps at once
+and then at most once per CACHE_TTL (a SET NX marker key): calls inside the
+window only mark the scope dirty, and the first generations() read after
+the window applies the pending bump. A running scrape, which flushes every
+few seconds, therefore still lets cached responses be hit.
+
+Every invalidation also bumps a separate, never debounced version counter
+per scope (versions()), which is what ETags are computed from: a
+conditional GET must not validate data that changed inside the window. The tag also holds the current day, since
+the endpoints compute "today" relative ranges.
+
+An entry that is outdated (older tag or older than its TTL) but younger than
+its stale TTL is still served, while one background thread recomputes it
+(stale-while-revalidate). A real miss is computed by one request only: the
+others wait on a Redis lock (and a local lock) for its result instead of
+running the same queries (stampede protection).
+
+Redis errors fail open: the local tier keeps working with generation 0.
+Hits, misses and stale serves are counted per endpoint, see stats().
+"""
+from app.models.database import SessionLocal
+from app.services.redis_client import get_redis
+from collections import Counter, OrderedDict
+from datetime import date
+from fastapi.encoders import jsonable_encoder
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import redis
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 300))
+CACHE_STALE_TTL = int(os.getenv("RESPONSE_CACHE_STALE_TTL", 3600))
+LOCAL_SIZE = int(os.getenv("RESPONSE_CACHE_LOCAL_SIZE", 512))
+LOCK_TTL = 60  # Seconds a computing request may hold the stampede lock
+LOCK_WAIT = 10  # Seconds other requests wait for its result
+LOCK_POLL = 0.05
+KEY_LOCK_STRIPES = 64  # Local fill locks, shared by hash so their number stays fixed
+
+_GENERATION_KEY = "response_cache:gen:{}"
+_VERSION_KEY = "response_cache:version:{}"
+_ENTRY_KEY = "response_cache:entry:{}"
+_LOCK_KEY = "response_cache:lock:{}"
+_DEBOUNCE_KEY = "response_cache:debounce:{}"
+_DIRTY_KEY = "response_cache:dirty:{}"
+_METRICS_KEY = "response_cache:metrics"
+
+_local: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_local_lock = threading.Lock()
+_key_locks = [threading.Lock() for _ in range(KEY_LOCK_STRIPES)]
+_refreshing = set()
+_metrics = Counter()
+
+
+def invalidate(*scopes: str):
+    """Make cached responses computed from these scopes outdated; never raises"""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for scope in scopes:
+            pipe.incr(_GENERATION_KEY.format(scope))
+            pipe.incr(_VERSION_KEY.format(scope))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not invalidate response cache scopes {scopes}: {e}")
+
+
+def invalidate_debounced(scope: str):
+    """invalidate(scope) at most once per CACHE_TTL; later calls are applied when the window ends"""
+    try:
+        client = get_redis()
+        client.incr(_VERSION_KEY.format(scope))
+        if client.set(_DEBOUNCE_KEY.format(scope), "1", nx=True, ex=CACHE_TTL):
+            pipe = client.pipeline(transaction=False)
+            pipe.delete(_DIRTY_KEY.format(scope))
+            pipe.incr(_GENERATION_KEY.format(scope))
+            pipe.execute()
+        else:
+            client.set(_DIRTY_KEY.format(scope), "1")
+    except redis.RedisError as e:
+        logger.warning(f"Could not invalidate response cache scope {scope}: {e}")
+
+
+def _apply_pending(client, scope: str) -> Optional[int]:
+    # Only the reader that removes the dirty mark bumps, and opens the next window
+    if not client.delete(_DIRTY_KEY.format(scope)):
+        return None
+    client.set(_DEBOUNCE_KEY.format(scope), "1", nx=True, ex=CACHE_TTL)
+    return client.incr(_GENERATION_KEY.format(scope))
+
+
+def generations(scopes: Sequence[str]) -> Optional[List[int]]:
+    """Current generation of each scope (pending debounced bumps applied), None when Redis is unavailable"""
+    try:
+        client = get_redis()
+        values = client.mget(
+            [_GENERATION_KEY.format(scope) for scope in scopes]
+            + [_DIRTY_KEY.format(scope) for scope in scopes]
+            + [_DEBOUNCE_KEY.format(scope) for scope in scopes]
+        )
+        count = len(scopes)
+        current = [int(value or 0) for value in values[:count]]
+        for i, scope in enumerate(scopes):
+            if values[count + i] and not values[2 * count + i]:
+                current[i] = _apply_pending(client, scope) or current[i]
+    except redis.RedisError:
+        return None
+    return current
+
+
+def versions(scopes: Sequence[str]) -> Optional[List[int]]:
+    """Write counter of each scope, bumped by every invalidation; None when Redis is unavailable"""
+    try:
+        values = get_redis().mget([_VERSION_KEY.format(scope) for scope in scopes])
+    except redis.RedisError:
+        return None
+    return [int(value or 0) for value in values]
+
+
+def _tag(scopes: Sequence[str]) -> str:
+    current = generations(scopes) or [0] * len(scopes)
+    return ":".join([date.today().isoformat()] + [f"{scope}={gen}" for scope, gen in zip(scopes, current)])
+
+
+def _base_key(namespace: str, params: Dict[str, Any]) -> str:
+    digest = hashlib.sha1(json.dumps(jsonable_encoder(params), sort_keys=True).encode()).hexdigest()[:16]
+    return f"{namespace}:{digest}"
+
+
+def _count(namespace: str, outcome: str):
+    _metrics[f"{namespace}:{outcome}"] += 1
+    try:
+        get_redis().hincrby(_METRICS_KEY, f"{namespace}:{outcome}", 1)
+    except redis.RedisError:
+        pass
+
+
+def _local_get(base: str) -> Optional[Dict[str, Any]]:
+    with _local_lock:
+        entry = _local.get(base)
+        if entry is not None:
+            _local.move_to_end(base)
+        return entry
+
+
+def _local_put(base: str, entry: Dict[str, Any]):
+    with _local_lock:
+        _local[base] = entry
+        _local.move_to_end(base)
+        while len(_local) > LOCAL_SIZE:
+            _local.popitem(last=False)
+
+
+def _shared_get(base: str) -> Optional[Dict[str, Any]]:
+    try:
+        data = get_redis().get(_ENTRY_KEY.format(base))
+    except redis.RedisError:
+        return None
+    return json.loads(data) if data else None
+
+
+def _store(base: str, tag: str, value: Any, stale_ttl: int) -> Dict[str, Any]:
+    entry = {"tag": tag, "stored_at": time.time(), "value": value}
+    _local_put(base, entry)
+    try:
+        get_redis().set(_ENTRY_KEY.format(base), json.dumps(entry), ex=stale_ttl)
+    except redis.RedisError as e:
+        logger.warning(f"Could not store cached response {base}: {e}")
+    return entry
+
+
+def _is_fresh(entry: Optional[Dict[str, Any]], tag: str, ttl: int) -> bool:
+    return entry is not None and entry["tag"] == tag and time.time() - entry["stored_at"] < ttl
+
+
+def _lock(name: str) -> bool:
+    try:
+        return bool(get_redis().set(_LOCK_KEY.format(name), "1", nx=True, ex=LOCK_TTL))
+    except redis.RedisError:
+        return True  # Without Redis every process computes for itself
+
+
+def _unlock(name: str):
+    try:
+        get_redis().delete(_LOCK_KEY.format(name))
+    except redis.RedisError:
+        pass
+
+
+def _compute(compute: Callable, db=None):
+    if db is not None:
+        return jsonable_encoder(compute(db))
+    session = SessionLocal()
+    try:
+        return jsonable_encoder(compute(session))
+    finally:
+        session.close()
+
+
+def _refresh_in_background(base: str, tag: str, compute: Callable, stale_ttl: int):
+    with _local_lock:
+        if base in _refreshing:
+            return
+        _refreshing.add(base)
+
+    def run():
+        try:
+            if _lock(f"{base}:{tag}"):
+                try:
+                    _store(base, tag, _compute(compute), stale_ttl)
+                finally:
+                    _unlock(f"{base}:{tag}")
+        except Exception as e:
+            logger.error(f"Background refresh of {base} failed: {e}")
+        finally:
+            with _local_lock:
+                _refreshing.discard(base)
+
+    threading.Thread(target=run, name="response-cache-refresh", daemon=True).start()
+
+
+def get_or_compute(namespace: str, params: Dict[str, Any], scopes: Sequence[str], compute: Callable,
+                   db=None, ttl: int = CACHE_TTL, stale_ttl: int = CACHE_STALE_TTL) -> Any:
+    """
+    Cached JSON-ready result of compute(db). db is used only when this request
+    computes; background refreshes open their own session.
+    """
+    return get_entry(namespace, params, scopes, compute, db, ttl, stale_ttl)["value"]
+
+
+def get_entry(namespace: str, params: Dict[str, Any], scopes: Sequence[str], compute: Callable,
+              db=None, ttl: int = CACHE_TTL, stale_ttl: int = CACHE_STALE_TTL) -> Dict[str, Any]:
+    """
+    Like get_or_compute, but the whole entry: value, tag and stored_at identify
+    the response. An outdated entry served while it is refreshed has stale=True.
+    """
+    base = _base_key(namespace, params)
+    tag = _tag(scopes)
+
+    entry = _local_get(base)
+    if _is_fresh(entry, tag, ttl):
+        _count(namespace, "hit_local")
+        return entry
+
+    shared = _shared_get(base)
+    if _is_fresh(shared, tag, ttl):
+        _local_put(base, shared)
+        _count(namespace, "hit_shared")
+        return shared
+
+    newest = max((e for e in (entry, shared) if e), key=lambda e: e["stored_at"], default=None)
+    if newest is not None and time.time() - newest["stored_at"] < stale_ttl:
+        _refresh_in_background(base, tag, compute, stale_ttl)
+        _count(namespace, "stale")
+        return {**newest, "stale": True}
+
+    with _key_locks[hash(base) % KEY_LOCK_STRIPES]:
+        entry = _local_get(base)
+        if _is_fresh(entry, tag, ttl):
+            _count(namespace, "hit_local")
+            return entry
+
+        lock_name = f"{base}:{tag}"
+        locked = _lock(lock_name)
+        if not locked:
+            # Another process is computing it; wait for its result
+            deadline = time.monotonic() + LOCK_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL)
+                shared = _shared_get(base)
+                if _is_fresh(shared, tag, ttl):
+                    _local_put(base, shared)
+                    _count(namespace, "hit_shared")
+                    return shared
+
+        _count(namespace, "miss")
+        try:
+            return _store(base, tag, _compute(compute, db), stale_ttl)
+        finally:
+            if locked:
+                _unlock(lock_name)
+
+
+def stats() -> Dict[str, Any]:
+    """Hit/miss counters of this process and of all processes (from Redis)"""
+    try:
+        shared = {field: int(count) for field, count in get_redis().hgetall(_METRICS_KEY).items()}
+    except redis.RedisError:
+        shared = None
+    return {
+        "local": dict(_metrics),
+        "shared": shared,
+        "local_entries": len(_local),
+        "ttl": CACHE_TTL,
+        "stale_ttl": CACHE_STALE_TTL,
+    }
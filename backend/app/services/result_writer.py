@@ -0,0 +1,467 @@
+"""
+Buffered writer for scrape results.
+
+Scrape tasks hand their results to the per-process ResultWriter instead of
+committing one PriceHistory row each. Buffered rows are flushed in a single
+transaction: COPY into a temp staging table, one INSERT ... SELECT into
+price_history and one UPDATE ... FROM for product_sources.
+
+A flush happens when the buffer reaches RESULT_WRITER_BATCH_SIZE rows or when
+the oldest buffered row is older than RESULT_WRITER_FLUSH_INTERVAL seconds.
+
+PRICE_STORAGE_MODE selects how price_history is written:
+    append       - one row per scrape (default)
+    change_only  - a new row only when price, currency, availability or
+                   shipping changes; otherwise last_seen_at of the current
+                   row is extended. Only the newest result per mapping in a
+                   batch is considered. A row is not extended past
+                   PRICE_MAX_INTERVAL_DAYS, so readers of a day only look
+                   that far back in checked_at (see interval_scan_start).
+
+The newest result per mapping is upserted into current_prices on the same
+flush; previous_price/price_changed_at only move when the price changes.
+
+Every flush also writes a price_change_events row for each mapping whose
+newest price or availability differs from its current price_history row,
+in the same transaction, and then queues event_tasks.process_price_events.
+
+Scrape attempts (successes and failures, with response times) are counted
+in memory per source and day and added to source_scrape_counters on the
+same flush.
+
+Each result is also folded into an in-memory DaySketch per product and day
+(see price_sketches), merged into product_price_sketches and that day's
+DailyPriceStats row on flush.
+
+A batch that still fails after RESULT_WRITER_MAX_RETRIES flushes is spilled
+to a Redis list instead of being dropped. Every successful flush then
+writes one spilled batch in a transaction of its own (never mixed with the
+live buffer); a batch that fails RESULT_WRITER_MAX_REPLAYS replays is moved
+to a dead-letter list for inspection.
+"""
+from app.models.database import SessionLocal
+from app.services.price_sketches import DaySketch, persist_sketches
+from app.services import response_cache
+from app.services.redis_client import get_redis
+from app.tasks.celery_app import celery_app
+from sqlalchemy import text
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import time
+import redis
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("RESULT_WRITER_BATCH_SIZE", 500))
+FLUSH_INTERVAL = float(os.getenv("RESULT_WRITER_FLUSH_INTERVAL", 5))
+MAX_RETRIES = int(os.getenv("RESULT_WRITER_MAX_RETRIES", 3))
+STORAGE_MODE = os.getenv("PRICE_STORAGE_MODE", "append")
+MAX_REPLAYS = int(os.getenv("RESULT_WRITER_MAX_REPLAYS", 5))
+SPILL_KEY = "result_writer:spilled"
+DEAD_LETTER_KEY = "result_writer:dead_letter"
+MAX_INTERVAL_DAYS = int(os.getenv("PRICE_MAX_INTERVAL_DAYS", 7))  # Longest change_only validity interval
+
+STAGING_COLUMNS = (
+    "product_id", "source_id", "price", "currency",
+    "availability", "shipping_cost", "checked_at",
+)
+
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE scrape_results_staging (
+        product_id INTEGER NOT NULL,
+        source_id INTEGER NOT NULL,
+        price NUMERIC(10, 2) NOT NULL,
+        currency VARCHAR,
+        availability BOOLEAN,
+        shipping_cost NUMERIC(10, 2),
+        checked_at TIMESTAMP NOT NULL
+    ) ON COMMIT DROP
+"""
+
+COPY_STAGING_SQL = (
+    f"COPY scrape_results_staging ({', '.join(STAGING_COLUMNS)}) "
+    "FROM STDIN WITH (FORMAT csv)"
+)
+
+# Rows whose product or source was deleted while the result sat in the buffer
+# are skipped so one stale row cannot fail the whole batch.
+INSERT_PRICE_HISTORY_SQL = text("""
+    INSERT INTO price_history (
+        product_id, source_id, price, currency, availability, shipping_cost, checked_at, last_seen_at
+    )
+    SELECT s.product_id, s.source_id, s.price, s.currency, s.availability, s.shipping_cost, s.checked_at, s.checked_at
+    FROM scrape_results_staging s
+    JOIN products p ON p.id = s.product_id
+    JOIN sources src ON src.id = s.source_id
+""")
+
+# Newest staged result per mapping next to the mapping's current price_history
+# row (latest checked_at, served by idx_price_product_source_date). Built before
+# price_history is written, so "current" is the state before this batch.
+CREATE_LATEST_SQL = text("""
+    CREATE TEMP TABLE scrape_results_latest ON COMMIT DROP AS
+    SELECT
+        l.*,
+        cur.id AS current_id,
+        cur.checked_at AS current_checked_at,
+        cur.price AS current_price,
+        cur.availability AS current_availability,
+        (
+            cur.id IS NOT NULL
+            AND cur.price = l.price
+            AND cur.currency IS NOT DISTINCT FROM l.currency
+            AND cur.availability IS NOT DISTINCT FROM l.availability
+            AND cur.shipping_cost IS NOT DISTINCT FROM l.shipping_cost
+            AND cur.checked_at > l.checked_at - CAST(:max_interval AS INTERVAL)
+        ) AS unchanged
+    FROM (
+        SELECT DISTINCT ON (s.product_id, s.source_id) s.*
+        FROM scrape_results_staging s
+        JOIN products p ON p.id = s.product_id
+        JOIN sources src ON src.id = s.source_id
+        ORDER BY s.product_id, s.source_id, s.checked_at DESC
+    ) l
+    LEFT JOIN LATERAL (
+        SELECT ph.id, ph.checked_at, ph.price, ph.currency, ph.availability, ph.shipping_cost
+        FROM price_history ph
+        WHERE ph.product_id = l.product_id
+          AND ph.source_id = l.source_id
+        ORDER BY ph.checked_at DESC
+        LIMIT 1
+    ) cur ON true
+""")
+
+EXTEND_UNCHANGED_SQL = text("""
+    UPDATE price_history ph
+    SET last_seen_at = GREATEST(ph.last_seen_at, l.checked_at)
+    FROM scrape_results_latest l
+    WHERE l.unchanged
+      AND ph.id = l.current_id
+      AND ph.checked_at = l.current_checked_at
+""")
+
+INSERT_CHANGED_SQL = text("""
+    INSERT INTO price_history (
+        product_id, source_id, price, currency, availability, shipping_cost, checked_at, last_seen_at
+    )
+    SELECT product_id, source_id, price, currency, availability, shipping_cost, checked_at, checked_at
+    FROM scrape_results_latest
+    WHERE NOT unchanged
+""")
+
+# First observations count as changes, so their product's stats pick them up
+INSERT_EVENTS_SQL = text("""
+    INSERT INTO price_change_events (
+        product_id, source_id, old_price, new_price, old_availability, new_availability, checked_at, created_at
+    )
+    SELECT product_id, source_id, current_price, price, current_availability, availability, checked_at,
+           now() AT TIME ZONE 'utc'
+    FROM scrape_results_latest
+    WHERE current_id IS NULL
+       OR current_price <> price
+       OR current_availability IS DISTINCT FROM availability
+""")
+
+# Sorted so concurrent flushes lock mappings in the same order; an older
+# result never overwrites a newer one
+UPSERT_CURRENT_PRICES_SQL = text("""
+    INSERT INTO current_prices (
+        product_id, source_id, price, currency, availability, shipping_cost, checked_at,
+        previous_price, price_changed_at, updated_at
+    )
+    SELECT
+        product_id, source_id, price, currency, availability, shipping_cost, checked_at,
+        CASE WHEN current_price <> price THEN current_price END,
+        CASE WHEN current_price <> price THEN checked_at END,
+        now() AT TIME ZONE 'utc'
+    FROM scrape_results_latest
+    ORDER BY product_id, source_id
+    ON CONFLICT (product_id, source_id) DO UPDATE SET
+        price = EXCLUDED.price,
+        currency = EXCLUDED.currency,
+        availability = EXCLUDED.availability,
+        shipping_cost = EXCLUDED.shipping_cost,
+        checked_at = EXCLUDED.checked_at,
+        previous_price = CASE
+            WHEN current_prices.price <> EXCLUDED.price THEN current_prices.price
+            ELSE current_prices.previous_price
+        END,
+        price_changed_at = CASE
+            WHEN current_prices.price <> EXCLUDED.price THEN EXCLUDED.checked_at
+            ELSE current_prices.price_changed_at
+        END,
+        updated_at = EXCLUDED.updated_at
+    WHERE current_prices.checked_at <= EXCLUDED.checked_at
+""")
+
+# Counters of sources deleted while buffered are dropped
+UPSERT_SCRAPE_COUNTERS_SQL = text("""
+    INSERT INTO source_scrape_counters (source_id, date, attempts, failures, response_time_total)
+    SELECT id, :date, :attempts, :failures, :response_time_total
+    FROM sources
+    WHERE id = :source_id
+    ON CONFLICT (source_id, date) DO UPDATE SET
+        attempts = source_scrape_counters.attempts + EXCLUDED.attempts,
+        failures = source_scrape_counters.failures + EXCLUDED.failures,
+        response_time_total = source_scrape_counters.response_time_total + EXCLUDED.response_time_total
+""")
+
+UPDATE_PRODUCT_SOURCES_SQL = text("""
+    UPDATE product_sources ps
+    SET last_checked = s.checked_at,
+        last_price = s.price
+    FROM (
+        SELECT DISTINCT ON (product_id, source_id) product_id, source_id, price, checked_at
+        FROM scrape_results_staging
+        ORDER BY product_id, source_id, checked_at DESC
+    ) s
+    WHERE ps.product_id = s.product_id
+      AND ps.source_id = s.source_id
+""")
+
+
+def interval_scan_start(day_start: datetime) -> datetime:
+    """Earliest checked_at of a price_history row whose interval can reach day_start"""
+    if STORAGE_MODE == "change_only":
+        return day_start - timedelta(days=MAX_INTERVAL_DAYS)
+    return day_start
+
+
+class ResultWriter:
+    """Buffers scrape results and writes them to the database in batches"""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._counters = {}  # (source_id, date) -> [attempts, failures, response_time_total]
+        self._sketches = {}  # (product_id, date) -> DaySketch
+        self._oldest = None
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer_pid = None
+
+    def add(self, product_id: int, source_id: int, result: Dict[str, Any], checked_at: Optional[datetime] = None):
+        """Buffer a successful scrape result; flushes when the batch is full"""
+        checked_at = checked_at or datetime.utcnow()
+        availability = result.get("availability", True)
+        row = (
+            product_id,
+            source_id,
+            result["price"],
+            result.get("currency", "PLN"),
+            availability,
+            result.get("shipping_cost"),
+            checked_at,
+        )
+
+        with self._lock:
+            self._ensure_timer()
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.append(row)
+            self._sketches.setdefault((product_id, checked_at.date()), DaySketch()).add(result["price"], availability, source_id)
+            batch_full = len(self._rows) >= self.batch_size
+
+        if batch_full:
+            self.flush()
+
+    def record_attempt(self, source_id: int, success: bool, response_time: float, checked_at: Optional[datetime] = None):
+        """Count one scrape attempt of a source; written with the next flush"""
+        key = (source_id, (checked_at or datetime.utcnow()).date())
+
+        with self._lock:
+            self._ensure_timer()
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            counter = self._counters.setdefault(key, [0, 0, 0.0])
+            counter[0] += 1
+            counter[1] += 0 if success else 1
+            counter[2] += response_time
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self) -> int:
+        """Write all buffered rows in one transaction. Returns number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                counters, self._counters = self._counters, {}
+                sketches, self._sketches = self._sketches, {}
+                self._oldest = None
+
+            if not rows and not counters:
+                return 0
+
+            started = time.monotonic()
+            try:
+                self._write(rows, counters, sketches)
+            except Exception as e:
+                self._failures += 1
+                if self._failures <= MAX_RETRIES:
+                    logger.error(f"Result writer flush failed ({self._failures}/{MAX_RETRIES}), re-queueing {len(rows)} rows: {e}")
+                    self._requeue(rows, counters, sketches)
+                else:
+                    logger.error(f"Result writer flush failed {self._failures} times, spilling {len(rows)} rows: {e}")
+                    self._spill(rows, counters)
+                    self._failures = 0
+                return 0
+
+            self._failures = 0
+            elapsed = time.monotonic() - started
+            logger.info(f"Result writer flushed {len(rows)} rows in {elapsed:.3f}s")
+            self._replay_spilled()
+            return len(rows)
+
+    def _requeue(self, rows, counters, sketches):
+        with self._lock:
+            self._rows[:0] = rows
+            for key, (attempts, failures, response_time) in counters.items():
+                counter = self._counters.setdefault(key, [0, 0, 0.0])
+                counter[0] += attempts
+                counter[1] += failures
+                counter[2] += response_time
+            for key, sketch in sketches.items():
+                self._sketches.setdefault(key, DaySketch()).merge(sketch)
+            self._oldest = time.monotonic()
+
+    def _spill(self, rows, counters, replays: int = 0, key: str = SPILL_KEY):
+        # Sketches are not stored: they are rebuilt from the rows on replay
+        batch = json.dumps({
+            "rows": rows,
+            "counters": [[source_id, day, *counter] for (source_id, day), counter in counters.items()],
+            "replays": replays,
+        }, default=str)
+        try:
+            get_redis().rpush(key, batch)
+        except redis.RedisError as e:
+            logger.error(f"Could not spill {len(rows)} rows, they are lost: {e}")
+
+    def _replay_spilled(self):
+        """Write one spilled batch on its own; called after a successful flush"""
+        try:
+            batch = get_redis().lpop(SPILL_KEY)
+        except redis.RedisError:
+            return
+        if not batch:
+            return
+
+        data = json.loads(batch)
+        rows, sketches = [], {}
+        for product_id, source_id, price, currency, availability, shipping_cost, checked_at in data["rows"]:
+            checked_at = datetime.fromisoformat(checked_at)
+            rows.append((product_id, source_id, price, currency, availability, shipping_cost, checked_at))
+            sketches.setdefault((product_id, checked_at.date()), DaySketch()).add(float(price), availability, source_id)
+        counters = {
+            (source_id, date.fromisoformat(day)): [attempts, failures, response_time]
+            for source_id, day, attempts, failures, response_time in data["counters"]
+        }
+
+        try:
+            self._write(rows, counters, sketches)
+        except Exception as e:
+            replays = data.get("replays", 0) + 1
+            if replays >= MAX_REPLAYS:
+                logger.error(f"Spilled batch of {len(rows)} rows failed {replays} replays, moving it to {DEAD_LETTER_KEY}: {e}")
+                self._spill(rows, counters, replays, DEAD_LETTER_KEY)
+            else:
+                logger.error(f"Spilled batch of {len(rows)} rows failed replay {replays}/{MAX_REPLAYS}: {e}")
+                self._spill(rows, counters, replays)
+            return
+        logger.info(f"Result writer replayed {len(rows)} spilled rows")
+
+        # persist_sketches leaves finished days to the nightly job; recompute
+        # the ones this batch added rows to
+        for day in sorted({day for _, day in sketches if day < date.today()}):
+            try:
+                celery_app.send_task('app.tasks.aggregation_tasks.calculate_daily_stats', args=[day.isoformat()])
+            except Exception as e:
+                logger.warning(f"Could not queue daily stats of {day} after a replay: {e}")
+
+    def _write(self, rows, counters, sketches):
+        events = 0
+        db = SessionLocal()
+        try:
+            if rows:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                buffer.seek(0)
+
+                # Raw DBAPI cursor on the session's connection, so COPY runs in the same transaction
+                cursor = db.connection().connection.cursor()
+                cursor.execute(CREATE_STAGING_SQL)
+                cursor.copy_expert(COPY_STAGING_SQL, buffer)
+
+                db.execute(CREATE_LATEST_SQL, {"max_interval": f"{MAX_INTERVAL_DAYS} days"})
+                if STORAGE_MODE == "change_only":
+                    db.execute(EXTEND_UNCHANGED_SQL)
+                    db.execute(INSERT_CHANGED_SQL)
+                else:
+                    db.execute(INSERT_PRICE_HISTORY_SQL)
+                events = db.execute(INSERT_EVENTS_SQL).rowcount
+                db.execute(UPSERT_CURRENT_PRICES_SQL)
+                db.execute(UPDATE_PRODUCT_SOURCES_SQL)
+
+            if sketches:
+                persist_sketches(db, sketches)
+
+            if counters:
+                db.execute(UPSERT_SCRAPE_COUNTERS_SQL, [
+                    {
+                        "source_id": source_id,
+                        "date": day,
+                        "attempts": attempts,
+                        "failures": failures,
+                        "response_time_total": response_time,
+                    }
+                    for (source_id, day), (attempts, failures, response_time) in counters.items()
+                ])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        if rows or sketches:
+            response_cache.invalidate_debounced("prices")
+        if events:
+            self._notify(events)
+
+    def _notify(self, events: int):
+        # Events are already committed; if the broker is down the beat
+        # schedule picks them up on its next process_price_events run
+        try:
+            celery_app.send_task('app.tasks.event_tasks.process_price_events')
+        except Exception as e:
+            logger.warning(f"Could not queue processing of {events} price change events: {e}")
+
+    def _ensure_timer(self):
+        # Threads do not survive fork, so each worker process starts its own timer
+        pid = os.getpid()
+        if self._timer_pid == pid:
+            return
+        self._timer_pid = pid
+        thread = threading.Thread(target=self._run_timer, name="result-writer-flush", daemon=True)
+        thread.start()
+
+    def _run_timer(self):
+        while True:
+            time.sleep(min(self.flush_interval, 1.0))
+            with self._lock:
+                due = self._oldest is not None and time.monotonic() - self._oldest >= self.flush_interval
+            if due:
+                self.flush()
+
+
+result_writer = ResultWriter()
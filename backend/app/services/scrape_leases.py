@@ -0,0 +1,84 @@
+"""
+De-duplication of scrape work per (product_id, source_id) mapping.
+
+Three Redis keys per mapping:
+    scrape:queued:{p}:{s}  - a task is waiting in the queue (set at dispatch)
+    scrape:lease:{p}:{s}   - a worker is fetching right now (set by the task)
+    scrape:fresh:{p}:{s}   - a result was saved less than SCRAPE_MIN_INTERVAL ago
+
+Dispatchers skip mappings with any of the keys present; tasks drop themselves
+before fetching when the mapping is fresh or leased by another worker.
+When Redis is unavailable everything fails open (no de-duplication).
+"""
+from app.services.redis_client import get_redis
+from typing import Optional, Tuple
+import logging
+import os
+import uuid
+import redis
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL = int(os.getenv("SCRAPE_LEASE_TTL", 600))  # Matches task_time_limit
+QUEUED_TTL = int(os.getenv("SCRAPE_QUEUED_TTL", 1800))
+MIN_RESCRAPE_INTERVAL = int(os.getenv("SCRAPE_MIN_INTERVAL", 900))
+
+# Delete the lease only if we still own it
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def _key(kind: str, product_id: int, source_id: int) -> str:
+    return f"scrape:{kind}:{product_id}:{source_id}"
+
+def mark_queued(product_id: int, source_id: int, force: bool = False) -> Optional[str]:
+    """
+    Register a dispatch. Returns None if the caller should enqueue,
+    otherwise the reason the request was coalesced: fresh, in_flight or queued.
+    """
+    try:
+        r = get_redis()
+        if not force and r.exists(_key("fresh", product_id, source_id)):
+            return "fresh"
+        if r.exists(_key("lease", product_id, source_id)):
+            return "in_flight"
+        if not r.set(_key("queued", product_id, source_id), 1, nx=True, ex=QUEUED_TTL):
+            return "queued"
+        return None
+    except redis.RedisError as e:
+        logger.warning(f"Lease store unavailable, dispatching without de-duplication: {e}")
+        return None
+
+def acquire(product_id: int, source_id: int, force: bool = False) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Take the fetch lease for a mapping.
+    Returns (token, None) on success, (None, reason) when the task should be dropped.
+    Token is None with no reason when Redis is unavailable.
+    """
+    try:
+        r = get_redis()
+        r.delete(_key("queued", product_id, source_id))
+        if not force and r.exists(_key("fresh", product_id, source_id)):
+            return None, "fresh"
+        token = uuid.uuid4().hex
+        if not r.set(_key("lease", product_id, source_id), token, nx=True, ex=LEASE_TTL):
+            return None, "in_flight"
+        return token, None
+    except redis.RedisError as e:
+        logger.warning(f"Lease store unavailable, scraping without lease: {e}")
+        return None, None
+
+def release(product_id: int, source_id: int, token: Optional[str], fresh: bool = False):
+    """Release the lease; with fresh=True block re-scrapes for SCRAPE_MIN_INTERVAL"""
+    if token is None:
+        return
+    try:
+        r = get_redis()
+        if fresh:
+            r.set(_key("fresh", product_id, source_id), 1, ex=MIN_RESCRAPE_INTERVAL)
+        r.eval(_RELEASE_SCRIPT, 1, _key("lease", product_id, source_id), token)
+    except redis.RedisError as e:
+        logger.warning(f"Could not release scrape lease for product {product_id}, source {source_id}: {e}")
@@ -0,0 +1,170 @@
+"""
+Worker-resident cache of scrape targets.
+
+Each worker process preloads active sources and product-source mappings at
+start (worker_process_init) and keeps one scraper instance per source, so
+scrape_product needs no queries. Entries are dropped on "sources" and
+"product_sources" invalidation messages and the whole cache is reloaded
+every SOURCE_CACHE_TTL seconds as a safety net.
+"""
+from app.models.database import SessionLocal
+from app.models.models import ProductSource, Source
+from app.scrapers.universal_scraper import get_scraper
+from app.scrapers.base_scraper import BaseScraper
+from app.services import invalidation
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SOURCE_CACHE_TTL = int(os.getenv("SOURCE_CACHE_TTL", 600))
+
+_MISSING = object()  # Negative entry: no active mapping
+
+class CachedSource(NamedTuple):
+    id: int
+    name: str
+    is_active: bool
+    scraper_config: Optional[Dict[str, Any]]
+    scraper: BaseScraper
+
+class ScrapeTarget(NamedTuple):
+    source_url: str
+    config: Dict[str, Any]
+    source: CachedSource
+
+class SourceCache:
+    """Sources, mappings and scraper instances for one worker process"""
+    
+    def __init__(self):
+        self._sources = {}
+        self._mappings = {}
+        self._loaded_at = None
+        self._lock = threading.RLock()
+    
+    def start(self):
+        """Preload and subscribe to invalidation messages (call after fork)"""
+        invalidation.subscribe("sources", self._on_source_message)
+        invalidation.subscribe("product_sources", self._on_mapping_message)
+        self.preload()
+    
+    def preload(self):
+        db = SessionLocal()
+        try:
+            sources = db.query(Source).filter(Source.is_active == True).all()
+            mappings = db.query(ProductSource).filter(ProductSource.is_active == True).all()
+            
+            with self._lock:
+                # Keep scraper instances of sources that did not change
+                previous = self._sources
+                self._sources = {}
+                for source in sources:
+                    cached = previous.get(source.id)
+                    if cached is None or cached.name != source.name or cached.scraper_config != source.scraper_config:
+                        cached = self._build_source(source)
+                    self._sources[source.id] = cached
+                self._mappings = {}
+                for ps in mappings:
+                    source = self._sources.get(ps.source_id)
+                    if source:
+                        self._mappings[(ps.product_id, ps.source_id)] = self._build_target(ps, source)
+                self._loaded_at = time.monotonic()
+            
+            logger.info(f"Source cache loaded: {len(sources)} sources, {len(self._mappings)} mappings")
+        finally:
+            db.close()
+    
+    def lookup(self, product_id: int, source_id: int) -> Tuple[Optional[ScrapeTarget], Optional[str]]:
+        """Returns (target, None) or (None, reason) when there is nothing to scrape"""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > SOURCE_CACHE_TTL:
+            self.preload()
+        
+        key = (product_id, source_id)
+        with self._lock:
+            target = self._mappings.get(key)
+        
+        if target is None:
+            target = self._load_mapping(product_id, source_id)
+        
+        if target is _MISSING:
+            return None, "No active mapping"
+        if not target.source.is_active:
+            return None, "Source inactive"
+        return target, None
+    
+    def invalidate_source(self, source_id: int):
+        with self._lock:
+            self._sources.pop(source_id, None)
+            for key in [key for key in self._mappings if key[1] == source_id]:
+                del self._mappings[key]
+    
+    def invalidate_mapping(self, product_id: int, source_id: int):
+        with self._lock:
+            self._mappings.pop((product_id, source_id), None)
+    
+    def clear(self):
+        with self._lock:
+            self._sources = {}
+            self._mappings = {}
+            self._loaded_at = None
+    
+    def _load_mapping(self, product_id: int, source_id: int):
+        db = SessionLocal()
+        try:
+            ps = db.query(ProductSource).filter(
+                ProductSource.product_id == product_id,
+                ProductSource.source_id == source_id,
+                ProductSource.is_active == True
+            ).first()
+            
+            with self._lock:
+                source = self._sources.get(source_id)
+            if ps and source is None:
+                db_source = db.query(Source).filter(Source.id == source_id).first()
+                source = self._build_source(db_source) if db_source else None
+                if source:
+                    with self._lock:
+                        self._sources[source_id] = source
+            
+            target = self._build_target(ps, source) if ps and source else _MISSING
+            with self._lock:
+                self._mappings[(product_id, source_id)] = target
+            return target
+        finally:
+            db.close()
+    
+    @staticmethod
+    def _build_source(source: Source) -> CachedSource:
+        return CachedSource(
+            id=source.id,
+            name=source.name,
+            is_active=source.is_active,
+            scraper_config=source.scraper_config,
+            scraper=get_scraper(source.name),
+        )
+    
+    @staticmethod
+    def _build_target(ps: ProductSource, source: CachedSource) -> ScrapeTarget:
+        return ScrapeTarget(
+            source_url=ps.source_url,
+            config=ps.selector_config or source.scraper_config or {},
+            source=source,
+        )
+    
+    def _on_source_message(self, payload: Dict[str, Any]):
+        if payload.get("reset") or payload.get("source_id") is None:
+            self.clear()
+        else:
+            self.invalidate_source(payload["source_id"])
+    
+    def _on_mapping_message(self, payload: Dict[str, Any]):
+        if payload.get("reset") or payload.get("product_id") is None:
+            self.clear()
+        else:
+            self.invalidate_mapping(payload["product_id"], payload["source_id"])
+
+
+source_cache = SourceCache()
@@ -0,0 +1,132 @@
+"""
+Minimal merging t-digest (Dunning) for approximate quantiles.
+
+Values are buffered and periodically merged into a sorted list of centroids
+whose size is bounded by the compression parameter, so adding a value is
+O(1) amortized and two digests merge by concatenating their centroids.
+Up to compression values are kept as one centroid each; while every
+centroid is a single value, quantiles are exact and interpolated between
+neighbouring values like percentile_cont. Larger inputs interpolate between
+centroid midpoints.
+"""
+from typing import Any, Dict, List, Optional
+import math
+
+DEFAULT_COMPRESSION = 100
+
+
+class TDigest:
+    """Mergeable quantile sketch"""
+
+    def __init__(self, compression: float = DEFAULT_COMPRESSION):
+        self.compression = compression
+        self._centroids: List[List[float]] = []  # [mean, weight], sorted by mean
+        self._buffer: List[List[float]] = []
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    @property
+    def count(self) -> float:
+        return sum(w for _, w in self._centroids) + sum(w for _, w in self._buffer)
+
+    def add(self, value: float, weight: float = 1):
+        value = float(value)
+        self._buffer.append([value, weight])
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self._buffer) >= self.compression * 5:
+            self._compress()
+
+    def merge(self, other: "TDigest"):
+        if other.min is None:
+            return
+        self._buffer.extend([mean, weight] for mean, weight in other._centroids)
+        self._buffer.extend([mean, weight] for mean, weight in other._buffer)
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._compress()
+
+    def quantile(self, q: float) -> Optional[float]:
+        self._compress()
+        centroids = self._centroids
+        if not centroids:
+            return None
+        if len(centroids) == 1 or q <= 0:
+            return centroids[0][0] if q > 0 else self.min
+        if q >= 1:
+            return self.max
+
+        if all(weight == 1 for _, weight in centroids):
+            # Exact: linear interpolation at position q * (n - 1), as percentile_cont
+            position = q * (len(centroids) - 1)
+            lower = int(position)
+            upper = min(lower + 1, len(centroids) - 1)
+            return centroids[lower][0] + (centroids[upper][0] - centroids[lower][0]) * (position - lower)
+
+        total = sum(w for _, w in centroids)
+        target = q * total
+        cumulative = 0.0
+        prev_mean, prev_mid = self.min, 0.0
+        for mean, weight in centroids:
+            mid = cumulative + weight / 2
+            if target < mid:
+                if mid == prev_mid:
+                    return mean
+                return prev_mean + (mean - prev_mean) * (target - prev_mid) / (mid - prev_mid)
+            prev_mean, prev_mid = mean, mid
+            cumulative += weight
+
+        # Between the last centroid's midpoint and the maximum
+        if total == prev_mid:
+            return self.max
+        return prev_mean + (self.max - prev_mean) * (target - prev_mid) / (total - prev_mid)
+
+    def to_dict(self) -> Dict[str, Any]:
+        self._compress()
+        return {
+            "compression": self.compression,
+            "centroids": self._centroids,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "TDigest":
+        digest = cls((data or {}).get("compression", DEFAULT_COMPRESSION))
+        if data:
+            digest._centroids = [[float(m), float(w)] for m, w in data.get("centroids", [])]
+            digest.min = data.get("min")
+            digest.max = data.get("max")
+        return digest
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        points = sorted(self._centroids + self._buffer)
+        self._buffer = []
+
+        total = sum(w for _, w in points)
+        if total <= self.compression:
+            self._centroids = [list(point) for point in points]
+            return
+
+        merged = [list(points[0])]
+        cumulative = 0.0
+        k_lower = self._k(0.0)
+        for mean, weight in points[1:]:
+            current = merged[-1]
+            q_upper = (cumulative + current[1] + weight) / total
+            if self._k(q_upper) - k_lower <= 1:
+                # Absorb into the current centroid (weighted mean)
+                new_weight = current[1] + weight
+                current[0] += (mean - current[0]) * weight / new_weight
+                current[1] = new_weight
+            else:
+                cumulative += current[1]
+                k_lower = self._k(cumulative / total)
+                merged.append([mean, weight])
+        self._centroids = merged
+
+    def _k(self, q: float) -> float:
+        # k1 scale function: small centroids at the tails, large in the middle
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
@@ -4,25 +4,337 @@ Runs after scraping completes to pre-calculate dashboard metrics.
 """
 from app.tasks.celery_app import celery_app
 from app.models.database import SessionLocal
-from app.models.models import (
-    Product, ProductSource, PriceHistory, 
-    DailyPriceStats, SourceDailyStats
-)
-from sqlalchemy import func, and_
+from app.models.models import PriceChangeEvent
+from app.services import frame_aggregation, price_archive, price_cube, response_cache
+from app.services.result_writer import interval_scan_start
+from sqlalchemy import text
 from datetime import datetime, timedelta, date
 import logging
+import os
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# "sql" (single set-based statements) or "pandas" (app.services.frame_aggregation)
+AGGREGATION_BACKEND = os.getenv("AGGREGATION_BACKEND", "sql")
+
+# One statement per day: the day's observations are the price_history rows
+# whose validity interval [checked_at, last_seen_at] overlaps it (in append
+# mode last_seen_at = checked_at, so these are simply the day's scrapes).
+# :scan_start bounds checked_at from below (see result_writer.interval_scan_start),
+# so idx_price_date serves a range scan; the upsert relies on
+# idx_daily_stats_unique.
+UPSERT_DAILY_STATS_SQL = text("""
+    WITH obs AS (
+        SELECT ph.product_id, ph.source_id, ph.price, ph.availability
+        FROM price_history ph
+        JOIN products p ON p.id = ph.product_id AND p.is_active
+        WHERE ph.last_seen_at >= :day_start
+          AND ph.checked_at >= :scan_start
+          AND ph.checked_at < :day_end
+          AND (CAST(:product_ids AS INTEGER[]) IS NULL OR ph.product_id = ANY(CAST(:product_ids AS INTEGER[])))
+          AND (CAST(:product_min AS INTEGER) IS NULL OR ph.product_id BETWEEN :product_min AND :product_max)
+    ),
+    agg AS (
+        SELECT
+            product_id,
+            MIN(price) AS min_price,
+            MAX(price) AS max_price,
+            AVG(price) AS avg_price,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY price) AS median_price,
+            COUNT(*) FILTER (WHERE availability) AS sources_available,
+            COUNT(*) AS total_sources_checked
+        FROM obs
+        GROUP BY product_id
+    ),
+    best AS (
+        -- Cheapest available offer; cheapest overall when nothing is in stock
+        SELECT DISTINCT ON (product_id) product_id, source_id, price
+        FROM obs
+        ORDER BY product_id, availability DESC NULLS LAST, price, source_id
+    ),
+    upserted AS (
+        INSERT INTO daily_price_stats (
+            product_id, date, min_price, max_price, avg_price, median_price,
+            change_from_previous, change_percentage,
+            sources_available, total_sources_checked, best_source_id, best_price, created_at
+        )
+        SELECT
+            a.product_id, :day, a.min_price, a.max_price, a.avg_price, a.median_price,
+            a.avg_price - prev.avg_price,
+            CAST((a.avg_price - prev.avg_price) / NULLIF(prev.avg_price, 0) * 100 AS DOUBLE PRECISION),
+            a.sources_available, a.total_sources_checked, b.source_id, b.price,
+            now() AT TIME ZONE 'utc'
+        FROM agg a
+        JOIN best b ON b.product_id = a.product_id
+        LEFT JOIN daily_price_stats prev ON prev.product_id = a.product_id AND prev.date = :prev_day
+        ON CONFLICT (product_id, date) DO UPDATE SET
+            min_price = EXCLUDED.min_price,
+            max_price = EXCLUDED.max_price,
+            avg_price = EXCLUDED.avg_price,
+            median_price = EXCLUDED.median_price,
+            change_from_previous = EXCLUDED.change_from_previous,
+            change_percentage = EXCLUDED.change_percentage,
+            sources_available = EXCLUDED.sources_available,
+            total_sources_checked = EXCLUDED.total_sources_checked,
+            best_source_id = EXCLUDED.best_source_id,
+            best_price = EXCLUDED.best_price
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT
+        COUNT(*) FILTER (WHERE inserted) AS created,
+        COUNT(*) FILTER (WHERE NOT inserted) AS updated
+    FROM upserted
+""")
+
+
+def upsert_daily_stats(db, calc_date: date, product_ids=None, product_range=None, backend: str = None):
+    """
+    Compute and upsert DailyPriceStats for one day in a single statement.
+    Limited to product_ids and/or an inclusive (min_id, max_id) product_range
+    when given (backfill shards). Does not commit. Returns (created, updated).
+    backend="pandas" aggregates in pandas instead (AGGREGATION_BACKEND by default).
+    """
+    if (backend or AGGREGATION_BACKEND) == "pandas":
+        return frame_aggregation.upsert_daily_stats(db, calc_date, product_ids, product_range)
+    
+    product_min, product_max = product_range or (None, None)
+    day_start = datetime.combine(calc_date, datetime.min.time())
+    row = db.execute(UPSERT_DAILY_STATS_SQL, {
+        "day": calc_date,
+        "prev_day": calc_date - timedelta(days=1),
+        "day_start": day_start,
+        "scan_start": interval_scan_start(day_start),
+        "day_end": datetime.combine(calc_date + timedelta(days=1), datetime.min.time()),
+        "product_ids": list(product_ids) if product_ids is not None else None,
+        "product_min": product_min,
+        "product_max": product_max,
+    }).one()
+    return row.created, row.updated
+
+
+# Days computed out of order (parallel backfill) may have used a stale or
+# missing previous day; recompute the day-over-day change once all are done.
+# The day after the range depends on its last day, so it is included.
+FIX_DAILY_CHANGES_SQL = text("""
+    UPDATE daily_price_stats d
+    SET change_from_previous = d.avg_price - prev.avg_price,
+        change_percentage = CAST((d.avg_price - prev.avg_price) / NULLIF(prev.avg_price, 0) * 100 AS DOUBLE PRECISION)
+    FROM daily_price_stats prev
+    WHERE prev.product_id = d.product_id
+      AND prev.date = d.date - 1
+      AND d.date BETWEEN :date_from AND :date_to_next
+      AND (CAST(:product_ids AS INTEGER[]) IS NULL OR d.product_id = ANY(CAST(:product_ids AS INTEGER[])))
+""")
+
+
+def fix_daily_changes(db, date_from: date, date_to: date, product_ids=None) -> int:
+    """Recompute change_from_previous/change_percentage over a date range. Does not commit."""
+    return db.execute(FIX_DAILY_CHANGES_SQL, {
+        "date_from": date_from,
+        "date_to_next": date_to + timedelta(days=1),
+        "product_ids": list(product_ids) if product_ids is not None else None,
+    }).rowcount
+
+
+ROLLUP_RESOLUTIONS = {"week": "1 week", "month": "1 month"}
+
+# Periods (weeks or months) touched by a range of days
+ROLLUP_PERIODS_CTE = """
+    periods AS (
+        SELECT DISTINCT CAST(date_trunc(:resolution, d) AS DATE) AS period_start
+        FROM generate_series(CAST(:date_from AS TIMESTAMP), CAST(:date_to AS TIMESTAMP), INTERVAL '1 day') d
+    )
+"""
+
+# Recomputes whole periods from daily rows. The change against the previous
+# period uses the previous period computed in the same statement when there
+# is one, otherwise the stored rollup.
+REFRESH_PRICE_ROLLUPS_SQL = text(f"""
+    WITH {ROLLUP_PERIODS_CTE},
+    daily AS (
+        SELECT p.period_start, ds.*
+        FROM periods p
+        JOIN daily_price_stats ds
+          ON ds.date >= p.period_start
+         AND ds.date < p.period_start + CAST(:period AS INTERVAL)
+        WHERE (CAST(:product_ids AS INTEGER[]) IS NULL OR ds.product_id = ANY(CAST(:product_ids AS INTEGER[])))
+    ),
+    agg AS (
+        SELECT
+            product_id,
+            period_start,
+            MIN(min_price) AS min_price,
+            MAX(max_price) AS max_price,
+            AVG(avg_price) AS avg_price,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY median_price) AS median_price,
+            MAX(sources_available) AS sources_available,
+            COUNT(*) AS days
+        FROM daily
+        GROUP BY product_id, period_start
+    ),
+    best AS (
+        SELECT DISTINCT ON (product_id, period_start) product_id, period_start, best_source_id, best_price
+        FROM daily
+        WHERE best_price IS NOT NULL
+        ORDER BY product_id, period_start, best_price, date DESC
+    ),
+    chained AS (
+        SELECT
+            a.*,
+            CASE
+                WHEN LAG(a.period_start) OVER w = CAST(a.period_start - CAST(:period AS INTERVAL) AS DATE)
+                THEN LAG(a.avg_price) OVER w
+            END AS prev_in_batch
+        FROM agg a
+        WINDOW w AS (PARTITION BY a.product_id ORDER BY a.period_start)
+    )
+    INSERT INTO price_stats_rollups (
+        product_id, resolution, period_start, min_price, max_price, avg_price, median_price,
+        change_percentage, sources_available, best_source_id, best_price, days, updated_at
+    )
+    SELECT
+        c.product_id, :resolution, c.period_start, c.min_price, c.max_price, c.avg_price, c.median_price,
+        CAST(
+            (c.avg_price - COALESCE(c.prev_in_batch, prev.avg_price))
+            / NULLIF(COALESCE(c.prev_in_batch, prev.avg_price), 0) * 100
+            AS DOUBLE PRECISION
+        ),
+        c.sources_available, b.best_source_id, b.best_price, c.days,
+        now() AT TIME ZONE 'utc'
+    FROM chained c
+    LEFT JOIN best b ON b.product_id = c.product_id AND b.period_start = c.period_start
+    LEFT JOIN price_stats_rollups prev
+      ON prev.product_id = c.product_id
+     AND prev.resolution = :resolution
+     AND prev.period_start = CAST(c.period_start - CAST(:period AS INTERVAL) AS DATE)
+    ON CONFLICT (product_id, resolution, period_start) DO UPDATE SET
+        min_price = EXCLUDED.min_price,
+        max_price = EXCLUDED.max_price,
+        avg_price = EXCLUDED.avg_price,
+        median_price = EXCLUDED.median_price,
+        change_percentage = EXCLUDED.change_percentage,
+        sources_available = EXCLUDED.sources_available,
+        best_source_id = EXCLUDED.best_source_id,
+        best_price = EXCLUDED.best_price,
+        days = EXCLUDED.days,
+        updated_at = EXCLUDED.updated_at
+""")
+
+REFRESH_SOURCE_ROLLUPS_SQL = text(f"""
+    WITH {ROLLUP_PERIODS_CTE}
+    INSERT INTO source_stats_rollups (
+        source_id, resolution, period_start, products_scraped, successful_scrapes, failed_scrapes,
+        avg_response_time, avg_price_change, products_price_increased, products_price_decreased,
+        products_unavailable, days, updated_at
+    )
+    SELECT
+        ss.source_id, :resolution, p.period_start,
+        MAX(ss.products_scraped),
+        SUM(ss.successful_scrapes),
+        SUM(ss.failed_scrapes),
+        SUM(ss.avg_response_time * (ss.successful_scrapes + ss.failed_scrapes))
+            / NULLIF(SUM(ss.successful_scrapes + ss.failed_scrapes) FILTER (WHERE ss.avg_response_time IS NOT NULL), 0),
+        AVG(ss.avg_price_change),
+        SUM(ss.products_price_increased),
+        SUM(ss.products_price_decreased),
+        MAX(ss.products_unavailable),
+        COUNT(*),
+        now() AT TIME ZONE 'utc'
+    FROM periods p
+    JOIN source_daily_stats ss
+      ON ss.date >= p.period_start
+     AND ss.date < p.period_start + CAST(:period AS INTERVAL)
+    WHERE (CAST(:source_ids AS INTEGER[]) IS NULL OR ss.source_id = ANY(CAST(:source_ids AS INTEGER[])))
+    GROUP BY ss.source_id, p.period_start
+    ON CONFLICT (source_id, resolution, period_start) DO UPDATE SET
+        products_scraped = EXCLUDED.products_scraped,
+        successful_scrapes = EXCLUDED.successful_scrapes,
+        failed_scrapes = EXCLUDED.failed_scrapes,
+        avg_response_time = EXCLUDED.avg_response_time,
+        avg_price_change = EXCLUDED.avg_price_change,
+        products_price_increased = EXCLUDED.products_price_increased,
+        products_price_decreased = EXCLUDED.products_price_decreased,
+        products_unavailable = EXCLUDED.products_unavailable,
+        days = EXCLUDED.days,
+        updated_at = EXCLUDED.updated_at
+""")
+
+
+def refresh_price_rollups(db, date_from: date, date_to: date, product_ids=None):
+    """Recompute weekly and monthly product rollups covering [date_from, date_to]. Does not commit."""
+    for resolution, period in ROLLUP_RESOLUTIONS.items():
+        db.execute(REFRESH_PRICE_ROLLUPS_SQL, {
+            "resolution": resolution,
+            "period": period,
+            "date_from": date_from,
+            "date_to": date_to,
+            "product_ids": list(product_ids) if product_ids is not None else None,
+        })
+
+
+def refresh_source_rollups(db, date_from: date, date_to: date, source_ids=None):
+    """Recompute weekly and monthly source rollups covering [date_from, date_to]. Does not commit."""
+    for resolution, period in ROLLUP_RESOLUTIONS.items():
+        db.execute(REFRESH_SOURCE_ROLLUPS_SQL, {
+            "resolution": resolution,
+            "period": period,
+            "date_from": date_from,
+            "date_to": date_to,
+            "source_ids": list(source_ids) if source_ids is not None else None,
+        })
+
+
+def refresh_price_cube(db, date_from: date, date_to: date):
+    """Update the analytics cube; it is derived data, so failures only log"""
+    try:
+        price_cube.refresh(db, date_from, date_to)
+    except Exception as e:
+        logger.warning(f"Price cube not refreshed for {date_from} - {date_to}: {e}")
+
+
+@celery_app.task(name='app.tasks.aggregation_tasks.rebuild_price_cube')
+def rebuild_price_cube(last_day: str = None):
+    """
+    Rebuild the analytics cube from daily_price_stats.
+    
+    Args:
+        last_day: Last day in the cube (YYYY-MM-DD). Defaults to yesterday.
+    """
+    db = SessionLocal()
+    
+    try:
+        if last_day:
+            cube_end = datetime.strptime(last_day, '%Y-%m-%d').date()
+        else:
+            cube_end = date.today() - timedelta(days=1)
+        
+        meta = price_cube.rebuild(db, cube_end)
+        return {
+            "status": "success",
+            "version": meta["version"],
+            "products": len(meta["product_ids"]),
+            "start": meta["start"],
+            "last_day": meta["last_day"]
+        }
+        
+    except Exception as e:
+        logger.error(f"Error rebuilding price cube: {e}")
+        return {"status": "error", "error": str(e)}
+    finally:
+        db.close()
+
+
 @celery_app.task(name='app.tasks.aggregation_tasks.calculate_daily_stats')
-def calculate_daily_stats(target_date: str = None):
+def calculate_daily_stats(target_date: str = None, backend: str = None):
     """
     Calculate daily price statistics for all products.
     Should run after daily scraping completes (e.g., 3 AM).
     
     Args:
         target_date: Date to calculate stats for (YYYY-MM-DD). Defaults to yesterday.
+        backend: "sql" or "pandas". Defaults to AGGREGATION_BACKEND.
     """
     db = SessionLocal()
     
@@ -35,102 +347,13 @@ def calculate_daily_stats(target_date: str = None):
         
         logger.info(f"Calculating daily stats for {calc_date}")
         
-        # Get all active products
-        products = db.query(Product).filter(Product.is_active == True).all()
-        
-        stats_created = 0
-        stats_updated = 0
-        
-        for product in products:
-            # Get price history for this date
-            start_time = datetime.combine(calc_date, datetime.min.time())
-            end_time = datetime.combine(calc_date, datetime.max.time())
-            
-            prices = db.query(PriceHistory).filter(
-                and_(
-                    PriceHistory.product_id == product.id,
-                    PriceHistory.checked_at >= start_time,
-                    PriceHistory.checked_at <= end_time
-                )
-            ).all()
-            
-            if not prices:
-                continue
-            
-            # Calculate aggregates
-            price_values = [float(p.price) for p in prices]
-            available_sources = sum(1 for p in prices if p.availability)
-            
-            min_price = min(price_values)
-            max_price = max(price_values)
-            avg_price = sum(price_values) / len(price_values)
-            median_price = sorted(price_values)[len(price_values) // 2]
-            
-            # Find best source
-            best_price_record = min(prices, key=lambda p: float(p.price) if p.availability else float('inf'))
-            
-            # Get previous day stats for comparison
-            prev_stats = db.query(DailyPriceStats).filter(
-                and_(
-                    DailyPriceStats.product_id == product.id,
-                    DailyPriceStats.date == calc_date - timedelta(days=1)
-                )
-            ).first()
-            
-            change_from_previous = None
-            change_percentage = None
-            if prev_stats and prev_stats.avg_price:
-                change_from_previous = avg_price - float(prev_stats.avg_price)
-                change_percentage = (change_from_previous / float(prev_stats.avg_price)) * 100
-            
-            # Check if stats already exist
-            existing_stats = db.query(DailyPriceStats).filter(
-                and_(
-                    DailyPriceStats.product_id == product.id,
-                    DailyPriceStats.date == calc_date
-                )
-            ).first()
-            
-            if existing_stats:
-                # Update existing
-                existing_stats.min_price = min_price
-                existing_stats.max_price = max_price
-                existing_stats.avg_price = avg_price
-                existing_stats.median_price = median_price
-                existing_stats.sources_available = available_sources
-                existing_stats.total_sources_checked = len(prices)
-                existing_stats.best_source_id = best_price_record.source_id
-                existing_stats.best_price = best_price_record.price
-                existing_stats.change_from_previous = change_from_previous
-                existing_stats.change_percentage = change_percentage
-                stats_updated += 1
-            else:
-                # Create new
-                daily_stats = DailyPriceStats(
-                    product_id=product.id,
-                    date=calc_date,
-                    min_price=min_price,
-                    max_price=max_price,
-                    avg_price=avg_price,
-                    median_price=median_price,
-                    sources_available=available_sources,
-                    total_sources_checked=len(prices),
-                    best_source_id=best_price_record.source_id,
-                    best_price=best_price_record.price,
-                    change_from_previous=change_from_previous,
-                    change_percentage=change_percentage
-                )
-                db.add(daily_stats)
-                stats_created += 1
-            
-            # Update product cached stats
-            product.min_price = min_price
-            product.max_price = max_price
-            product.avg_price = avg_price
-            product.last_scraped = datetime.utcnow()
-        
+        stats_created, stats_updated = upsert_daily_stats(db, calc_date, backend=backend)
+        refresh_price_rollups(db, calc_date, calc_date)
         db.commit()
         
+        refresh_price_cube(db, calc_date, calc_date)
+        response_cache.invalidate("stats")
+        
         logger.info(f"Daily stats calculation completed: {stats_created} created, {stats_updated} updated")
         return {
             "status": "success",
@@ -147,10 +370,124 @@ def calculate_daily_stats(target_date: str = None):
         db.close()
 
 
+# Closing price/availability of every mapping on the day and the day before,
+# compared with LAG() instead of one lookup per price row. Successes, failures
+# and response times come from source_scrape_counters (written by the result
+# writer), so a source whose scrapes all failed still gets a row; observations
+# cannot be counted instead, in change_only mode one row spans many scrapes.
+# Days from before the counters existed have no counter row: a new row falls
+# back to the number of mappings observed, an existing one keeps its value.
+UPSERT_SOURCE_STATS_SQL = text("""
+    WITH days AS (
+        SELECT CAST(:prev_day AS DATE) AS day
+        UNION ALL
+        SELECT CAST(:day AS DATE)
+    ),
+    obs AS (
+        SELECT d.day, ph.product_id, ph.source_id, ph.price, ph.availability, ph.checked_at
+        FROM price_history ph
+        JOIN days d ON ph.last_seen_at >= d.day AND ph.checked_at < d.day + 1
+        WHERE ph.last_seen_at >= :prev_day_start
+          AND ph.checked_at >= :scan_start
+          AND ph.checked_at < :day_end
+          AND (CAST(:source_ids AS INTEGER[]) IS NULL OR ph.source_id = ANY(CAST(:source_ids AS INTEGER[])))
+    ),
+    closes AS (
+        SELECT DISTINCT ON (product_id, source_id, day) day, product_id, source_id, price, availability
+        FROM obs
+        ORDER BY product_id, source_id, day, checked_at DESC
+    ),
+    changes AS (
+        SELECT
+            day, source_id, availability,
+            (price - LAG(price) OVER w) / NULLIF(LAG(price) OVER w, 0) * 100 AS pct_change
+        FROM closes
+        WINDOW w AS (PARTITION BY product_id, source_id ORDER BY day)
+    ),
+    agg AS (
+        SELECT
+            source_id,
+            COUNT(*) AS products_scraped,
+            COUNT(*) FILTER (WHERE NOT availability) AS products_unavailable,
+            AVG(pct_change) AS avg_price_change,
+            COUNT(*) FILTER (WHERE pct_change > 0) AS products_price_increased,
+            COUNT(*) FILTER (WHERE pct_change < 0) AS products_price_decreased
+        FROM changes
+        WHERE day = :day
+        GROUP BY source_id
+    ),
+    upserted AS (
+        INSERT INTO source_daily_stats (
+            source_id, date, products_scraped, successful_scrapes, failed_scrapes, avg_response_time,
+            avg_price_change, products_price_increased, products_price_decreased, products_unavailable,
+            created_at
+        )
+        SELECT
+            s.id, :day,
+            COALESCE(a.products_scraped, 0),
+            COALESCE(c.attempts - c.failures, a.products_scraped, 0),
+            COALESCE(c.failures, 0),
+            c.response_time_total / NULLIF(c.attempts, 0),
+            CAST(COALESCE(a.avg_price_change, 0) AS DOUBLE PRECISION),
+            COALESCE(a.products_price_increased, 0),
+            COALESCE(a.products_price_decreased, 0),
+            COALESCE(a.products_unavailable, 0),
+            now() AT TIME ZONE 'utc'
+        FROM sources s
+        LEFT JOIN agg a ON a.source_id = s.id
+        LEFT JOIN source_scrape_counters c ON c.source_id = s.id AND c.date = :day
+        WHERE s.is_active
+          AND (a.source_id IS NOT NULL OR c.source_id IS NOT NULL)
+          AND (CAST(:source_ids AS INTEGER[]) IS NULL OR s.id = ANY(CAST(:source_ids AS INTEGER[])))
+        ON CONFLICT (source_id, date) DO UPDATE SET
+            products_scraped = EXCLUDED.products_scraped,
+            successful_scrapes = CASE
+                WHEN EXISTS (
+                    SELECT 1 FROM source_scrape_counters c
+                    WHERE c.source_id = EXCLUDED.source_id AND c.date = EXCLUDED.date
+                ) THEN EXCLUDED.successful_scrapes
+                ELSE source_daily_stats.successful_scrapes
+            END,
+            failed_scrapes = EXCLUDED.failed_scrapes,
+            avg_response_time = EXCLUDED.avg_response_time,
+            avg_price_change = EXCLUDED.avg_price_change,
+            products_price_increased = EXCLUDED.products_price_increased,
+            products_price_decreased = EXCLUDED.products_price_decreased,
+            products_unavailable = EXCLUDED.products_unavailable
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM upserted
+""")
+
+
+def upsert_source_stats(db, calc_date: date, source_ids=None, backend: str = None) -> int:
+    """
+    Compute and upsert SourceDailyStats for one day in a single statement.
+    Limited to source_ids when given. Does not commit. Returns rows written.
+    backend="pandas" aggregates in pandas instead (AGGREGATION_BACKEND by default).
+    """
+    if (backend or AGGREGATION_BACKEND) == "pandas":
+        return frame_aggregation.upsert_source_stats(db, calc_date, source_ids)
+    
+    prev_day_start = datetime.combine(calc_date - timedelta(days=1), datetime.min.time())
+    return db.execute(UPSERT_SOURCE_STATS_SQL, {
+        "day": calc_date,
+        "prev_day": calc_date - timedelta(days=1),
+        "prev_day_start": prev_day_start,
+        "scan_start": interval_scan_start(prev_day_start),
+        "day_end": datetime.combine(calc_date + timedelta(days=1), datetime.min.time()),
+        "source_ids": list(source_ids) if source_ids is not None else None,
+    }).scalar()
+
+
 @celery_app.task(name='app.tasks.aggregation_tasks.calculate_source_stats')
-def calculate_source_stats(target_date: str = None):
+def calculate_source_stats(target_date: str = None, backend: str = None):
     """
     Calculate daily statistics per source.
+    
+    Args:
+        target_date: Date to calculate stats for (YYYY-MM-DD). Defaults to yesterday.
+        backend: "sql" or "pandas". Defaults to AGGREGATION_BACKEND.
     """
     db = SessionLocal()
     
@@ -162,81 +499,13 @@ def calculate_source_stats(target_date: str = None):
         
         logger.info(f"Calculating source stats for {calc_date}")
         
-        from app.models.models import Source
-        sources = db.query(Source).filter(Source.is_active == True).all()
-        
-        for source in sources:
-            start_time = datetime.combine(calc_date, datetime.min.time())
-            end_time = datetime.combine(calc_date, datetime.max.time())
-            
-            # Get all price records for this source today
-            prices = db.query(PriceHistory).filter(
-                and_(
-                    PriceHistory.source_id == source.id,
-                    PriceHistory.checked_at >= start_time,
-                    PriceHistory.checked_at <= end_time
-                )
-            ).all()
-            
-            if not prices:
-                continue
-            
-            successful_scrapes = len(prices)
-            products_scraped = len(set(p.product_id for p in prices))
-            products_unavailable = sum(1 for p in prices if not p.availability)
-            
-            # Calculate price changes
-            price_changes = []
-            for price in prices:
-                # Get yesterday's price for same product
-                yesterday = calc_date - timedelta(days=1)
-                prev_price = db.query(PriceHistory).filter(
-                    and_(
-                        PriceHistory.product_id == price.product_id,
-                        PriceHistory.source_id == price.source_id,
-                        func.date(PriceHistory.checked_at) == yesterday
-                    )
-                ).first()
-                
-                if prev_price and prev_price.price:
-                    change = ((float(price.price) - float(prev_price.price)) / float(prev_price.price)) * 100
-                    price_changes.append(change)
-            
-            avg_price_change = sum(price_changes) / len(price_changes) if price_changes else 0
-            products_price_increased = sum(1 for c in price_changes if c > 0)
-            products_price_decreased = sum(1 for c in price_changes if c < 0)
-            
-            # Create or update stats
-            existing_stats = db.query(SourceDailyStats).filter(
-                and_(
-                    SourceDailyStats.source_id == source.id,
-                    SourceDailyStats.date == calc_date
-                )
-            ).first()
-            
-            if existing_stats:
-                existing_stats.products_scraped = products_scraped
-                existing_stats.successful_scrapes = successful_scrapes
-                existing_stats.avg_price_change = avg_price_change
-                existing_stats.products_price_increased = products_price_increased
-                existing_stats.products_price_decreased = products_price_decreased
-                existing_stats.products_unavailable = products_unavailable
-            else:
-                source_stats = SourceDailyStats(
-                    source_id=source.id,
-                    date=calc_date,
-                    products_scraped=products_scraped,
-                    successful_scrapes=successful_scrapes,
-                    avg_price_change=avg_price_change,
-                    products_price_increased=products_price_increased,
-                    products_price_decreased=products_price_decreased,
-                    products_unavailable=products_unavailable
-                )
-                db.add(source_stats)
-        
+        sources_updated = upsert_source_stats(db, calc_date, backend=backend)
+        refresh_source_rollups(db, calc_date, calc_date)
         db.commit()
-        logger.info(f"Source stats calculation completed for {calc_date}")
-        return {"status": "success", "date": str(calc_date)}
+        response_cache.invalidate("stats")
+        
+        logger.info(f"Source stats calculation completed for {calc_date}: {sources_updated} sources")
+        return {"status": "success", "date": str(calc_date), "sources_updated": sources_updated}
         
     except Exception as e:
         logger.error(f"Error calculating source stats: {e}")
@@ -246,65 +515,114 @@ def calculate_source_stats(target_date: str = None):
         db.close()
 
 
+# How far before a horizon a price may have been last seen and still count
+# as the price at that horizon (tolerates a missed scrape day)
+PRICE_CHANGE_LOOKBACK = timedelta(days=int(os.getenv("PRICE_CHANGE_LOOKBACK_DAYS", 2)))
+
+# As-of prices at now / -1d / -7d / -30d for every active mapping in one pass:
+# each horizon is a range scan (at - scan_lookback <= checked_at <= at,
+# last_seen_at >= at - lookback) and DISTINCT ON picks the row valid at that
+# moment. scan_lookback is lookback widened by interval_scan_start, so the
+# checked_at range stays bounded on both sides.
+REFRESH_PRICE_CHANGES_SQL = text("""
+    WITH mappings AS (
+        SELECT product_id, source_id
+        FROM product_sources
+        WHERE is_active
+          AND (CAST(:product_ids AS INTEGER[]) IS NULL OR product_id = ANY(CAST(:product_ids AS INTEGER[])))
+    ),
+    horizons AS (
+        SELECT DISTINCT ON (ph.product_id, ph.source_id, h.days)
+            h.days, ph.product_id, ph.source_id, ph.price, ph.availability, ph.checked_at
+        FROM (VALUES
+            (0, CAST(:now AS TIMESTAMP)),
+            (1, CAST(:now AS TIMESTAMP) - INTERVAL '1 day'),
+            (7, CAST(:now AS TIMESTAMP) - INTERVAL '7 days'),
+            (30, CAST(:now AS TIMESTAMP) - INTERVAL '30 days')
+        ) AS h(days, at)
+        JOIN price_history ph
+          ON ph.checked_at <= h.at
+         AND ph.checked_at >= h.at - CAST(:scan_lookback AS INTERVAL)
+         AND ph.last_seen_at >= h.at - CAST(:lookback AS INTERVAL)
+        WHERE (CAST(:product_ids AS INTEGER[]) IS NULL OR ph.product_id = ANY(CAST(:product_ids AS INTEGER[])))
+        ORDER BY ph.product_id, ph.source_id, h.days, ph.checked_at DESC
+    ),
+    upserted AS (
+        INSERT INTO product_source_price_changes (
+            product_id, source_id, current_price, current_availability, current_checked_at,
+            price_1d, price_7d, price_30d, price_change_1d, price_change_7d, price_change_30d, updated_at
+        )
+        SELECT
+            m.product_id, m.source_id, c.price, c.availability, c.checked_at,
+            h1.price, h7.price, h30.price,
+            CAST((c.price - h1.price) / NULLIF(h1.price, 0) * 100 AS DOUBLE PRECISION),
+            CAST((c.price - h7.price) / NULLIF(h7.price, 0) * 100 AS DOUBLE PRECISION),
+            CAST((c.price - h30.price) / NULLIF(h30.price, 0) * 100 AS DOUBLE PRECISION),
+            CAST(:now AS TIMESTAMP)
+        FROM mappings m
+        LEFT JOIN horizons c ON c.product_id = m.product_id AND c.source_id = m.source_id AND c.days = 0
+        LEFT JOIN horizons h1 ON h1.product_id = m.product_id AND h1.source_id = m.source_id AND h1.days = 1
+        LEFT JOIN horizons h7 ON h7.product_id = m.product_id AND h7.source_id = m.source_id AND h7.days = 7
+        LEFT JOIN horizons h30 ON h30.product_id = m.product_id AND h30.source_id = m.source_id AND h30.days = 30
+        ON CONFLICT (product_id, source_id) DO UPDATE SET
+            current_price = EXCLUDED.current_price,
+            current_availability = EXCLUDED.current_availability,
+            current_checked_at = EXCLUDED.current_checked_at,
+            price_1d = EXCLUDED.price_1d,
+            price_7d = EXCLUDED.price_7d,
+            price_30d = EXCLUDED.price_30d,
+            price_change_1d = EXCLUDED.price_change_1d,
+            price_change_7d = EXCLUDED.price_change_7d,
+            price_change_30d = EXCLUDED.price_change_30d,
+            updated_at = EXCLUDED.updated_at
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM upserted
+""")
+
+DELETE_INACTIVE_PRICE_CHANGES_SQL = text("""
+    DELETE FROM product_source_price_changes pc
+    WHERE NOT EXISTS (
+        SELECT 1 FROM product_sources ps
+        WHERE ps.product_id = pc.product_id
+          AND ps.source_id = pc.source_id
+          AND ps.is_active
+    )
+""")
+
+
+def refresh_price_changes(db, product_ids=None) -> int:
+    """
+    Recompute product_source_price_changes, for all active mappings or only
+    those of product_ids. Does not commit. Returns rows written.
+    """
+    now = datetime.utcnow()
+    updated = db.execute(REFRESH_PRICE_CHANGES_SQL, {
+        "now": now,
+        "lookback": PRICE_CHANGE_LOOKBACK,
+        "scan_lookback": now - interval_scan_start(now - PRICE_CHANGE_LOOKBACK),
+        "product_ids": list(product_ids) if product_ids is not None else None,
+    }).scalar()
+    if product_ids is None:
+        db.execute(DELETE_INACTIVE_PRICE_CHANGES_SQL)
+    return updated
+
+
 @celery_app.task(name='app.tasks.aggregation_tasks.update_product_source_changes')
-def update_product_source_changes():
+def update_product_source_changes(product_ids: list = None):
     """
-    Update price_change_1d, price_change_7d, price_change_30d in ProductSource.
-    Run daily after scraping.
+    Refresh 1d/7d/30d price changes in product_source_price_changes.
+    Queued when a full scrape run completes; also runs nightly.
     """
     db = SessionLocal()
     
     try:
         logger.info("Updating product source price changes")
         
-        product_sources = db.query(ProductSource).filter(
-            ProductSource.is_active == True
-        ).all()
-        
-        updated_count = 0
-        
-        for ps in product_sources:
-            if not ps.last_price or not ps.last_checked:
-                continue
-            
-            # Get historical prices
-            price_1d = db.query(PriceHistory).filter(
-                and_(
-                    PriceHistory.product_id == ps.product_id,
-                    PriceHistory.source_id == ps.source_id,
-                    func.date(PriceHistory.checked_at) == date.today() - timedelta(days=1)
-                )
-            ).first()
-            
-            price_7d = db.query(PriceHistory).filter(
-                and_(
-                    PriceHistory.product_id == ps.product_id,
-                    PriceHistory.source_id == ps.source_id,
-                    func.date(PriceHistory.checked_at) == date.today() - timedelta(days=7)
-                )
-            ).first()
-            
-            price_30d = db.query(PriceHistory).filter(
-                and_(
-                    PriceHistory.product_id == ps.product_id,
-                    PriceHistory.source_id == ps.source_id,
-                    func.date(PriceHistory.checked_at) == date.today() - timedelta(days=30)
-                )
-            ).first()
-            
-            # Calculate changes
-            if price_1d and price_1d.price:
-                ps.price_change_1d = ((ps.last_price - float(price_1d.price)) / float(price_1d.price)) * 100
-            
-            if price_7d and price_7d.price:
-                ps.price_change_7d = ((ps.last_price - float(price_7d.price)) / float(price_7d.price)) * 100
-            
-            if price_30d and price_30d.price:
-                ps.price_change_30d = ((ps.last_price - float(price_30d.price)) / float(price_30d.price)) * 100
-            
-            updated_count += 1
-        
+        updated_count = refresh_price_changes(db, product_ids)
         db.commit()
+        response_cache.invalidate("stats")
+        
         logger.info(f"Updated price changes for {updated_count} product sources")
         return {"status": "success", "updated": updated_count}
         
@@ -316,37 +634,266 @@ def update_product_source_changes():
         db.close()
 
 
-@celery_app.task(name='app.tasks.aggregation_tasks.cleanup_old_data')
-def cleanup_old_data(days_to_keep: int = 365):
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PRICE_HISTORY_PREMAKE_MONTHS", 3))
+
+IS_PARTITIONED_SQL = text("""
+    SELECT EXISTS (
+        SELECT 1 FROM pg_partitioned_table
+        WHERE partrelid = to_regclass('price_history')
+    )
+""")
+
+# Monthly partitions created by create_price_history_partition (migration 20261018_08)
+LIST_PRICE_PARTITIONS_SQL = text("""
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass('price_history')
+      AND c.relname ~ '^price_history_p[0-9]{6}$'
+    ORDER BY c.relname
+""")
+
+# Rows still valid past the retention boundary (change_only intervals) are
+# carried over with their validity clipped to start at the boundary
+CARRY_OVER_COLUMNS = (
+    "product_id, source_id, price, currency, availability, shipping_cost, discount_percentage, stock_quantity"
+)
+
+# Batched like DELETE_PRICE_HISTORY_BATCH_SQL: on the partitioned table each
+# clipped row moves to the cutoff's partition
+CLIP_VALID_ROWS_BATCH_SQL = text("""
+    UPDATE price_history
+    SET checked_at = :cutoff
+    WHERE id IN (
+        SELECT id FROM price_history
+        WHERE checked_at < :cutoff
+          AND last_seen_at >= :cutoff
+        ORDER BY checked_at
+        LIMIT :batch_size
+    )
+""")
+
+
+# Batched retention for the unpartitioned table: one short transaction per
+# batch of the oldest rows, so scrape writers are never stalled behind the cleanup
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", 20000))
+CLEANUP_BATCH_PAUSE = float(os.getenv("CLEANUP_BATCH_PAUSE", 0.5))
+CLEANUP_TIME_BUDGET = int(os.getenv("CLEANUP_TIME_BUDGET", 1800))
+# cleanup_old_data runs longer than the default task limits: the clip and delete budget
+# plus archiving before it
+CLEANUP_SOFT_TIME_LIMIT = int(os.getenv("CLEANUP_SOFT_TIME_LIMIT", CLEANUP_TIME_BUDGET + 1800))
+
+# Walks idx_price_date, so rows clipped to the cutoff (which keep their old,
+# low ids) cannot end the walk early
+DELETE_PRICE_HISTORY_BATCH_SQL = text("""
+    DELETE FROM price_history
+    WHERE id IN (
+        SELECT id FROM price_history
+        WHERE checked_at < :cutoff
+        ORDER BY checked_at
+        LIMIT :batch_size
+    )
+""")
+
+
+def is_price_history_partitioned(db) -> bool:
+    return db.execute(IS_PARTITIONED_SQL).scalar()
+
+
+def _partition_upper_bound(partition_name: str) -> datetime:
+    month = datetime.strptime(partition_name[-6:], "%Y%m")
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def drop_old_partitions(db, cutoff: datetime) -> list:
+    """
+    Detach and drop monthly partitions that end at or before cutoff.
+    Retention is rounded down to whole months; commits per partition.
+    """
+    dropped = []
+    for (partition_name,) in db.execute(LIST_PRICE_PARTITIONS_SQL).all():
+        upper = _partition_upper_bound(partition_name)
+        if upper > cutoff:
+            break
+        
+        db.execute(text(f"""
+            INSERT INTO price_history ({CARRY_OVER_COLUMNS}, checked_at, last_seen_at)
+            SELECT {CARRY_OVER_COLUMNS}, :upper, last_seen_at
+            FROM {partition_name}
+            WHERE last_seen_at >= :upper
+        """), {"upper": upper})
+        db.execute(text(f"ALTER TABLE price_history DETACH PARTITION {partition_name}"))
+        db.execute(text(f"DROP TABLE {partition_name}"))
+        db.commit()
+        
+        logger.info(f"Dropped price history partition {partition_name}")
+        dropped.append(partition_name)
+    return dropped
+
+
+def _run_cleanup_batches(db, statement, cutoff: datetime, batch_size: int, pause: float,
+                         deadline: float, action: str):
+    """
+    Run statement in committed batches until one is not full or the monotonic
+    deadline passes. Returns (row_count, finished).
+    """
+    total = 0
+    while True:
+        batch_started = time.monotonic()
+        affected = db.execute(statement, {"cutoff": cutoff, "batch_size": batch_size}).rowcount
+        db.commit()
+        total += affected
+
+        elapsed = time.monotonic() - batch_started
+        logger.info(
+            f"Cleanup batch: {action} {affected} rows "
+            f"in {elapsed:.2f}s ({affected / max(elapsed, 1e-6):.0f} rows/s, {total} total)"
+        )
+
+        if affected < batch_size:
+            return total, True
+
+        if time.monotonic() >= deadline:
+            return total, False
+        time.sleep(pause)
+
+
+def delete_old_price_history(db, cutoff: datetime, batch_size: int = CLEANUP_BATCH_SIZE,
+                             pause: float = CLEANUP_BATCH_PAUSE,
+                             time_budget: int = CLEANUP_TIME_BUDGET):
+    """
+    Delete price_history rows older than cutoff in batches of batch_size,
+    oldest first, committing each batch and sleeping pause seconds in between.
+
+    The walk ends with the first batch that is not full. When time_budget
+    seconds run out it stops early; the next run continues with what is left.
+
+    Returns (deleted_count, finished).
+    """
+    deadline = time.monotonic() + time_budget
+
+    # Rows still valid past the cutoff (change_only intervals) are kept,
+    # their validity clipped to start at the cutoff; same batching as the delete
+    clipped, finished = _run_cleanup_batches(
+        db, CLIP_VALID_ROWS_BATCH_SQL, cutoff, batch_size, pause, deadline, "clipped"
+    )
+    deleted_count = 0
+    if finished:
+        deleted_count, finished = _run_cleanup_batches(
+            db, DELETE_PRICE_HISTORY_BATCH_SQL, cutoff, batch_size, pause, deadline, "deleted"
+        )
+
+    if not finished:
+        logger.info(f"Cleanup time budget of {time_budget}s used up, continuing next run")
+    return deleted_count, finished
+
+
+def archive_closed_months(db, cutoff: datetime) -> list:
+    """Archive every month of price_history that ends at or before cutoff"""
+    oldest = db.execute(text("SELECT MIN(checked_at) FROM price_history")).scalar()
+    if oldest is None:
+        return []
+    
+    archived = []
+    month = oldest.date().replace(day=1)
+    while price_archive.next_month(month) <= cutoff.date():
+        manifest = price_archive.archive_month(db, month)
+        archived.append(manifest["month"])
+        month = price_archive.next_month(month)
+    return archived
+
+
+@celery_app.task(name='app.tasks.aggregation_tasks.ensure_price_history_partitions')
+def ensure_price_history_partitions(months_ahead: int = PARTITION_PREMAKE_MONTHS):
+    """
+    Create the current and the next months_ahead monthly partitions of
+    price_history in advance, so inserts never land in the default partition.
+    """
+    db = SessionLocal()
+    
+    try:
+        if not is_price_history_partitioned(db):
+            return {"status": "skipped", "reason": "price_history is not partitioned"}
+        
+        month = date.today().replace(day=1)
+        partitions = []
+        for _ in range(months_ahead + 1):
+            partitions.append(db.execute(
+                text("SELECT create_price_history_partition(:month)"), {"month": month}
+            ).scalar())
+            month = (month + timedelta(days=32)).replace(day=1)
+        db.commit()
+        
+        logger.info(f"Price history partitions ensured: {', '.join(partitions)}")
+        return {"status": "success", "partitions": partitions}
+        
+    except Exception as e:
+        logger.error(f"Error creating price history partitions: {e}")
+        db.rollback()
+        return {"status": "error", "error": str(e)}
+    finally:
+        db.close()
+
+
+@celery_app.task(name='app.tasks.aggregation_tasks.cleanup_old_data',
+                 soft_time_limit=CLEANUP_SOFT_TIME_LIMIT, time_limit=CLEANUP_SOFT_TIME_LIMIT + 60)
+def cleanup_old_data(days_to_keep: int = 365, batch_size: int = CLEANUP_BATCH_SIZE,
+                     pause: float = CLEANUP_BATCH_PAUSE, time_budget: int = CLEANUP_TIME_BUDGET):
     """
     Clean up old price history data to prevent database bloat.
     Keeps daily_price_stats forever, but removes raw price_history older than X days.
+    A partitioned price_history drops whole monthly partitions instead of
+    running a DELETE, so retention causes no bloat.
+    With PRICE_ARCHIVE_DIR set, closed months are exported to Parquet first
+    (retention is rounded down to whole months) and only verified months
+    are removed from the database.
     
     Args:
         days_to_keep: Number of days of raw price history to keep (default 365)
+        batch_size: Rows deleted per transaction (unpartitioned table)
+        pause: Seconds to sleep between batches
+        time_budget: Seconds after which the run stops and resumes next time
     """
     db = SessionLocal()
     
     try:
         cutoff_date = datetime.utcnow() - timedelta(days=days_to_keep)
         
+        archived_months = []
+        if price_archive.is_enabled():
+            cutoff_date = datetime.combine(cutoff_date.date().replace(day=1), datetime.min.time())
+            archived_months = archive_closed_months(db, cutoff_date)
+        
         logger.info(f"Cleaning up price history older than {cutoff_date}")
         
-        # Delete old price history
-        deleted_count = db.query(PriceHistory).filter(
-            PriceHistory.checked_at < cutoff_date
-        ).delete(synchronize_session=False)
+        deleted_count = 0
+        finished = True
+        dropped_partitions = []
+        if is_price_history_partitioned(db):
+            dropped_partitions = drop_old_partitions(db, cutoff_date)
+            logger.info(f"Dropped {len(dropped_partitions)} old price history partitions")
+        else:
+            deleted_count, finished = delete_old_price_history(
+                db, cutoff_date, batch_size, pause, time_budget
+            )
+            logger.info(f"Deleted {deleted_count} old price history records")
         
+        # Consumed outbox rows are only kept for a week
+        events_deleted = db.query(PriceChangeEvent).filter(
+            PriceChangeEvent.processed_at < datetime.utcnow() - timedelta(days=7)
+        ).delete(synchronize_session=False)
         db.commit()
         
-        logger.info(f"Deleted {deleted_count} old price history records")
-        
         # Vacuum the table (PostgreSQL specific)
         # This should be done manually or via pg_cron
         
         return {
             "status": "success",
             "deleted_count": deleted_count,
+            "finished": finished,
+            "dropped_partitions": dropped_partitions,
+            "archived_months": archived_months,
+            "events_deleted": events_deleted,
             "cutoff_date": str(cutoff_date)
         }
         
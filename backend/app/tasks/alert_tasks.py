@@ -1,6 +1,6 @@
 from app.tasks.celery_app import celery_app
 from app.models.database import SessionLocal
-from app.models.models import Alert, Product, PriceHistory, Source
+from app.models.models import Alert, Product, PriceHistory, Source, CurrentPrice
 from app.services.email_service import send_alert_email
 from datetime import datetime, timedelta
 from sqlalchemy import desc
@@ -62,15 +62,19 @@ def check_alert(alert_id: int):
     finally:
         db.close()
 
+def _latest_price(db, product: Product):
+    """Most recently observed price of the product across sources"""
+    return db.query(CurrentPrice).filter(
+        CurrentPrice.product_id == product.id
+    ).order_by(desc(CurrentPrice.checked_at)).first()
+
 def _check_price_drop(db, alert: Alert, product: Product):
     """Check if price dropped below threshold"""
     threshold = alert.condition.get("threshold")
     percentage = alert.condition.get("percentage")
     
     # Get latest price
-    latest_price = db.query(PriceHistory).filter(
-        PriceHistory.product_id == product.id
-    ).order_by(desc(PriceHistory.checked_at)).first()
+    latest_price = _latest_price(db, product)
     
     if not latest_price:
         return False, ""
@@ -102,9 +106,7 @@ def _check_price_increase(db, alert: Alert, product: Product):
     threshold = alert.condition.get("threshold")
     percentage = alert.condition.get("percentage")
     
-    latest_price = db.query(PriceHistory).filter(
-        PriceHistory.product_id == product.id
-    ).order_by(desc(PriceHistory.checked_at)).first()
+    latest_price = _latest_price(db, product)
     
     if not latest_price:
         return False, ""
@@ -132,9 +134,7 @@ def _check_availability(db, alert: Alert, product: Product):
     """Check if product became available/unavailable"""
     target_availability = alert.condition.get("available", True)
     
-    latest_price = db.query(PriceHistory).filter(
-        PriceHistory.product_id == product.id
-    ).order_by(desc(PriceHistory.checked_at)).first()
+    latest_price = _latest_price(db, product)
     
     if not latest_price:
         return False, ""
@@ -152,14 +152,16 @@ def _check_competitor_price(db, alert: Alert, product: Product):
     if not product.base_price:
         return False, ""
     
-    # Get all latest prices
-    latest_prices = db.query(PriceHistory, Source.name).join(Source).filter(
-        PriceHistory.product_id == product.id
-    ).order_by(desc(PriceHistory.checked_at)).limit(10).all()
+    # Current price of every source, cheapest first
+    current_prices = db.query(CurrentPrice, Source.name).join(
+        Source, CurrentPrice.source_id == Source.id
+    ).filter(
+        CurrentPrice.product_id == product.id
+    ).order_by(CurrentPrice.price).all()
     
-    for price_history, source_name in latest_prices:
-        if price_history.price < (product.base_price - margin):
-            return True, f"{source_name} has lower price: {price_history.price} PLN (your price: {product.base_price} PLN)"
+    for current_price, source_name in current_prices:
+        if current_price.price < (product.base_price - margin):
+            return True, f"{source_name} has lower price: {current_price.price} PLN (your price: {product.base_price} PLN)"
     
     return False, ""
 
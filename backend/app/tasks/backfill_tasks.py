@@ -0,0 +1,325 @@
+"""
+Parallel backfill / recompute of daily_price_stats and source_daily_stats.
+
+A date range is split into shards: for every day, BACKFILL_PRODUCT_SHARDS
+product-id ranges of roughly equal size (daily stats) plus one source shard
+(source stats). Each shard runs the same set-based upsert as the nightly
+tasks. Shards run as a Celery chord, or in a local process pool from the
+command line; the final step recomputes day-over-day changes, since days
+finish out of order, and the weekly/monthly rollups of the range.
+
+Progress (shards done, rows written, throughput) is kept in Redis under
+backfill:<id>.
+
+Usage:
+    python -m app.tasks.backfill_tasks 2025-01-01 2025-12-31
+    python -m app.tasks.backfill_tasks 2025-01-01 2025-12-31 --local --workers 8
+    python -m app.tasks.backfill_tasks 2025-06-01 2025-06-30 --products 1,2,3 --sources 4
+"""
+from app.tasks.celery_app import celery_app
+from app.tasks.aggregation_tasks import (
+    upsert_daily_stats, upsert_source_stats, fix_daily_changes,
+    refresh_price_rollups, refresh_source_rollups, refresh_price_cube
+)
+from app.models.database import SessionLocal, engine
+from app.services import response_cache
+from app.services.redis_client import get_redis
+from celery import chord
+from redis.exceptions import RedisError
+from sqlalchemy import text
+from datetime import datetime, timedelta, date
+from typing import Any, Dict, List, Optional
+import argparse
+import logging
+import os
+import time
+import uuid
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKFILL_PRODUCT_SHARDS = int(os.getenv("BACKFILL_PRODUCT_SHARDS", 8))
+PROGRESS_TTL = 7 * 24 * 3600
+
+# Equal-count product id ranges over active products
+PRODUCT_RANGES_SQL = text("""
+    SELECT MIN(id) AS product_min, MAX(id) AS product_max
+    FROM (
+        SELECT id, ntile(:shards) OVER (ORDER BY id) AS bucket
+        FROM products
+        WHERE is_active
+          AND (CAST(:product_ids AS INTEGER[]) IS NULL OR id = ANY(CAST(:product_ids AS INTEGER[])))
+    ) t
+    GROUP BY bucket
+    ORDER BY product_min
+""")
+
+
+def plan_shards(db, date_from: date, date_to: date, product_ids=None,
+                product_shards: int = BACKFILL_PRODUCT_SHARDS) -> List[Dict[str, Any]]:
+    """Split a date range into daily (per product range) and source shards"""
+    ranges = [
+        [row.product_min, row.product_max]
+        for row in db.execute(PRODUCT_RANGES_SQL, {
+            "shards": max(product_shards, 1),
+            "product_ids": list(product_ids) if product_ids is not None else None,
+        })
+    ]
+
+    shards = []
+    day = date_from
+    while day <= date_to:
+        for product_range in ranges:
+            shards.append({"kind": "daily", "date": day.isoformat(), "product_range": product_range})
+        shards.append({"kind": "source", "date": day.isoformat()})
+        day += timedelta(days=1)
+    return shards
+
+
+def run_shard(shard: Dict[str, Any], product_ids=None, source_ids=None) -> Dict[str, Any]:
+    """Compute one shard in its own transaction"""
+    db = SessionLocal()
+    started = time.monotonic()
+
+    try:
+        calc_date = date.fromisoformat(shard["date"])
+        if shard["kind"] == "daily":
+            created, updated = upsert_daily_stats(
+                db, calc_date, product_ids=product_ids, product_range=tuple(shard["product_range"])
+            )
+            rows = created + updated
+        else:
+            rows = upsert_source_stats(db, calc_date, source_ids=source_ids)
+        db.commit()
+        return {"status": "success", "rows": rows, "seconds": time.monotonic() - started}
+
+    except Exception as e:
+        logger.error(f"Error in backfill shard {shard}: {e}")
+        db.rollback()
+        return {"status": "error", "error": str(e), "shard": shard, "seconds": time.monotonic() - started}
+    finally:
+        db.close()
+
+
+def finalize(date_from: date, date_to: date, product_ids=None, source_ids=None) -> int:
+    """Fix day-over-day changes, then rebuild the weekly/monthly rollups of the range"""
+    db = SessionLocal()
+    try:
+        fixed = fix_daily_changes(db, date_from, date_to, product_ids)
+        refresh_price_rollups(db, date_from, date_to + timedelta(days=1), product_ids)
+        refresh_source_rollups(db, date_from, date_to, source_ids)
+        db.commit()
+        refresh_price_cube(db, date_from, date_to)
+        response_cache.invalidate("stats")
+        return fixed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _progress_key(backfill_id: str) -> str:
+    return f"backfill:{backfill_id}"
+
+
+def _progress_start(backfill_id: str, total: int, date_from: date, date_to: date):
+    try:
+        key = _progress_key(backfill_id)
+        get_redis().hset(key, mapping={
+            "total": total, "done": 0, "failed": 0, "rows": 0,
+            "date_from": date_from.isoformat(), "date_to": date_to.isoformat(),
+            "started": time.time(), "status": "running",
+        })
+        get_redis().expire(key, PROGRESS_TTL)
+    except RedisError as e:
+        logger.warning(f"Backfill {backfill_id}: progress not recorded: {e}")
+
+
+def _progress_shard(backfill_id: str, result: Dict[str, Any]):
+    try:
+        key = _progress_key(backfill_id)
+        pipe = get_redis().pipeline()
+        pipe.hincrby(key, "done", 1)
+        pipe.hincrby(key, "rows", result.get("rows", 0))
+        if result["status"] != "success":
+            pipe.hincrby(key, "failed", 1)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Backfill {backfill_id}: progress not recorded: {e}")
+
+
+def _progress_finish(backfill_id: str, status: str, changes_fixed: int = 0):
+    try:
+        get_redis().hset(_progress_key(backfill_id), mapping={
+            "status": status, "finished": time.time(), "changes_fixed": changes_fixed,
+        })
+    except RedisError as e:
+        logger.warning(f"Backfill {backfill_id}: progress not recorded: {e}")
+
+
+def get_backfill_progress(backfill_id: str) -> Optional[Dict[str, Any]]:
+    """Progress and throughput of a backfill, None when unknown or expired"""
+    data = get_redis().hgetall(_progress_key(backfill_id))
+    if not data:
+        return None
+
+    total, done, rows = int(data["total"]), int(data["done"]), int(data["rows"])
+    elapsed = float(data.get("finished") or time.time()) - float(data["started"])
+    shards_per_second = done / elapsed if elapsed > 0 else 0
+    return {
+        "backfill_id": backfill_id,
+        "status": data["status"],
+        "date_from": data["date_from"],
+        "date_to": data["date_to"],
+        "shards_total": total,
+        "shards_done": done,
+        "shards_failed": int(data["failed"]),
+        "rows_written": rows,
+        "elapsed_seconds": round(elapsed, 1),
+        "shards_per_second": round(shards_per_second, 2),
+        "rows_per_second": round(rows / elapsed, 1) if elapsed > 0 else 0,
+        "eta_seconds": round((total - done) / shards_per_second, 1) if shards_per_second and done < total else None,
+    }
+
+
+@celery_app.task(name='app.tasks.backfill_tasks.backfill_stats')
+def backfill_stats(date_from: str, date_to: str, product_ids: list = None, source_ids: list = None,
+                   product_shards: int = BACKFILL_PRODUCT_SHARDS):
+    """
+    Recompute daily and source stats for a date range (YYYY-MM-DD, inclusive)
+    as a chord of shard tasks followed by finalize_backfill.
+    """
+    db = SessionLocal()
+
+    try:
+        start = datetime.strptime(date_from, '%Y-%m-%d').date()
+        end = datetime.strptime(date_to, '%Y-%m-%d').date()
+        if end < start:
+            return {"status": "error", "error": "date_to is before date_from"}
+
+        shards = plan_shards(db, start, end, product_ids, product_shards)
+        backfill_id = uuid.uuid4().hex[:12]
+        _progress_start(backfill_id, len(shards), start, end)
+
+        chord(
+            backfill_shard.s(backfill_id, shard, product_ids, source_ids) for shard in shards
+        )(finalize_backfill.s(backfill_id, date_from, date_to, product_ids, source_ids))
+
+        logger.info(f"Backfill {backfill_id}: {len(shards)} shards dispatched for {date_from}..{date_to}")
+        return {"status": "dispatched", "backfill_id": backfill_id, "shards": len(shards)}
+
+    except Exception as e:
+        logger.error(f"Error starting backfill: {e}")
+        return {"status": "error", "error": str(e)}
+    finally:
+        db.close()
+
+
+@celery_app.task(name='app.tasks.backfill_tasks.backfill_shard')
+def backfill_shard(backfill_id: str, shard: dict, product_ids: list = None, source_ids: list = None):
+    result = run_shard(shard, product_ids, source_ids)
+    _progress_shard(backfill_id, result)
+    return result
+
+
+@celery_app.task(name='app.tasks.backfill_tasks.finalize_backfill')
+def finalize_backfill(results: list, backfill_id: str, date_from: str, date_to: str,
+                      product_ids: list = None, source_ids: list = None):
+    try:
+        start = datetime.strptime(date_from, '%Y-%m-%d').date()
+        end = datetime.strptime(date_to, '%Y-%m-%d').date()
+        changes_fixed = finalize(start, end, product_ids, source_ids)
+
+        failed = sum(1 for r in results if r.get("status") != "success")
+        _progress_finish(backfill_id, "completed" if not failed else "completed_with_errors", changes_fixed)
+        logger.info(f"Backfill {backfill_id} finished: {len(results)} shards, {failed} failed, {changes_fixed} changes fixed")
+        return {"status": "success", "backfill_id": backfill_id, "shards": len(results), "failed": failed}
+
+    except Exception as e:
+        logger.error(f"Error finalizing backfill {backfill_id}: {e}")
+        _progress_finish(backfill_id, "failed")
+        return {"status": "error", "error": str(e)}
+
+
+def _init_pool_worker():
+    # Connections inherited through fork must not be shared with the parent
+    engine.dispose(close=False)
+
+
+def _run_local(args, product_ids, source_ids):
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    start = datetime.strptime(args.date_from, '%Y-%m-%d').date()
+    end = datetime.strptime(args.date_to, '%Y-%m-%d').date()
+
+    db = SessionLocal()
+    try:
+        shards = plan_shards(db, start, end, product_ids, args.product_shards)
+    finally:
+        db.close()
+
+    started = time.monotonic()
+    done = failed = rows = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_pool_worker) as pool:
+        futures = [pool.submit(run_shard, shard, product_ids, source_ids) for shard in shards]
+        for future in as_completed(futures):
+            result = future.result()
+            done += 1
+            rows += result.get("rows", 0)
+            failed += result["status"] != "success"
+            elapsed = time.monotonic() - started
+            print(
+                f"\r{done}/{len(shards)} shards, {failed} failed, {rows} rows, "
+                f"{rows / elapsed:.0f} rows/s, {elapsed:.0f}s",
+                end="", flush=True,
+            )
+    print()
+
+    changes_fixed = finalize(start, end, product_ids, source_ids)
+    print(f"Done in {time.monotonic() - started:.1f}s, {changes_fixed} day-over-day changes recomputed")
+
+
+def _parse_ids(value: Optional[str]) -> Optional[List[int]]:
+    return [int(v) for v in value.split(",") if v.strip()] if value else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute daily and source stats for a date range")
+    parser.add_argument("date_from", help="YYYY-MM-DD")
+    parser.add_argument("date_to", help="YYYY-MM-DD (inclusive)")
+    parser.add_argument("--products", help="Comma-separated product ids")
+    parser.add_argument("--sources", help="Comma-separated source ids (source stats)")
+    parser.add_argument("--product-shards", type=int, default=BACKFILL_PRODUCT_SHARDS)
+    parser.add_argument("--local", action="store_true", help="Run in a local process pool instead of Celery")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    product_ids, source_ids = _parse_ids(args.products), _parse_ids(args.sources)
+
+    if args.local:
+        _run_local(args, product_ids, source_ids)
+        return
+
+    result = backfill_stats(args.date_from, args.date_to, product_ids, source_ids, args.product_shards)
+    if result["status"] != "dispatched":
+        raise SystemExit(result.get("error"))
+
+    # Poll progress until the chord's finalize step has run
+    while True:
+        progress = get_backfill_progress(result["backfill_id"])
+        if progress:
+            print(
+                f"\r{progress['shards_done']}/{progress['shards_total']} shards, "
+                f"{progress['shards_failed']} failed, {progress['rows_written']} rows, "
+                f"{progress['rows_per_second']} rows/s, {progress['elapsed_seconds']}s",
+                end="", flush=True,
+            )
+            if progress["status"] != "running":
+                print(f"\n{progress['status']}")
+                return
+        time.sleep(2)
+
+
+if __name__ == "__main__":
+    main()
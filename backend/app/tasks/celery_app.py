@@ -15,7 +15,9 @@ celery_app = Celery(
     include=[
         'app.tasks.scraping_tasks', 
         'app.tasks.alert_tasks',
-        'app.tasks.aggregation_tasks'  # Added aggregation tasks
+        'app.tasks.aggregation_tasks',  # Added aggregation tasks
+        'app.tasks.event_tasks',
+        'app.tasks.backfill_tasks',
     ]
 )
 
@@ -62,6 +64,20 @@ celery_app.conf.beat_schedule = {
         'options': {'queue': 'celery'},
     },
     
+    # Stale scrape runs: resume or fail every 10 minutes
+    'recover-stale-scrape-jobs': {
+        'task': 'app.tasks.scraping_tasks.recover_stale_scrape_jobs',
+        'schedule': crontab(minute='*/10'),
+        'options': {'queue': 'celery'},
+    },
+    
+    # Price change events: safety net for triggers lost after a flush
+    'process-price-events': {
+        'task': 'app.tasks.event_tasks.process_price_events',
+        'schedule': crontab(),
+        'options': {'queue': 'celery'},
+    },
+    
     # Alerts: Every hour
     'check-alerts-hourly': {
         'task': 'app.tasks.alert_tasks.check_all_alerts',
@@ -69,6 +85,13 @@ celery_app.conf.beat_schedule = {
         'options': {'queue': 'celery'},
     },
     
+    # Monthly price_history partitions: created ahead, daily at 1:00 AM UTC
+    'ensure-price-history-partitions': {
+        'task': 'app.tasks.aggregation_tasks.ensure_price_history_partitions',
+        'schedule': crontab(hour=1, minute=0),
+        'options': {'queue': 'celery'},
+    },
+    
     # Cleanup old data: Weekly on Sunday at 5:00 AM UTC
     'cleanup-old-price-history': {
         'task': 'app.tasks.aggregation_tasks.cleanup_old_data',
@@ -83,4 +106,6 @@ celery_app.conf.task_routes = {
     'app.tasks.scraping_tasks.*': {'queue': 'celery'},
     'app.tasks.aggregation_tasks.*': {'queue': 'celery'},
     'app.tasks.alert_tasks.*': {'queue': 'celery'},
+    'app.tasks.event_tasks.*': {'queue': 'celery'},
+    'app.tasks.backfill_tasks.*': {'queue': 'celery'},
 }
@@ -0,0 +1,85 @@
+"""
+Consumers of the price_change_events outbox.
+
+The result writer records every price/availability change in the same
+transaction as price_history and queues process_price_events right after
+the flush. The consumer refreshes the 1d/7d/30d price changes of the
+touched products and evaluates only the alerts of those products, so a
+change is visible within seconds instead of at the next hourly/nightly
+batch. Intraday DailyPriceStats are kept current by the writer itself
+(price_sketches). The beat schedule runs the consumer every minute as
+a safety net for lost triggers.
+"""
+from app.tasks.celery_app import celery_app
+from app.tasks.aggregation_tasks import refresh_price_changes
+from app.tasks.alert_tasks import check_alert
+from app.models.database import SessionLocal
+from app.models.models import PriceChangeEvent, Alert
+from app.services import response_cache
+from datetime import datetime
+import logging
+import os
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EVENT_BATCH_SIZE = int(os.getenv("PRICE_EVENT_BATCH_SIZE", 1000))
+
+
+@celery_app.task(name='app.tasks.event_tasks.process_price_events')
+def process_price_events(batch_size: int = EVENT_BATCH_SIZE):
+    """
+    Consume one batch of unprocessed price change events.
+    Concurrent consumers skip each other's rows (FOR UPDATE SKIP LOCKED);
+    a full batch re-queues the task until the outbox is drained.
+    """
+    db = SessionLocal()
+
+    try:
+        events = db.query(PriceChangeEvent).filter(
+            PriceChangeEvent.processed_at.is_(None)
+        ).order_by(PriceChangeEvent.id).limit(batch_size).with_for_update(skip_locked=True).all()
+
+        if not events:
+            return {"status": "success", "events": 0}
+
+        product_ids = {e.product_id for e in events}
+        refresh_price_changes(db, sorted(product_ids))
+        alert_ids = [
+            alert_id for (alert_id,) in db.query(Alert.id).filter(
+                Alert.product_id.in_(product_ids),
+                Alert.is_active == True
+            ).all()
+        ]
+
+        now = datetime.utcnow()
+        for event in events:
+            event.processed_at = now
+        db.commit()
+        # The refreshed price changes are read under the "prices" scope
+        response_cache.invalidate_debounced("prices")
+
+        # Alerts read the committed price_history, so queue them after the commit
+        for alert_id in alert_ids:
+            check_alert.delay(alert_id)
+
+        if len(events) >= batch_size:
+            process_price_events.delay(batch_size)
+
+        logger.info(
+            f"Processed {len(events)} price change events: "
+            f"{len(product_ids)} products refreshed, {len(alert_ids)} alerts queued"
+        )
+        return {
+            "status": "success",
+            "events": len(events),
+            "products": len(product_ids),
+            "alerts_queued": len(alert_ids)
+        }
+
+    except Exception as e:
+        logger.error(f"Error processing price change events: {e}")
+        db.rollback()
+        return {"status": "error", "error": str(e)}
+    finally:
+        db.close()
@@ -1,151 +1,443 @@
 from app.tasks.celery_app import celery_app
+from app.tasks.aggregation_tasks import update_product_source_changes
 from app.models.database import SessionLocal
-from app.models.models import Product, ProductSource, Source, PriceHistory, ScrapeJob
-from app.scrapers.universal_scraper import get_scraper
-from datetime import datetime
+from app.models.models import ProductSource, ScrapeJob, ScrapeJobChunk
+from app.services.result_writer import result_writer
+from app.services.source_cache import source_cache
+from app.services import scrape_leases
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_process_init, worker_process_shutdown
+from sqlalchemy import func, text
+from datetime import datetime, timedelta
 import logging
 import asyncio
+import os
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Full-run checkpointing
+CHUNK_SIZE = int(os.getenv("SCRAPE_CHUNK_SIZE", 25))
+HEARTBEAT_INTERVAL = int(os.getenv("SCRAPE_HEARTBEAT_INTERVAL", 30))  # Seconds between progress saves
+STALE_AFTER = int(os.getenv("SCRAPE_JOB_STALE_AFTER", 1800))
+RESUME_WINDOW = int(os.getenv("SCRAPE_RESUME_WINDOW", 43200))  # Older stalled runs are failed, not resumed
+MAX_RESUMES = int(os.getenv("SCRAPE_MAX_RESUMES", 3))
+# Seconds a chunk task scrapes before handing over to a fresh task; must stay
+# below task_soft_time_limit (540s) so progress is saved before any limit fires
+CHUNK_TIME_BUDGET = int(os.getenv("SCRAPE_CHUNK_TIME_BUDGET", 420))
+
+@worker_process_init.connect
+def preload_source_cache(**kwargs):
+    """Load sources, mappings and scrapers once per worker process"""
+    try:
+        source_cache.start()
+    except Exception as e:
+        # Lookups fall back to loading entries on demand
+        logger.error(f"Could not preload source cache: {e}")
+
+@worker_process_shutdown.connect
+def flush_result_writer(**kwargs):
+    """Write out buffered scrape results before the worker process exits"""
+    flushed = result_writer.flush()
+    if flushed:
+        logger.info(f"Flushed {flushed} buffered results on worker shutdown")
+
+def dispatch_scrape(product_id: int, source_id: int, force: bool = False):
+    """
+    Queue scrape_product unless the mapping is fresh, in flight or already queued.
+    Returns {"task_id": ...} or {"coalesced": reason}.
+    """
+    reason = scrape_leases.mark_queued(product_id, source_id, force=force)
+    if reason:
+        return {"coalesced": reason}
+    task = scrape_product.delay(product_id, source_id, force=force)
+    return {"task_id": task.id}
+
 @celery_app.task(name='app.tasks.scraping_tasks.scrape_product')
-def scrape_product(product_id: int, source_id: int):
+def scrape_product(product_id: int, source_id: int, force: bool = False):
     """Scrape price for a single product from a specific source"""
-    db = SessionLocal()
+    # Drop duplicate work before fetching anything
+    lease_token, reason = scrape_leases.acquire(product_id, source_id, force=force)
+    if reason:
+        logger.info(f"Skipping product {product_id}, source {source_id}: {reason}")
+        return {"status": "skipped", "reason": reason, "coalesced": True}
+    
+    saved = False
+    started = None
     
     try:
-        # Get product source mapping
-        product_source = db.query(ProductSource).filter(
-            ProductSource.product_id == product_id,
-            ProductSource.source_id == source_id,
-            ProductSource.is_active == True
-        ).first()
-        
-        if not product_source:
-            logger.warning(f"No active product-source mapping for product {product_id}, source {source_id}")
-            return {"status": "skipped", "reason": "No active mapping"}
-        
-        # Get source info
-        source = db.query(Source).filter(Source.id == source_id).first()
-        if not source or not source.is_active:
-            logger.warning(f"Source {source_id} not found or inactive")
-            return {"status": "skipped", "reason": "Source inactive"}
-        
-        # Get scraper
-        scraper = get_scraper(source.name)
-        
-        # Prepare config
-        config = product_source.selector_config or source.scraper_config or {}
+        # Mapping, merged config and scraper come from the worker-resident cache
+        target, reason = source_cache.lookup(product_id, source_id)
+        if not target:
+            logger.warning(f"Skipping product {product_id}, source {source_id}: {reason}")
+            return {"status": "skipped", "reason": reason}
         
         # Scrape price (run async function in sync context)
+        started = time.monotonic()
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(scraper.scrape_price(product_source.source_url, config))
+        result = loop.run_until_complete(target.source.scraper.scrape_price(target.source_url, target.config))
         loop.close()
         
         if "error" in result:
             logger.error(f"Error scraping product {product_id} from source {source_id}: {result['error']}")
             return {"status": "error", "error": result["error"]}
         
-        # Save price history
-        price_history = PriceHistory(
-            product_id=product_id,
-            source_id=source_id,
-            price=result["price"],
-            currency=result.get("currency", "PLN"),
-            availability=result.get("availability", True),
-            checked_at=datetime.utcnow()
-        )
-        db.add(price_history)
-        
-        # Update product source
-        product_source.last_checked = datetime.utcnow()
-        product_source.last_price = result["price"]
+        if result.get("price") is None:
+            logger.error(f"Scraper returned no price for product {product_id} from source {source_id}")
+            return {"status": "error", "error": "Price not found"}
         
-        db.commit()
+        # Buffered: price_history and product_sources.last_* are written in batches
+        result_writer.add(product_id, source_id, result, checked_at=datetime.utcnow())
+        saved = True
         
         logger.info(f"Successfully scraped product {product_id} from source {source_id}: {result['price']}")
         return {"status": "success", "price": result["price"], "product_id": product_id, "source_id": source_id}
         
+    except SoftTimeLimitExceeded:
+        # Not a failed mapping: let scrape_chunk save its progress
+        raise
     except Exception as e:
         logger.error(f"Error in scrape_product task: {e}")
-        db.rollback()
         return {"status": "error", "error": str(e)}
     finally:
-        db.close()
+        if started is not None:
+            # Attempts and response times feed source_daily_stats
+            result_writer.record_attempt(source_id, saved, time.monotonic() - started)
+        scrape_leases.release(product_id, source_id, lease_token, fresh=saved)
 
 @celery_app.task(name='app.tasks.scraping_tasks.scrape_all_products')
 def scrape_all_products():
-    """Scrape all active products from all active sources"""
+    """
+    Scrape all active products from all active sources.
+    The work list is stored as scrape_job_chunks and one scrape_chunk task is
+    dispatched per chunk, so an interrupted run can be resumed.
+    """
     db = SessionLocal()
+    scrape_job = None
     
     try:
+        # Coalesce with a full run that is already in progress, resume it if it stalled
+        running_job = db.query(ScrapeJob).filter(
+            ScrapeJob.job_type == "full",
+            ScrapeJob.status == "running"
+        ).first()
+        if running_job:
+            if not is_job_stale(db, running_job):
+                logger.info(f"Full scrape job {running_job.id} already running, skipping")
+                return {"status": "coalesced", "job_id": running_job.id}
+            if _can_resume(running_job):
+                logger.info(f"Full scrape job {running_job.id} is stale, resuming it")
+                return _resume_job(db, running_job)
+            _fail_job(running_job, "Stale: no progress and outside resume window")
+            db.commit()
+        
         # Create scrape job
+        now = datetime.utcnow()
         scrape_job = ScrapeJob(
+            job_type="full",
             status="running",
-            started_at=datetime.utcnow(),
+            started_at=now,
+            heartbeat_at=now,
             prices_found=0
         )
         db.add(scrape_job)
-        db.commit()
+        db.flush()
         
-        # Get all active product-source mappings
-        product_sources = db.query(ProductSource).filter(
+        # Get all active product-source mappings and store them as chunks
+        mappings = db.query(ProductSource.product_id, ProductSource.source_id).filter(
             ProductSource.is_active == True
-        ).all()
+        ).order_by(ProductSource.id).all()
         
-        logger.info(f"Starting scraping job for {len(product_sources)} product-source mappings")
+        chunks = [
+            ScrapeJobChunk(
+                job_id=scrape_job.id,
+                chunk_index=index,
+                mappings=[[product_id, source_id] for product_id, source_id in mappings[offset:offset + CHUNK_SIZE]]
+            )
+            for index, offset in enumerate(range(0, len(mappings), CHUNK_SIZE))
+        ]
+        db.add_all(chunks)
+        scrape_job.total_chunks = len(chunks)
+        db.commit()
         
-        # Queue individual scraping tasks
-        tasks = []
-        for ps in product_sources:
-            task = scrape_product.delay(ps.product_id, ps.source_id)
-            tasks.append(task)
+        logger.info(f"Starting scraping job {scrape_job.id} for {len(mappings)} product-source mappings in {len(chunks)} chunks")
         
-        # Wait for all tasks and count successes
-        successful = 0
-        failed = 0
+        if not chunks:
+            _finish_job(db, scrape_job)
+            return {"status": "completed", "job_id": scrape_job.id, "total": 0}
         
-        for task in tasks:
-            try:
-                result = task.get(timeout=300)  # 5 minutes timeout
-                if result.get("status") == "success":
-                    successful += 1
-                else:
-                    failed += 1
-            except Exception as e:
-                logger.error(f"Task failed: {e}")
-                failed += 1
+        dispatched = _dispatch_chunks(db, scrape_job)
+        
+        return {
+            "status": "dispatched",
+            "job_id": scrape_job.id,
+            "chunks": dispatched,
+            "total": len(mappings)
+        }
+        
+    except Exception as e:
+        logger.error(f"Error in scrape_all_products task: {e}")
+        db.rollback()
+        if scrape_job and scrape_job.id:
+            _fail_job(scrape_job, str(e))
+            db.commit()
+        return {"status": "error", "error": str(e)}
+    finally:
+        db.close()
+
+@celery_app.task(name='app.tasks.scraping_tasks.scrape_chunk')
+def scrape_chunk(chunk_id: int, attempt: int):
+    """
+    Scrape the mappings of one chunk, continuing from its saved progress.
+    Deliveries from an older dispatch (attempt) are dropped.
+    """
+    db = SessionLocal()
+    
+    try:
+        chunk = db.query(ScrapeJobChunk).filter(ScrapeJobChunk.id == chunk_id).first()
+        if not chunk or chunk.attempts != attempt or chunk.status == "completed":
+            return {"status": "skipped", "reason": "Chunk superseded or completed"}
         
-        # Update scrape job
-        scrape_job.status = "completed"
-        scrape_job.completed_at = datetime.utcnow()
-        scrape_job.prices_found = successful
-        if failed > 0:
-            scrape_job.error_message = f"{failed} tasks failed"
+        job = chunk.job
+        if job.status != "running":
+            chunk.status = "pending"
+            db.commit()
+            return {"status": "skipped", "reason": f"Job {job.status}"}
         
+        chunk.status = "running"
+        chunk.heartbeat_at = datetime.utcnow()
         db.commit()
+        started = last_heartbeat = time.monotonic()
         
-        logger.info(f"Scraping job completed: {successful} successful, {failed} failed")
+        mappings = chunk.mappings
+        try:
+            while chunk.progress < len(mappings):
+                if time.monotonic() - started >= CHUNK_TIME_BUDGET:
+                    return _continue_chunk(db, job, chunk)
+                
+                product_id, source_id = mappings[chunk.progress]
+                result = scrape_product(product_id, source_id)
+                
+                if result.get("status") == "success":
+                    chunk.successful += 1
+                elif result.get("coalesced"):
+                    chunk.coalesced += 1
+                else:
+                    chunk.failed += 1
+                chunk.progress += 1
+                
+                if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    chunk.heartbeat_at = datetime.utcnow()
+                    db.commit()
+                    last_heartbeat = time.monotonic()
+                    
+                    # Attributes reload after commit: stop on cancel or re-dispatch
+                    if job.status != "running" or chunk.attempts != attempt:
+                        if chunk.attempts == attempt:
+                            chunk.status = "pending"
+                            db.commit()
+                        return {"status": "stopped", "chunk_id": chunk_id, "progress": chunk.progress}
+        except SoftTimeLimitExceeded:
+            # Only reached when a single scrape overruns the budget
+            return _continue_chunk(db, job, chunk)
+        
+        _complete_chunk(db, chunk)
         return {
             "status": "completed",
-            "successful": successful,
-            "failed": failed,
-            "total": len(product_sources)
+            "chunk_id": chunk_id,
+            "successful": chunk.successful,
+            "failed": chunk.failed,
+            "coalesced": chunk.coalesced
         }
         
     except Exception as e:
-        logger.error(f"Error in scrape_all_products task: {e}")
-        if scrape_job:
-            scrape_job.status = "failed"
-            scrape_job.completed_at = datetime.utcnow()
-            scrape_job.error_message = str(e)
-            db.commit()
+        logger.error(f"Error in scrape_chunk task {chunk_id}: {e}")
+        db.rollback()
         return {"status": "error", "error": str(e)}
     finally:
         db.close()
 
+def _continue_chunk(db, job: ScrapeJob, chunk: ScrapeJobChunk):
+    """Save the chunk's progress, then continue it in a fresh task"""
+    counts = {field: getattr(chunk, field) for field in ("progress", "successful", "failed", "coalesced")}
+    # The limit may have interrupted a commit; start from a clean transaction
+    db.rollback()
+    for field, value in counts.items():
+        setattr(chunk, field, value)
+    chunk.heartbeat_at = datetime.utcnow()
+    db.commit()
+    
+    _dispatch_chunks(db, job, chunks=[chunk])
+    return {"status": "continued", "chunk_id": chunk.id, "progress": chunk.progress}
+
+@celery_app.task(name='app.tasks.scraping_tasks.resume_scrape_job')
+def resume_scrape_job(job_id: int):
+    """Re-dispatch the chunks of a full run that are not completed"""
+    db = SessionLocal()
+    
+    try:
+        job = db.query(ScrapeJob).filter(ScrapeJob.id == job_id).first()
+        if not job or job.job_type != "full":
+            return {"status": "skipped", "reason": "Full scrape job not found"}
+        if job.status == "completed":
+            return {"status": "skipped", "reason": "Job already completed"}
+        if job.status == "running" and not is_job_stale(db, job):
+            return {"status": "skipped", "reason": "Job is running"}
+        
+        return _resume_job(db, job)
+        
+    except Exception as e:
+        logger.error(f"Error resuming scrape job {job_id}: {e}")
+        db.rollback()
+        return {"status": "error", "error": str(e)}
+    finally:
+        db.close()
+
+@celery_app.task(name='app.tasks.scraping_tasks.recover_stale_scrape_jobs')
+def recover_stale_scrape_jobs():
+    """
+    Detect running jobs without progress for SCRAPE_JOB_STALE_AFTER seconds.
+    Full runs inside the resume window are resumed, the rest are marked failed.
+    """
+    db = SessionLocal()
+    
+    try:
+        jobs = db.query(ScrapeJob).filter(ScrapeJob.status == "running").all()
+        
+        resumed = 0
+        failed = 0
+        for job in jobs:
+            if not is_job_stale(db, job):
+                continue
+            
+            if job.job_type == "full" and _can_resume(job):
+                logger.warning(f"Scrape job {job.id} is stale, resuming")
+                _resume_job(db, job)
+                resumed += 1
+            else:
+                logger.warning(f"Scrape job {job.id} is stale, marking as failed")
+                _fail_job(job, "Stale: no progress and cannot be resumed")
+                db.commit()
+                failed += 1
+        
+        return {"status": "success", "resumed": resumed, "failed": failed}
+        
+    except Exception as e:
+        logger.error(f"Error recovering stale scrape jobs: {e}")
+        db.rollback()
+        return {"status": "error", "error": str(e)}
+    finally:
+        db.close()
+
+def _dispatch_chunks(db, job: ScrapeJob, chunks=None, include_in_progress: bool = False) -> int:
+    """Queue scrape_chunk for the given chunks (default: the job's pending ones)"""
+    if chunks is None:
+        statuses = ["pending", "queued", "running"] if include_in_progress else ["pending"]
+        chunks = db.query(ScrapeJobChunk).filter(
+            ScrapeJobChunk.job_id == job.id,
+            ScrapeJobChunk.status.in_(statuses)
+        ).order_by(ScrapeJobChunk.chunk_index).all()
+    
+    # Bump attempts before sending so older deliveries of the same chunk drop out
+    for chunk in chunks:
+        chunk.status = "queued"
+        chunk.attempts = (chunk.attempts or 0) + 1
+    job.heartbeat_at = datetime.utcnow()
+    db.commit()
+    
+    for chunk in chunks:
+        task = scrape_chunk.delay(chunk.id, chunk.attempts)
+        chunk.celery_task_id = task.id
+    db.commit()
+    
+    return len(chunks)
+
+def _resume_job(db, job: ScrapeJob):
+    job.status = "running"
+    job.completed_at = None
+    job.error_message = None
+    job.resume_count = (job.resume_count or 0) + 1
+    db.commit()
+    
+    dispatched = _dispatch_chunks(db, job, include_in_progress=True)
+    if not dispatched:
+        # Nothing left (or a run from before checkpointing, without a work list)
+        if job.total_chunks and job.completed_chunks >= job.total_chunks:
+            _finish_job(db, job)
+        else:
+            _fail_job(job, "No work list to resume")
+            db.commit()
+        return {"status": job.status, "job_id": job.id, "chunks": 0}
+    
+    logger.info(f"Resumed scrape job {job.id}: {dispatched} chunks re-dispatched")
+    return {"status": "resumed", "job_id": job.id, "chunks": dispatched}
+
+def _complete_chunk(db, chunk: ScrapeJobChunk):
+    now = datetime.utcnow()
+    chunk.status = "completed"
+    chunk.completed_at = now
+    chunk.heartbeat_at = now
+    
+    # Counters are incremented in SQL, several chunks finish concurrently
+    totals = db.execute(text("""
+        UPDATE scrape_jobs
+        SET completed_chunks = COALESCE(completed_chunks, 0) + 1,
+            products_processed = COALESCE(products_processed, 0) + :processed,
+            prices_found = COALESCE(prices_found, 0) + :successful,
+            errors_count = COALESCE(errors_count, 0) + :failed,
+            heartbeat_at = :now
+        WHERE id = :job_id
+        RETURNING completed_chunks, total_chunks
+    """), {
+        "processed": chunk.progress,
+        "successful": chunk.successful,
+        "failed": chunk.failed,
+        "now": now,
+        "job_id": chunk.job_id,
+    }).first()
+    db.commit()
+    
+    if totals and totals.completed_chunks >= totals.total_chunks:
+        job = db.query(ScrapeJob).filter(ScrapeJob.id == chunk.job_id).first()
+        if job.status == "running":
+            _finish_job(db, job)
+
+def _finish_job(db, job: ScrapeJob):
+    job.status = "completed"
+    job.completed_at = datetime.utcnow()
+    job.duration_seconds = (job.completed_at - job.started_at).total_seconds()
+    if job.errors_count:
+        job.error_message = f"{job.errors_count} tasks failed"
+    db.commit()
+    logger.info(f"Scraping job {job.id} completed: {job.prices_found} successful, {job.errors_count} failed")
+    
+    # Refresh precomputed price changes once the workers' buffered results are flushed
+    update_product_source_changes.apply_async(countdown=result_writer.flush_interval * 2)
+
+def _fail_job(job: ScrapeJob, message: str):
+    job.status = "failed"
+    job.completed_at = datetime.utcnow()
+    job.error_message = message
+
+def is_job_stale(db, job: ScrapeJob) -> bool:
+    last_chunk_heartbeat = db.query(func.max(ScrapeJobChunk.heartbeat_at)).filter(
+        ScrapeJobChunk.job_id == job.id
+    ).scalar()
+    activity = [t for t in (job.heartbeat_at, job.started_at, last_chunk_heartbeat) if t]
+    if not activity:
+        return True
+    return max(activity) < datetime.utcnow() - timedelta(seconds=STALE_AFTER)
+
+def _can_resume(job: ScrapeJob) -> bool:
+    started = job.started_at or job.created_at
+    return (
+        started is not None
+        and started >= datetime.utcnow() - timedelta(seconds=RESUME_WINDOW)
+        and (job.resume_count or 0) < MAX_RESUMES
+    )
+
 @celery_app.task(name='app.tasks.scraping_tasks.scrape_products_by_source')
 def scrape_products_by_source(source_id: int):
     """Scrape all products for a specific source"""
@@ -160,11 +452,15 @@ def scrape_products_by_source(source_id: int):
         logger.info(f"Scraping {len(product_sources)} products for source {source_id}")
         
         tasks = []
+        coalesced = 0
         for ps in product_sources:
-            task = scrape_product.delay(ps.product_id, ps.source_id)
-            tasks.append(task)
+            dispatched = dispatch_scrape(ps.product_id, ps.source_id)
+            if "coalesced" in dispatched:
+                coalesced += 1
+            else:
+                tasks.append(dispatched["task_id"])
         
-        return {"status": "queued", "tasks": len(tasks)}
+        return {"status": "queued", "tasks": len(tasks), "coalesced": coalesced}
         
     except Exception as e:
         logger.error(f"Error in scrape_products_by_source task: {e}")
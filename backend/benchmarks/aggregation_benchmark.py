@@ -0,0 +1,138 @@
+"""
+Benchmark the SQL and pandas aggregation backends on synthetic data.
+
+Generates products, sources and two days of price_history in the database
+pointed to by DATABASE_URL, runs upsert_daily_stats / upsert_source_stats
+with each backend, compares the rows both produce and rolls everything
+back, so it is safe to run against a development database.
+
+    python -m benchmarks.aggregation_benchmark --products 10000 --sources 20 --scrapes 2
+"""
+from app.models.database import SessionLocal
+from app.tasks.aggregation_tasks import upsert_daily_stats, upsert_source_stats
+from sqlalchemy import text
+from datetime import date, datetime, timedelta
+import argparse
+import statistics
+import time
+
+BENCH_DAY = date(2000, 1, 2)  # Far from real data; the day before is generated too
+
+CREATE_PRODUCTS_SQL = text("""
+    INSERT INTO products (name, sku, category, is_active, created_at)
+    SELECT 'Benchmark product ' || n, 'bench-' || :run || '-' || n, 'benchmark', true, now()
+    FROM generate_series(1, :products) AS n
+    RETURNING id
+""")
+
+CREATE_SOURCES_SQL = text("""
+    INSERT INTO sources (name, type, is_active, created_at)
+    SELECT 'Benchmark source ' || :run || '-' || n, 'benchmark', true, now()
+    FROM generate_series(1, :sources) AS n
+    RETURNING id
+""")
+
+# :scrapes observations per mapping and day, jittered ±10% around a per-product base price
+CREATE_HISTORY_SQL = text("""
+    INSERT INTO price_history (product_id, source_id, price, currency, availability, checked_at, last_seen_at)
+    SELECT
+        p.id, s.id,
+        round(CAST(50 + (p.id % 500) * (0.9 + random() * 0.2) AS NUMERIC), 2),
+        'PLN',
+        random() > 0.1,
+        ts, ts
+    FROM unnest(CAST(:product_ids AS INTEGER[])) AS p(id)
+    CROSS JOIN unnest(CAST(:source_ids AS INTEGER[])) AS s(id)
+    CROSS JOIN generate_series(
+        CAST(:first_day AS TIMESTAMP),
+        CAST(:last_day AS TIMESTAMP) + INTERVAL '1 day' - INTERVAL '1 second',
+        INTERVAL '1 day' / :scrapes
+    ) AS ts
+""")
+
+DAILY_RESULT_SQL = text("""
+    SELECT product_id, min_price, max_price, avg_price, median_price,
+           sources_available, total_sources_checked, best_source_id, best_price
+    FROM daily_price_stats
+    WHERE date = :day AND product_id = ANY(CAST(:product_ids AS INTEGER[]))
+    ORDER BY product_id
+""")
+
+SOURCE_RESULT_SQL = text("""
+    SELECT source_id, products_scraped, successful_scrapes, round(CAST(avg_price_change AS NUMERIC), 6),
+           products_price_increased, products_price_decreased, products_unavailable
+    FROM source_daily_stats
+    WHERE date = :day AND source_id = ANY(CAST(:source_ids AS INTEGER[]))
+    ORDER BY source_id
+""")
+
+
+def _time(db, action, result_sql, params, repeat):
+    """Median seconds of action() over repeat rolled-back attempts, and the rows it wrote"""
+    timings, rows = [], None
+    for _ in range(repeat):
+        savepoint = db.begin_nested()
+        started = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - started)
+        rows = db.execute(result_sql, params).all()
+        savepoint.rollback()
+    return statistics.median(timings), rows
+
+
+def _differences(a, b) -> int:
+    return sum(1 for x, y in zip(a, b) if x != y) + abs(len(a) - len(b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the sql and pandas aggregation backends")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--sources", type=int, default=20)
+    parser.add_argument("--scrapes", type=int, default=2, help="Observations per mapping and day")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        run_id = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        product_ids = [r.id for r in db.execute(CREATE_PRODUCTS_SQL, {"run": run_id, "products": args.products})]
+        source_ids = [r.id for r in db.execute(CREATE_SOURCES_SQL, {"run": run_id, "sources": args.sources})]
+
+        started = time.perf_counter()
+        rows = db.execute(CREATE_HISTORY_SQL, {
+            "product_ids": product_ids,
+            "source_ids": source_ids,
+            "first_day": BENCH_DAY - timedelta(days=1),
+            "last_day": BENCH_DAY,
+            "scrapes": args.scrapes,
+        }).rowcount
+        db.execute(text("ANALYZE price_history"))
+        print(f"Generated {rows} price_history rows in {time.perf_counter() - started:.1f}s")
+
+        product_range = (min(product_ids), max(product_ids))
+        daily_params = {"day": BENCH_DAY, "product_ids": product_ids}
+        source_params = {"day": BENCH_DAY, "source_ids": source_ids}
+        results = {}
+        for backend in ("sql", "pandas"):
+            results[backend] = (
+                _time(db, lambda: upsert_daily_stats(db, BENCH_DAY, product_range=product_range, backend=backend),
+                      DAILY_RESULT_SQL, daily_params, args.repeat),
+                _time(db, lambda: upsert_source_stats(db, BENCH_DAY, source_ids, backend=backend),
+                      SOURCE_RESULT_SQL, source_params, args.repeat),
+            )
+
+        for backend, ((daily_seconds, _), (source_seconds, _)) in results.items():
+            print(f"{backend:>6}: daily stats {daily_seconds:.3f}s, source stats {source_seconds:.3f}s")
+
+        # Averages may differ in the last cent where float and NUMERIC round differently
+        (_, sql_daily), (_, sql_source) = results["sql"]
+        (_, pandas_daily), (_, pandas_source) = results["pandas"]
+        print(f"Daily stats: {len(sql_daily)} rows, {_differences(sql_daily, pandas_daily)} differ")
+        print(f"Source stats: {len(sql_source)} rows, {_differences(sql_source, pandas_source)} differ")
+    finally:
+        db.rollback()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark product search latency: leading-wildcard ILIKE against the
+trigram search in app.services.product_search.
+
+Grows a synthetic catalog in the database pointed to by DATABASE_URL to
+each requested size, times a fixed set of search terms with both queries
+and rolls everything back. Needs migration 20261018_10 (pg_trgm indexes).
+
+    python -m benchmarks.search_benchmark --sizes 10000,100000,1000000
+"""
+from app.models.database import SessionLocal
+from app.models.models import Product
+from app.services import product_search
+from sqlalchemy import text
+from datetime import datetime
+import argparse
+import statistics
+import time
+
+PAGE_SIZE = 50
+
+# Names like "Wiertarka udarowa Bosch 1234", ean 590 + 10 digits
+CREATE_PRODUCTS_SQL = text("""
+    INSERT INTO products (name, sku, ean, category, brand, is_active, created_at)
+    SELECT
+        (ARRAY['Wiertarka', 'Szlifierka', 'Łączówka', 'Śrubokręt', 'Żarówka', 'Przedłużacz',
+               'Klucz', 'Młotek', 'Piła', 'Gniazdo'])[1 + n % 10]
+        || ' ' || (ARRAY['udarowa', 'kątowa', 'elektryczna', 'ręczna', 'bezprzewodowa',
+                         'uniwersalna', 'płaska', 'ścienna'])[1 + (n / 10) % 8]
+        || ' ' || (ARRAY['Bosch', 'Makita', 'Dewalt', 'Stanley', 'Yato', 'Kärcher'])[1 + (n / 80) % 6]
+        || ' ' || n,
+        'bench-' || :run || '-' || n,
+        '590' || lpad(CAST(n AS TEXT), 10, '0'),
+        'benchmark',
+        (ARRAY['Bosch', 'Makita', 'Dewalt', 'Stanley', 'Yato', 'Kärcher'])[1 + (n / 80) % 6],
+        true,
+        now()
+    FROM generate_series(:first, :last) AS n
+""")
+
+ILIKE_SQL = text("""
+    SELECT id FROM products
+    WHERE name ILIKE :pattern OR sku ILIKE :pattern OR ean ILIKE :pattern
+    ORDER BY id
+    LIMIT :limit
+""")
+
+
+def _terms(run_id: str, size: int):
+    return {
+        "word": "szlifierka",
+        "two words": "wiertarka bosch",
+        "no diacritics": "laczowka",
+        "typo": "szlifirka",
+        "number": str(size // 2),
+        "sku exact": f"bench-{run_id}-{size // 2}",
+        "ean exact": "590" + str(size // 2).rjust(10, "0"),
+        "ean prefix": "5900000",
+    }
+
+
+def _time(action, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        action()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ILIKE and trigram product search latency")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma separated catalog sizes")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+
+    db = SessionLocal()
+    try:
+        run_id = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        generated = 0
+        for size in sizes:
+            started = time.perf_counter()
+            db.execute(CREATE_PRODUCTS_SQL, {"run": run_id, "first": generated + 1, "last": size})
+            db.execute(text("ANALYZE products"))
+            generated = size
+            print(f"\n{size} benchmark products (+ existing catalog), generated in {time.perf_counter() - started:.1f}s")
+            print(f"{'term':>14} {'ilike p50':>10} {'p95':>8} {'trgm p50':>10} {'p95':>8} {'hits':>5}")
+
+            for label, term in _terms(run_id, size).items():
+                ilike = _time(
+                    lambda: db.execute(ILIKE_SQL, {"pattern": f"%{term}%", "limit": PAGE_SIZE}).all(),
+                    args.repeat
+                )
+                hits = []
+                trgm = _time(
+                    lambda: hits.append(len(
+                        product_search.apply_search(db, db.query(Product.id), term).limit(PAGE_SIZE).all()
+                    )),
+                    args.repeat
+                )
+                print(f"{label:>14} {ilike[0]:>8.2f}ms {ilike[1]:>6.2f}ms {trgm[0]:>8.2f}ms {trgm[1]:>6.2f}ms {hits[-1]:>5}")
+    finally:
+        db.rollback()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
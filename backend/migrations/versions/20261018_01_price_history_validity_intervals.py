@@ -0,0 +1,61 @@
+"""price_history validity intervals (last_seen_at) and price_observations view
+
+Revision ID: 20261018_01_price_history_validity_intervals
+Revises: 20260119_02_alerts_last_triggered_safety
+Create Date: 2026-10-18
+
+"""
+
+from alembic import op
+
+
+revision = "20261018_01_price_history_validity_intervals"
+down_revision = "20260119_02_alerts_last_triggered_safety"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE price_history ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP")
+
+    # Existing rows are single observations: the interval ends where it starts
+    op.execute("UPDATE price_history SET last_seen_at = checked_at WHERE last_seen_at IS NULL")
+    op.execute("ALTER TABLE price_history ALTER COLUMN last_seen_at SET NOT NULL")
+
+    op.execute("CREATE INDEX IF NOT EXISTS idx_price_last_seen ON price_history (last_seen_at)")
+
+    # One row per mapping per day the interval covers. The first day keeps the
+    # original checked_at, continuation days are stamped at midnight.
+    op.execute(
+        """
+        CREATE OR REPLACE VIEW price_observations AS
+        SELECT
+            ph.id,
+            ph.product_id,
+            ph.source_id,
+            ph.price,
+            ph.currency,
+            ph.availability,
+            ph.shipping_cost,
+            ph.discount_percentage,
+            ph.stock_quantity,
+            CASE
+                WHEN d.day = date_trunc('day', ph.checked_at) THEN ph.checked_at
+                ELSE d.day
+            END AS checked_at,
+            ph.checked_at AS valid_from,
+            ph.last_seen_at
+        FROM price_history ph
+        CROSS JOIN LATERAL generate_series(
+            date_trunc('day', ph.checked_at),
+            date_trunc('day', ph.last_seen_at),
+            interval '1 day'
+        ) AS d(day)
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP VIEW IF EXISTS price_observations")
+    op.execute("DROP INDEX IF EXISTS idx_price_last_seen")
+    op.execute("ALTER TABLE price_history DROP COLUMN IF EXISTS last_seen_at")
@@ -0,0 +1,63 @@
+"""checkpointed scrape runs: scrape_job_chunks and scrape_jobs progress columns
+
+Revision ID: 20261018_02_scrape_job_chunks
+Revises: 20261018_01_price_history_validity_intervals
+Create Date: 2026-10-18
+
+"""
+
+from alembic import op
+
+
+revision = "20261018_02_scrape_job_chunks"
+down_revision = "20261018_01_price_history_validity_intervals"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        ALTER TABLE scrape_jobs
+            ADD COLUMN IF NOT EXISTS total_chunks INTEGER DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS completed_chunks INTEGER DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS resume_count INTEGER DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP
+        """
+    )
+
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS scrape_job_chunks (
+            id SERIAL PRIMARY KEY,
+            job_id INTEGER NOT NULL REFERENCES scrape_jobs(id) ON DELETE CASCADE,
+            chunk_index INTEGER NOT NULL,
+            mappings JSON NOT NULL,
+            status VARCHAR DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            progress INTEGER DEFAULT 0,
+            successful INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            coalesced INTEGER DEFAULT 0,
+            celery_task_id VARCHAR,
+            heartbeat_at TIMESTAMP,
+            completed_at TIMESTAMP
+        )
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_scrape_job_chunks_id ON scrape_job_chunks (id)")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_scrape_job_chunk_job_status ON scrape_job_chunks (job_id, status)")
+    op.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_scrape_job_chunk_unique ON scrape_job_chunks (job_id, chunk_index)")
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS scrape_job_chunks")
+    op.execute(
+        """
+        ALTER TABLE scrape_jobs
+            DROP COLUMN IF EXISTS total_chunks,
+            DROP COLUMN IF EXISTS completed_chunks,
+            DROP COLUMN IF EXISTS resume_count,
+            DROP COLUMN IF EXISTS heartbeat_at
+        """
+    )
@@ -0,0 +1,40 @@
+"""price change outbox: price_change_events
+
+Revision ID: 20261018_03_price_change_events
+Revises: 20261018_02_scrape_job_chunks
+Create Date: 2026-10-18
+
+"""
+
+from alembic import op
+
+
+revision = "20261018_03_price_change_events"
+down_revision = "20261018_02_scrape_job_chunks"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS price_change_events (
+            id SERIAL PRIMARY KEY,
+            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+            old_price NUMERIC(10, 2),
+            new_price NUMERIC(10, 2) NOT NULL,
+            old_availability BOOLEAN,
+            new_availability BOOLEAN,
+            checked_at TIMESTAMP NOT NULL,
+            created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+            processed_at TIMESTAMP
+        )
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_price_change_events_id ON price_change_events (id)")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_price_event_processed ON price_change_events (processed_at, id)")
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS price_change_events")
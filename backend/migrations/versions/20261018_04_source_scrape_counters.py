@@ -0,0 +1,39 @@
+"""per-source scrape attempt counters: source_scrape_counters
+
+Revision ID: 20261018_04_source_scrape_counters
+Revises: 20261018_03_price_change_events
+Create Date: 2026-10-18
+
+"""
+
+from alembic import op
+
+
+revision = "20261018_04_source_scrape_counters"
+down_revision = "20261018_03_price_change_events"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS source_scrape_counters (
+            id SERIAL PRIMARY KEY,
+            source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+            date DATE NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            failures INTEGER NOT NULL DEFAULT 0,
+            response_time_total DOUBLE PRECISION NOT NULL DEFAULT 0
+        )
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_source_scrape_counters_id ON source_scrape_counters (id)")
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_source_scrape_counter_unique "
+        "ON source_scrape_counters (source_id, date)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS source_scrape_counters")
@@ -0,0 +1,46 @@
+"""precomputed 1d/7d/30d price changes: product_source_price_changes
+
+Revision ID: 20261018_05_product_source_price_changes
+Revises: 20261018_04_source_scrape_counters
+Create Date: 2026-10-18
+
+"""
+
+from alembic import op
+
+
+revision = "20261018_05_product_source_price_changes"
+down_revision = "20261018_04_source_scrape_counters"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS product_source_price_changes (
+            id SERIAL PRIMARY KEY,
+            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+            current_price NUMERIC(10, 2),
+            current_availability BOOLEAN,
+            current_checked_at TIMESTAMP,
+            price_1d NUMERIC(10, 2),
+            price_7d NUMERIC(10, 2),
+            price_30d NUMERIC(10, 2),
+            price_change_1d DOUBLE PRECISION,
+            price_change_7d DOUBLE PRECISION,
+            price_change_30d DOUBLE PRECISION,
+            updated_at TIMESTAMP
+        )
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_product_source_price_changes_id ON product_source_price_changes (id)")
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_price_change_mapping_unique "
+        "ON product_source_price_changes (product_id, source_id)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS product_source_price_changes")
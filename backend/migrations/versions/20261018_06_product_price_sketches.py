@@ -0,0 +1,46 @@
+"""intraday per-product sketches: product_price_sketches
+
+Revision ID: 20261018_06_product_price_sketches
+Revises: 20261018_05_product_source_price_changes
+Create Date: 2026-10-18
+
+"""
+
+from alembic import op
+
+
+revision = "20261018_06_product_price_sketches"
+down_revision = "20261018_05_product_source_price_changes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS product_price_sketches (
+            id SERIAL PRIMARY KEY,
+            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            date DATE NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            total DOUBLE PRECISION NOT NULL DEFAULT 0,
+            min_price NUMERIC(10, 2),
+            max_price NUMERIC(10, 2),
+            available_count INTEGER NOT NULL DEFAULT 0,
+            best_price NUMERIC(10, 2),
+            best_source_id INTEGER REFERENCES sources(id) ON DELETE SET NULL,
+            best_available BOOLEAN,
+            digest JSON,
+            updated_at TIMESTAMP
+        )
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_product_price_sketches_id ON product_price_sketches (id)")
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_price_sketch_unique "
+        "ON product_price_sketches (product_id, date)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS product_price_sketches")
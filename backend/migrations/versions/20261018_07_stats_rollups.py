@@ -0,0 +1,74 @@
+"""weekly/monthly rollups: price_stats_rollups, source_stats_rollups
+
+Revision ID: 20261018_07_stats_rollups
+Revises: 20261018_06_product_price_sketches
+Create Date: 2026-10-18
+
+"""
+
+from alembic import op
+
+
+revision = "20261018_07_stats_rollups"
+down_revision = "20261018_06_product_price_sketches"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS price_stats_rollups (
+            id SERIAL PRIMARY KEY,
+            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            resolution VARCHAR NOT NULL,
+            period_start DATE NOT NULL,
+            min_price NUMERIC(10, 2),
+            max_price NUMERIC(10, 2),
+            avg_price NUMERIC(10, 2),
+            median_price NUMERIC(10, 2),
+            change_percentage DOUBLE PRECISION,
+            sources_available INTEGER,
+            best_source_id INTEGER REFERENCES sources(id) ON DELETE SET NULL,
+            best_price NUMERIC(10, 2),
+            days INTEGER,
+            updated_at TIMESTAMP
+        )
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_price_stats_rollups_id ON price_stats_rollups (id)")
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_price_rollup_unique "
+        "ON price_stats_rollups (product_id, resolution, period_start)"
+    )
+
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS source_stats_rollups (
+            id SERIAL PRIMARY KEY,
+            source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+            resolution VARCHAR NOT NULL,
+            period_start DATE NOT NULL,
+            products_scraped INTEGER,
+            successful_scrapes INTEGER,
+            failed_scrapes INTEGER,
+            avg_response_time DOUBLE PRECISION,
+            avg_price_change DOUBLE PRECISION,
+            products_price_increased INTEGER,
+            products_price_decreased INTEGER,
+            products_unavailable INTEGER,
+            days INTEGER,
+            updated_at TIMESTAMP
+        )
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_source_stats_rollups_id ON source_stats_rollups (id)")
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_source_rollup_unique "
+        "ON source_stats_rollups (source_id, resolution, period_start)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS source_stats_rollups")
+    op.execute("DROP TABLE IF EXISTS price_stats_rollups")
@@ -0,0 +1,210 @@
+"""range-partition price_history by month on checked_at
+
+Revision ID: 20261018_08_partition_price_history
+Revises: 20261018_07_stats_rollups
+Create Date: 2026-10-18
+
+The data is moved online: a partitioned copy is filled in committed batches
+while scrapers keep writing, then a locked catch-up (rows committed behind
+the copy, rows deleted or clipped meanwhile, last_seen_at extensions) is
+checked against the source row count before the swap.
+Pause the weekly cleanup_old_data while this runs.
+
+"""
+
+from alembic import op
+from sqlalchemy import text
+
+
+revision = "20261018_08_partition_price_history"
+down_revision = "20261018_07_stats_rollups"
+branch_labels = None
+depends_on = None
+
+COPY_BATCH_SIZE = 50000
+PREMAKE_MONTHS = 3
+
+INDEXES = (
+    ("ix_price_history_id", "(id)"),
+    ("idx_price_product_date", "(product_id, checked_at)"),
+    ("idx_price_source_date", "(source_id, checked_at)"),
+    ("idx_price_product_source_date", "(product_id, source_id, checked_at)"),
+    ("idx_price_date", "(checked_at)"),
+    ("idx_price_last_seen", "(last_seen_at)"),
+)
+
+PRICE_OBSERVATIONS_VIEW = """
+    CREATE OR REPLACE VIEW price_observations AS
+    SELECT
+        ph.id,
+        ph.product_id,
+        ph.source_id,
+        ph.price,
+        ph.currency,
+        ph.availability,
+        ph.shipping_cost,
+        ph.discount_percentage,
+        ph.stock_quantity,
+        CASE
+            WHEN d.day = date_trunc('day', ph.checked_at) THEN ph.checked_at
+            ELSE d.day
+        END AS checked_at,
+        ph.checked_at AS valid_from,
+        ph.last_seen_at
+    FROM price_history ph
+    CROSS JOIN LATERAL generate_series(
+        date_trunc('day', ph.checked_at),
+        date_trunc('day', ph.last_seen_at),
+        interval '1 day'
+    ) AS d(day)
+"""
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    # Monthly partition price_history_pYYYYMM of the given parent; idempotent.
+    # Also called by aggregation_tasks.ensure_price_history_partitions.
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION create_price_history_partition(month_start DATE, parent TEXT DEFAULT 'price_history')
+        RETURNS TEXT AS $$
+        DECLARE
+            start_at DATE := date_trunc('month', month_start)::date;
+            end_at DATE := (date_trunc('month', month_start) + INTERVAL '1 month')::date;
+            partition_name TEXT := 'price_history_p' || to_char(start_at, 'YYYYMM');
+        BEGIN
+            IF to_regclass(partition_name) IS NULL THEN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, parent, start_at, end_at
+                );
+            END IF;
+            RETURN partition_name;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+
+    op.execute(
+        """
+        CREATE TABLE price_history_partitioned (
+            LIKE price_history INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+            PRIMARY KEY (id, checked_at),
+            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE,
+            FOREIGN KEY (source_id) REFERENCES sources(id) ON DELETE CASCADE
+        ) PARTITION BY RANGE (checked_at)
+        """
+    )
+    # Temporary names; renamed once the old table and its indexes are gone
+    for name, columns in INDEXES:
+        op.execute(f"CREATE INDEX {name}_part ON price_history_partitioned {columns}")
+
+    op.execute(
+        f"""
+        SELECT create_price_history_partition(CAST(m AS DATE), 'price_history_partitioned')
+        FROM generate_series(
+            date_trunc('month', COALESCE((SELECT MIN(checked_at) FROM price_history), now() AT TIME ZONE 'utc')),
+            date_trunc('month', now() AT TIME ZONE 'utc') + INTERVAL '{PREMAKE_MONTHS} months',
+            INTERVAL '1 month'
+        ) AS m
+        """
+    )
+    # Safety net for rows outside the premade range; kept empty by the beat task
+    op.execute("CREATE TABLE price_history_default PARTITION OF price_history_partitioned DEFAULT")
+
+    # Online copy: one committed batch per id range, writers are not blocked
+    with op.get_context().autocommit_block():
+        copy_started = bind.execute(text("SELECT now() AT TIME ZONE 'utc'")).scalar()
+        max_id = bind.execute(text("SELECT COALESCE(MAX(id), 0) FROM price_history")).scalar()
+        for low in range(0, max_id, COPY_BATCH_SIZE):
+            bind.execute(
+                text(
+                    "INSERT INTO price_history_partitioned "
+                    "SELECT * FROM price_history WHERE id > :low AND id <= :high"
+                ),
+                {"low": low, "high": low + COPY_BATCH_SIZE},
+            )
+
+    # Catch-up and swap under a write lock (reads keep working until the rename)
+    op.execute("LOCK TABLE price_history IN SHARE ROW EXCLUSIVE MODE")
+    # Whole-range anti-joins: ids below max_id can commit after their batch
+    # was copied, and cleanup may have deleted or clipped copied rows
+    bind.execute(
+        text(
+            """
+            DELETE FROM price_history_partitioned p
+            WHERE NOT EXISTS (
+                SELECT 1 FROM price_history o
+                WHERE o.id = p.id AND o.checked_at = p.checked_at
+            )
+            """
+        )
+    )
+    bind.execute(
+        text(
+            """
+            INSERT INTO price_history_partitioned
+            SELECT * FROM price_history o
+            WHERE NOT EXISTS (SELECT 1 FROM price_history_partitioned p WHERE p.id = o.id)
+            """
+        )
+    )
+    bind.execute(
+        text(
+            """
+            UPDATE price_history_partitioned p
+            SET last_seen_at = o.last_seen_at
+            FROM price_history o
+            WHERE o.last_seen_at >= :copy_started
+              AND p.id = o.id
+              AND p.checked_at = o.checked_at
+              AND p.last_seen_at <> o.last_seen_at
+            """
+        ),
+        {"copy_started": copy_started},
+    )
+    source_rows = bind.execute(text("SELECT COUNT(*) FROM price_history")).scalar()
+    copied_rows = bind.execute(text("SELECT COUNT(*) FROM price_history_partitioned")).scalar()
+    if copied_rows != source_rows:
+        raise RuntimeError(
+            f"price_history_partitioned has {copied_rows} rows, price_history has {source_rows}; not swapping"
+        )
+
+    op.execute("DROP VIEW IF EXISTS price_observations")
+    op.execute("ALTER TABLE price_history RENAME TO price_history_unpartitioned")
+    op.execute("ALTER TABLE price_history_partitioned RENAME TO price_history")
+    # The id sequence would be dropped with its old owner
+    op.execute("ALTER SEQUENCE price_history_id_seq OWNED BY price_history.id")
+    op.execute("DROP TABLE price_history_unpartitioned")
+    for name, _ in INDEXES:
+        op.execute(f"ALTER INDEX {name}_part RENAME TO {name}")
+    op.execute(PRICE_OBSERVATIONS_VIEW)
+
+
+def downgrade() -> None:
+    op.execute("DROP VIEW IF EXISTS price_observations")
+    op.execute(
+        """
+        CREATE TABLE price_history_unpartitioned (
+            LIKE price_history INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+        )
+        """
+    )
+    op.execute("INSERT INTO price_history_unpartitioned SELECT * FROM price_history")
+    op.execute("ALTER TABLE price_history RENAME TO price_history_partitioned")
+    op.execute("ALTER TABLE price_history_unpartitioned RENAME TO price_history")
+    op.execute("ALTER SEQUENCE price_history_id_seq OWNED BY price_history.id")
+    op.execute("DROP TABLE price_history_partitioned CASCADE")
+
+    op.execute("ALTER TABLE price_history ADD PRIMARY KEY (id)")
+    op.execute(
+        "ALTER TABLE price_history ADD FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE"
+    )
+    op.execute(
+        "ALTER TABLE price_history ADD FOREIGN KEY (source_id) REFERENCES sources(id) ON DELETE CASCADE"
+    )
+    for name, columns in INDEXES:
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON price_history {columns}")
+    op.execute(PRICE_OBSERVATIONS_VIEW)
+    op.execute("DROP FUNCTION IF EXISTS create_price_history_partition(DATE, TEXT)")
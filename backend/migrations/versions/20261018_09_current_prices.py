@@ -0,0 +1,85 @@
+"""latest price per product-source mapping: current_prices
+
+Revision ID: 20261018_09_current_prices
+Revises: 20261018_08_partition_price_history
+Create Date: 2026-10-18
+
+"""
+
+from alembic import op
+
+
+revision = "20261018_09_current_prices"
+down_revision = "20261018_08_partition_price_history"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS current_prices (
+            id SERIAL PRIMARY KEY,
+            product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+            source_id INTEGER NOT NULL REFERENCES sources(id) ON DELETE CASCADE,
+            price NUMERIC(10, 2) NOT NULL,
+            currency VARCHAR,
+            availability BOOLEAN,
+            shipping_cost NUMERIC(10, 2),
+            checked_at TIMESTAMP NOT NULL,
+            previous_price NUMERIC(10, 2),
+            price_changed_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_current_prices_id ON current_prices (id)")
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_current_price_mapping_unique "
+        "ON current_prices (product_id, source_id)"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS idx_current_price_changed ON current_prices (price_changed_at)")
+
+    # Seed from history: newest row per mapping (observed until last_seen_at),
+    # the newest earlier row with a different price and the first row after it
+    op.execute(
+        """
+        INSERT INTO current_prices (
+            product_id, source_id, price, currency, availability, shipping_cost, checked_at,
+            previous_price, price_changed_at, updated_at
+        )
+        SELECT
+            l.product_id, l.source_id, l.price, l.currency, l.availability, l.shipping_cost, l.last_seen_at,
+            prev.price, changed.checked_at,
+            now() AT TIME ZONE 'utc'
+        FROM (
+            SELECT DISTINCT ON (product_id, source_id) *
+            FROM price_history
+            ORDER BY product_id, source_id, checked_at DESC
+        ) l
+        LEFT JOIN LATERAL (
+            SELECT ph.price, ph.checked_at
+            FROM price_history ph
+            WHERE ph.product_id = l.product_id
+              AND ph.source_id = l.source_id
+              AND ph.checked_at < l.checked_at
+              AND ph.price <> l.price
+            ORDER BY ph.checked_at DESC
+            LIMIT 1
+        ) prev ON true
+        LEFT JOIN LATERAL (
+            SELECT ph.checked_at
+            FROM price_history ph
+            WHERE ph.product_id = l.product_id
+              AND ph.source_id = l.source_id
+              AND ph.checked_at > prev.checked_at
+            ORDER BY ph.checked_at
+            LIMIT 1
+        ) changed ON true
+        ON CONFLICT (product_id, source_id) DO NOTHING
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS current_prices")
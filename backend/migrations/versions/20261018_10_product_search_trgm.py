@@ -0,0 +1,49 @@
+"""trigram product search: pg_trgm GIN indexes on normalized name, sku and ean
+
+Revision ID: 20261018_10_product_search_trgm
+Revises: 20261018_09_current_prices
+Create Date: 2026-10-18
+
+"""
+
+from alembic import op
+
+
+revision = "20261018_10_product_search_trgm"
+down_revision = "20261018_09_current_prices"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # Lowercase without Polish diacritics; mirrored by product_search.normalize()
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION product_search_norm(value TEXT) RETURNS TEXT AS $$
+            SELECT lower(translate(value, 'ąćęłńóśźżĄĆĘŁŃÓŚŹŻ', 'acelnoszzacelnoszz'))
+        $$ LANGUAGE SQL IMMUTABLE PARALLEL SAFE
+        """
+    )
+
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_product_name_trgm "
+        "ON products USING gin (product_search_norm(name) gin_trgm_ops)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_product_sku_trgm "
+        "ON products USING gin (product_search_norm(sku) gin_trgm_ops)"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS idx_product_ean_trgm ON products USING gin (ean gin_trgm_ops)")
+
+    # Case-insensitive exact SKU lookups
+    op.execute("CREATE INDEX IF NOT EXISTS idx_product_sku_lower ON products (lower(sku))")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_product_sku_lower")
+    op.execute("DROP INDEX IF EXISTS idx_product_ean_trgm")
+    op.execute("DROP INDEX IF EXISTS idx_product_sku_trgm")
+    op.execute("DROP INDEX IF EXISTS idx_product_name_trgm")
+    op.execute("DROP FUNCTION IF EXISTS product_search_norm(TEXT)")
@@ -0,0 +1,48 @@
+"""split change_only price_history intervals longer than PRICE_MAX_INTERVAL_DAYS
+
+Revision ID: 20261018_11_split_long_price_intervals
+Revises: 20261018_10_product_search_trgm
+Create Date: 2026-10-18
+
+"""
+
+from alembic import op
+import os
+
+
+revision = "20261018_11_split_long_price_intervals"
+down_revision = "20261018_10_product_search_trgm"
+branch_labels = None
+depends_on = None
+
+MAX_INTERVAL = f"{int(os.getenv('PRICE_MAX_INTERVAL_DAYS', 7))} days"
+
+COLUMNS = "product_id, source_id, price, currency, availability, shipping_cost, discount_percentage, stock_quantity"
+
+
+# The result writer no longer extends a row past PRICE_MAX_INTERVAL_DAYS and
+# the daily aggregations only look that far back in checked_at; rows written
+# before that are split into pieces of at most that length
+def upgrade() -> None:
+    op.execute(
+        f"""
+        INSERT INTO price_history ({COLUMNS}, checked_at, last_seen_at)
+        SELECT {COLUMNS}, piece,
+               LEAST(piece + INTERVAL '{MAX_INTERVAL}' - INTERVAL '1 microsecond', last_seen_at)
+        FROM price_history,
+             generate_series(checked_at + INTERVAL '{MAX_INTERVAL}', last_seen_at, INTERVAL '{MAX_INTERVAL}') AS piece
+        WHERE last_seen_at >= checked_at + INTERVAL '{MAX_INTERVAL}'
+        """
+    )
+    op.execute(
+        f"""
+        UPDATE price_history
+        SET last_seen_at = checked_at + INTERVAL '{MAX_INTERVAL}' - INTERVAL '1 microsecond'
+        WHERE last_seen_at >= checked_at + INTERVAL '{MAX_INTERVAL}'
+        """
+    )
+
+
+def downgrade() -> None:
+    # The pieces describe the same validity as the original rows
+    pass